@@ -0,0 +1,155 @@
+# analytics.py
+"""
+Global usage and feedback analytics, read from the rollups table (db.py,
+migration 6). Triggers bump its counters on every message and feedback
+insert (and move them when an intent is relabelled), so a query reads a
+handful of rows by primary key no matter how many messages there are.
+Counters keep counting deleted and archived rows. rebuild() recounts from
+the hot database and the archive (retention.py), dropping the counts of
+deleted sessions, and backfills after a bulk import that bypassed the
+triggers. It holds the write lock while it recounts, so it is run from the
+command line only.
+
+    python analytics.py                  # totals and per-intent counters as JSON
+    python analytics.py --rebuild        # recount the rollups
+"""
+from __future__ import annotations
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import json
+
+import retention
+from db import ROLLUP_BACKFILL, _statements, flush_writes, get_convo, use_database
+
+DIMENSIONS = ("intent", "day", "model", "prompt_version")
+
+@dataclass
+class Rollup:
+    key: str
+    questions: int = 0
+    answers: int = 0
+    upvotes: int = 0
+    downvotes: int = 0
+
+    @property
+    def rated(self) -> int:
+        return self.upvotes + self.downvotes
+
+    @property
+    def approval(self) -> Optional[float]:
+        """Share of rated answers that got a thumbs up."""
+        return self.upvotes / self.rated if self.rated else None
+
+def _select(dim: str, since: Optional[str] = None) -> List[Rollup]:
+    if dim not in DIMENSIONS:
+        raise ValueError(f"Unknown rollup dimension: {dim}")
+    flush_writes()
+    with get_convo() as conn:
+        rows = conn.execute(
+            "SELECT key, questions, answers, upvotes, downvotes FROM rollups "
+            "WHERE dim = ? AND key >= ? ORDER BY key",
+            (dim, since or ""),
+        ).fetchall()
+    return [Rollup(*r) for r in rows]
+
+def by(dim: str) -> List[Rollup]:
+    """Counters for every intent, model or prompt version (use daily() for days)."""
+    return _select(dim)
+
+def daily(days: int = 30, today: Optional[date] = None) -> List[Rollup]:
+    """Counters of the last `days` days (UTC), oldest first; days without messages are left out."""
+    since = (today or datetime.now(timezone.utc).date()) - timedelta(days=days - 1)
+    return _select("day", since.isoformat())
+
+def totals() -> Rollup:
+    """All-time counters (the per-intent rows summed)."""
+    total = Rollup("all")
+    for r in by("intent"):
+        total.questions += r.questions
+        total.answers += r.answers
+        total.upvotes += r.upvotes
+        total.downvotes += r.downvotes
+    return total
+
+def _chunk_counts(chunk: Dict[str, Any]) -> Dict[Tuple[str, str], List[int]]:
+    """[questions, answers, upvotes, downvotes] per (dim, key) of one archived chunk, counted like ROLLUP_BACKFILL."""
+    counts: Dict[Tuple[str, str], List[int]] = {}
+
+    def bump(dim: str, key: Optional[str], column: int, n: int = 1) -> None:
+        if key is not None:
+            counts.setdefault((dim, key), [0, 0, 0, 0])[column] += n
+
+    keys_by_id = {}
+    for msg_id, role, intent, _content, created_at, model, prompt_version in chunk["messages"]:
+        keys = (("intent", intent), ("day", created_at[:10]), ("model", model), ("prompt_version", prompt_version))
+        keys_by_id[msg_id] = keys
+        for dim, key in keys[:2]:
+            bump(dim, key, 0, role == "user")
+            bump(dim, key, 1, role == "assistant")
+        for dim, key in keys[2:]:
+            bump(dim, key, 1)
+    for message_id, rating, _comment, _created_at in chunk["feedback"]:
+        if rating in (1, -1):
+            for dim, key in keys_by_id.get(message_id, ()):
+                bump(dim, key, 2 if rating == 1 else 3)
+    return counts
+
+def rebuild() -> int:
+    """Recount the rollups from messages and feedback, hot and archived; returns the number of rollup rows."""
+    flush_writes()
+    # Decoding the archive is the slow part, so it happens before taking the write lock
+    with get_convo() as conn:
+        names = [r[0] for r in conn.execute("SELECT DISTINCT archive FROM archived_sessions")]
+    decoded = {
+        (name, session_id, first_id): _chunk_counts(chunk)
+        for name in names
+        for session_id, first_id, chunk in retention.read_archive(name)
+    }
+    with get_convo() as conn:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM rollups")
+            for stmt in _statements(ROLLUP_BACKFILL):
+                conn.execute(stmt)
+            # Only the chunks indexed now: one archived since the pass above is decoded here,
+            # and one written out but still in the hot rows is counted from those
+            archived: Dict[Tuple[str, str], List[int]] = {}
+            for name, session_id, first_id in conn.execute(
+                "SELECT archive, session_id, first_id FROM archived_sessions"
+            ).fetchall():
+                counts = decoded.get((name, session_id, first_id))
+                if counts is None:
+                    counts = _chunk_counts(retention._load_chunk(name, session_id, first_id))
+                for dim_key, values in counts.items():
+                    total = archived.setdefault(dim_key, [0, 0, 0, 0])
+                    for i, n in enumerate(values):
+                        total[i] += n
+            conn.executemany(
+                "INSERT INTO rollups (dim, key, questions, answers, upvotes, downvotes) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (dim, key) DO UPDATE SET "
+                "questions = questions + excluded.questions, answers = answers + excluded.answers, "
+                "upvotes = upvotes + excluded.upvotes, downvotes = downvotes + excluded.downvotes",
+                [(dim, key, *values) for (dim, key), values in archived.items()],
+            )
+            count = conn.execute("SELECT COUNT(*) FROM rollups").fetchone()[0]
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+    return count
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", type=Path, help="database file (default: db.DB_PATH)")
+    ap.add_argument("--rebuild", action="store_true", help="recount the rollups from messages, feedback and the archive")
+    args = ap.parse_args()
+    if args.db:
+        use_database(args.db)
+    if args.rebuild:
+        print(f"rebuilt {rebuild()} rollup rows")
+    else:
+        print(json.dumps({"totals": asdict(totals()), "by_intent": [asdict(r) for r in by("intent")]}, indent=2))
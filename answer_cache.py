@@ -0,0 +1,237 @@
+# answer_cache.py
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Set
+import atexit
+import os
+import re
+import sqlite3
+import time
+
+from db import DB_PATH, ConnectionPool
+from intents import _normalize
+
+CACHE_PATH = DB_PATH.with_name("answer_cache.db")
+
+ENABLED = os.getenv("CAREERGUIDE_ANSWER_CACHE", "on") != "off"
+TTL_S = float(os.getenv("CAREERGUIDE_ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+CAPACITY = int(os.getenv("CAREERGUIDE_ANSWER_CACHE_SIZE", "2000"))
+# Character-trigram Jaccard similarity for the near-duplicate tier; 0 turns it off
+NEAR_THRESHOLD = float(os.getenv("CAREERGUIDE_ANSWER_CACHE_NEAR", "0.85"))
+NEAR_CANDIDATES = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answer_cache (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  intent TEXT NOT NULL,
+  query_norm TEXT NOT NULL,
+  temp_bucket REAL NOT NULL,
+  max_tokens INTEGER NOT NULL,
+  answer TEXT NOT NULL,
+  gen_ms REAL NOT NULL DEFAULT 0,     -- what generating the answer cost
+  hits INTEGER NOT NULL DEFAULT 0,
+  created_at REAL NOT NULL,
+  last_used_at REAL NOT NULL,
+  UNIQUE (intent, query_norm, temp_bucket, max_tokens)
+);
+CREATE INDEX IF NOT EXISTS idx_answer_cache_lru ON answer_cache (last_used_at);
+
+CREATE TABLE IF NOT EXISTS answer_cache_messages (
+  message_id INTEGER PRIMARY KEY,     -- assistant message served from the entry
+  entry_id INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS answer_cache_stats (
+  name TEXT PRIMARY KEY,
+  value REAL NOT NULL
+);
+"""
+
+# Grammar-shaped (structured) and free-form answers to the same question differ,
+# so they get separate entries. Which mode produced an older entry is unknown,
+# and a cache can simply start over, so they are dropped rather than guessed.
+STRUCTURED_KEY = """
+DROP TABLE IF EXISTS answer_cache;
+DELETE FROM answer_cache_messages;
+CREATE TABLE answer_cache (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  intent TEXT NOT NULL,
+  query_norm TEXT NOT NULL,
+  temp_bucket REAL NOT NULL,
+  max_tokens INTEGER NOT NULL,
+  structured INTEGER NOT NULL,        -- 1 if generated under the answer grammar
+  answer TEXT NOT NULL,
+  gen_ms REAL NOT NULL DEFAULT 0,     -- what generating the answer cost
+  hits INTEGER NOT NULL DEFAULT 0,
+  created_at REAL NOT NULL,
+  last_used_at REAL NOT NULL,
+  UNIQUE (intent, query_norm, temp_bucket, max_tokens, structured)
+);
+CREATE INDEX IF NOT EXISTS idx_answer_cache_lru ON answer_cache (last_used_at);
+"""
+
+# Which model generated the answer, so a cache hit is credited to it
+ANSWER_MODEL = """
+ALTER TABLE answer_cache ADD COLUMN model TEXT;
+"""
+
+_pool = ConnectionPool(CACHE_PATH, [(1, SCHEMA), (2, STRUCTURED_KEY), (3, ANSWER_MODEL)])
+atexit.register(_pool.close_all)
+
+@dataclass
+class CachedAnswer:
+    entry_id: int
+    answer: str
+    kind: str              # 'exact' | 'near'
+    similarity: float
+    saved_ms: float
+    model: Optional[str] = None     # file name of the model that generated it
+
+def _temp_bucket(temperature: float) -> float:
+    return round(temperature, 1)
+
+def _trigrams(text: str) -> Set[str]:
+    t = f"  {text} "
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+def _numbers(text: str) -> Set[str]:
+    return set(re.findall(r"\d+", text))
+
+def _similarity(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def _bump(conn: sqlite3.Connection, name: str, value: float = 1.0) -> None:
+    conn.execute(
+        "INSERT INTO answer_cache_stats (name, value) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+        (name, value),
+    )
+
+def lookup(intent: str, query: str, temperature: float, max_tokens: int, structured: bool = False) -> Optional[CachedAnswer]:
+    """Exact match on the normalized query first, then the closest near-duplicate."""
+    if not ENABLED:
+        return None
+    q = _normalize(query)
+    bucket = _temp_bucket(temperature)
+    now = time.time()
+    with _pool.connection() as conn:
+        row = conn.execute(
+            "SELECT id, answer, gen_ms, model FROM answer_cache "
+            "WHERE intent = ? AND query_norm = ? AND temp_bucket = ? AND max_tokens = ? AND structured = ? "
+            "AND created_at > ?",
+            (intent, q, bucket, max_tokens, int(structured), now - TTL_S),
+        ).fetchone()
+        hit = None
+        if row:
+            hit = CachedAnswer(row[0], row[1], "exact", 1.0, row[2], row[3])
+        elif NEAR_THRESHOLD > 0:
+            wanted = _trigrams(q)
+            # "12-week" and "6-week" plans look alike as trigrams but aren't the same question
+            wanted_numbers = _numbers(q)
+            best = None
+            for entry_id, cand, answer, gen_ms, model in conn.execute(
+                "SELECT id, query_norm, answer, gen_ms, model FROM answer_cache "
+                "WHERE intent = ? AND temp_bucket = ? AND max_tokens = ? AND structured = ? AND created_at > ? "
+                "ORDER BY last_used_at DESC LIMIT ?",
+                (intent, bucket, max_tokens, int(structured), now - TTL_S, NEAR_CANDIDATES),
+            ):
+                if _numbers(cand) != wanted_numbers:
+                    continue
+                sim = _similarity(wanted, _trigrams(cand))
+                if sim >= NEAR_THRESHOLD and (best is None or sim > best.similarity):
+                    best = CachedAnswer(entry_id, answer, "near", sim, gen_ms, model)
+            hit = best
+
+        if hit is None:
+            _bump(conn, "misses")
+        else:
+            conn.execute(
+                "UPDATE answer_cache SET hits = hits + 1, last_used_at = ? WHERE id = ?",
+                (now, hit.entry_id),
+            )
+            _bump(conn, f"{hit.kind}_hits")
+            _bump(conn, "saved_ms", hit.saved_ms)
+        conn.commit()
+        return hit
+
+def store(
+    intent: str,
+    query: str,
+    temperature: float,
+    max_tokens: int,
+    answer: str,
+    gen_s: float,
+    structured: bool = False,
+    model: Optional[str] = None,
+) -> Optional[int]:
+    """Remember a freshly generated answer; returns the cache entry id."""
+    if not ENABLED or not answer:
+        return None
+    now = time.time()
+    with _pool.connection() as conn:
+        cur = conn.execute(
+            "INSERT INTO answer_cache "
+            "(intent, query_norm, temp_bucket, max_tokens, structured, answer, gen_ms, model, created_at, last_used_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(intent, query_norm, temp_bucket, max_tokens, structured) DO UPDATE SET "
+            "answer = excluded.answer, gen_ms = excluded.gen_ms, model = excluded.model, hits = 0, "
+            "created_at = excluded.created_at, last_used_at = excluded.last_used_at "
+            "RETURNING id",
+            (
+                intent, _normalize(query), _temp_bucket(temperature), max_tokens, int(structured),
+                answer, gen_s * 1000.0, model, now, now,
+            ),
+        )
+        entry_id = cur.fetchone()[0]
+        _evict(conn, now)
+        conn.commit()
+        return entry_id
+
+def link_message(entry_id: Optional[int], message_id: int) -> None:
+    """Record that `message_id` showed the entry, so feedback on it can reach the cache."""
+    if entry_id is None:
+        return
+    with _pool.connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO answer_cache_messages (message_id, entry_id) VALUES (?, ?)",
+            (message_id, entry_id),
+        )
+        conn.commit()
+
+def invalidate_message(message_id: int) -> None:
+    """Drop the cache entry behind an answer that got negative feedback."""
+    with _pool.connection() as conn:
+        row = conn.execute(
+            "SELECT entry_id FROM answer_cache_messages WHERE message_id = ?", (message_id,)
+        ).fetchone()
+        if row:
+            conn.execute("DELETE FROM answer_cache WHERE id = ?", (row[0],))
+            conn.execute("DELETE FROM answer_cache_messages WHERE entry_id = ?", (row[0],))
+            _bump(conn, "invalidations")
+            conn.commit()
+
+def _evict(conn: sqlite3.Connection, now: float) -> None:
+    conn.execute("DELETE FROM answer_cache WHERE created_at <= ?", (now - TTL_S,))
+    conn.execute(
+        "DELETE FROM answer_cache WHERE id IN ("
+        "SELECT id FROM answer_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+        (CAPACITY,),
+    )
+    conn.execute("DELETE FROM answer_cache_messages WHERE entry_id NOT IN (SELECT id FROM answer_cache)")
+
+def stats() -> Dict[str, Any]:
+    with _pool.connection() as conn:
+        counters = dict(conn.execute("SELECT name, value FROM answer_cache_stats").fetchall())
+        hits = counters.get("exact_hits", 0) + counters.get("near_hits", 0)
+        lookups = hits + counters.get("misses", 0)
+        return {
+            "entries": conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0],
+            "exact_hits": int(counters.get("exact_hits", 0)),
+            "near_hits": int(counters.get("near_hits", 0)),
+            "misses": int(counters.get("misses", 0)),
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "saved_s": counters.get("saved_ms", 0.0) / 1000.0,
+            "invalidations": int(counters.get("invalidations", 0)),
+        }
@@ -0,0 +1,328 @@
+# api.py
+"""
+HTTP API over the service layer (service.py), on Tornado (already installed
+with Streamlit). Model and SQLite calls block, so they run on a thread pool
+and the event loop only moves bytes; a streamed answer is pushed to the
+client as Server-Sent Events while it is generated, and a client that hangs
+up cancels its generation at the next token.
+
+    python api.py --port 8000
+
+    POST /v1/ask                          {"query", "session_id"?, "temperature"?, "max_tokens"?, "structured"?, "stream"?}
+    GET  /v1/sessions/<session_id>/history?limit=20&before=<id>
+    GET  /v1/sessions/<session_id>/search?q=...&intent=&limit=20
+    POST /v1/feedback                     {"message_id", "rating": 1 | -1, "comment"?}
+    GET  /v1/health
+    GET  /metrics                         Prometheus text format (tracing.py)
+
+With "stream": true (or Accept: text/event-stream) /v1/ask answers with the
+events meta (session, intent, cache hit), delta (text), reset (drop the text
+so far, a retry follows), done (message id, stats) and error.
+
+History pages come newest page first, each oldest first; pass a page's
+"next_before" as ?before= to get the one before it (null: no more).
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+_import_started = time.perf_counter()
+import tornado.ioloop
+import tornado.web
+from tornado.iostream import StreamClosedError
+
+import answer_cache
+import model
+import service
+import tracing
+from db import SNIPPET_CLOSE, SNIPPET_OPEN, search_messages
+from inference import PoolBusy
+from model import GenerationStats
+from retention import get_history_page
+
+# Threads for blocking calls; a streamed answer holds one for its whole generation
+API_THREADS = int(os.getenv("CAREERGUIDE_API_THREADS", "16"))
+MAX_HISTORY = 200
+MAX_SEARCH_HITS = 100
+# The ranges the app's sliders allow
+TEMPERATURE_RANGE = (0.0, 1.0)
+MAX_TOKENS_RANGE = (128, 1024)
+RETRY_AFTER_S = 2
+
+log = logging.getLogger("careerguide.api")
+
+_executor = ThreadPoolExecutor(max_workers=API_THREADS, thread_name_prefix="api")
+
+def _stats_dict(stats: GenerationStats) -> Dict[str, Any]:
+    return {
+        "queue_wait_s": round(stats.queue_wait_s, 4),
+        "ttft_s": round(stats.ttft_s, 4) if stats.ttft_s is not None else None,
+        "gen_s": round(stats.gen_s, 4),
+        "completion_tokens": stats.completion_tokens,
+        "tokens_per_s": round(stats.tokens_per_s, 1),
+    }
+
+def _answer(q: service.Question, stats: GenerationStats, cancel: threading.Event, emit: Callable[[str, Any], None]) -> None:
+    """
+    Runs on a pool thread: generate the answer to `q`, emitting ("delta", text),
+    ("reset", None), then ("done", message_id) or ("error", exception).
+    """
+    try:
+        if q.cached:
+            emit("delta", q.cached.answer)
+            emit("done", service.save_answer(q, q.cached.answer))
+            return
+        parts = []
+        for piece in service.generate(q, stats, cancel):
+            if piece is None:
+                parts = []
+                emit("reset", None)
+            else:
+                parts.append(piece)
+                emit("delta", piece)
+        if cancel.is_set():
+            emit("error", asyncio.CancelledError())
+            return
+        answer = "".join(parts).strip()
+        if not answer:
+            raise RuntimeError("The model returned an empty answer")
+        emit("done", service.save_answer(q, answer, stats))
+    except Exception as e:
+        emit("error", e)
+
+def _error_status(e: BaseException) -> Tuple[int, str]:
+    if isinstance(e, PoolBusy):
+        return 503, "The model is busy; retry shortly"
+    if isinstance(e, TimeoutError):
+        return 504, "The answer took too long and was stopped"
+    if isinstance(e, asyncio.CancelledError):
+        return 499, "Cancelled"
+    return 500, f"Generation failed: {e}"
+
+class BaseHandler(tornado.web.RequestHandler):
+    def set_default_headers(self) -> None:
+        self.set_header("Content-Type", "application/json; charset=utf-8")
+
+    def json_body(self) -> Dict[str, Any]:
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="Body is not valid JSON")
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, reason="Body must be a JSON object")
+        return body
+
+    def int_argument(self, name: str, default: int, maximum: int) -> int:
+        """Query argument `name` as an int clamped to 1..maximum."""
+        try:
+            return min(maximum, max(1, int(self.get_argument(name, str(default)))))
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason=f"{name} must be an integer")
+
+    def blocking(self, fn: Callable, *args: Any) -> "asyncio.Future":
+        return tornado.ioloop.IOLoop.current().run_in_executor(_executor, fn, *args)
+
+    def write_error(self, status_code: int, **kwargs: Any) -> None:
+        self.finish({"error": self._reason})
+
+class AskHandler(BaseHandler):
+    cancel: threading.Event
+
+    def initialize(self) -> None:
+        self.cancel = threading.Event()
+
+    def on_connection_close(self) -> None:
+        self.cancel.set()
+
+    async def post(self) -> None:
+        body = self.json_body()
+        query = str(body.get("query") or "").strip()
+        if not query:
+            raise tornado.web.HTTPError(400, reason="query is required")
+        try:
+            temperature = float(body.get("temperature", 0.3))
+            max_tokens = int(body.get("max_tokens", 512))
+        except (TypeError, ValueError):
+            raise tornado.web.HTTPError(400, reason="temperature and max_tokens must be numbers")
+        temperature = min(TEMPERATURE_RANGE[1], max(TEMPERATURE_RANGE[0], temperature))
+        max_tokens = min(MAX_TOKENS_RANGE[1], max(MAX_TOKENS_RANGE[0], max_tokens))
+        session_id = str(body.get("session_id") or uuid.uuid4().hex)
+        structured = bool(body.get("structured", False))
+        stream = bool(body.get("stream", "text/event-stream" in self.request.headers.get("Accept", "")))
+
+        q = await self.blocking(service.prepare, session_id, query, temperature, max_tokens, structured)
+        stats = GenerationStats()
+        events: "asyncio.Queue[Tuple[str, Any]]" = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+
+        def emit(kind: str, value: Any) -> None:
+            loop.call_soon_threadsafe(events.put_nowait, (kind, value))
+
+        self.blocking(_answer, q, stats, self.cancel, emit)
+        meta = {"session_id": session_id, "message_id": q.message_id, "intent": q.intent, "cached": bool(q.cached)}
+        if stream:
+            await self._stream(events, meta, stats)
+        else:
+            await self._collect(events, meta, stats)
+
+    async def _collect(self, events: "asyncio.Queue[Tuple[str, Any]]", meta: Dict[str, Any], stats: GenerationStats) -> None:
+        parts = []
+        while True:
+            kind, value = await events.get()
+            if kind == "delta":
+                parts.append(value)
+            elif kind == "reset":
+                parts = []
+            elif kind == "error":
+                self._fail(value)
+                return
+            else:
+                self.finish({
+                    **meta, "answer": "".join(parts).strip(), "answer_id": value, "stats": _stats_dict(stats),
+                })
+                return
+
+    async def _stream(self, events: "asyncio.Queue[Tuple[str, Any]]", meta: Dict[str, Any], stats: GenerationStats) -> None:
+        # Hold the headers back until the first event, so a full queue is still a plain 503
+        kind, value = await events.get()
+        if kind == "error":
+            self._fail(value)
+            return
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        self.set_header("X-Accel-Buffering", "no")
+        try:
+            await self._send("meta", meta)
+            while True:
+                if kind == "delta":
+                    await self._send("delta", {"text": value})
+                elif kind == "reset":
+                    await self._send("reset", {})
+                elif kind == "error":
+                    status, message = _error_status(value)
+                    await self._send("error", {"status": status, "error": message})
+                    break
+                else:
+                    await self._send("done", {"answer_id": value, "stats": _stats_dict(stats)})
+                    break
+                kind, value = await events.get()
+        except StreamClosedError:
+            self.cancel.set()
+            return
+        self.finish()
+
+    async def _send(self, event: str, data: Dict[str, Any]) -> None:
+        self.write(f"event: {event}\ndata: {json.dumps(data)}\n\n")
+        await self.flush()
+
+    def _fail(self, e: BaseException) -> None:
+        status, message = _error_status(e)
+        if status == 499:
+            return  # nobody is listening
+        if status == 500:
+            log.error("ask failed", exc_info=e)
+        if status == 503:
+            self.set_header("Retry-After", str(RETRY_AFTER_S))
+        self.set_status(status)
+        self.finish({"error": message})
+
+class HistoryHandler(BaseHandler):
+    async def get(self, session_id: str) -> None:
+        limit = self.int_argument("limit", 20, MAX_HISTORY)
+        before = self.get_argument("before", None)
+        try:
+            before_id = int(before) if before is not None else None
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="before must be a message id")
+        rows, next_before = await self.blocking(get_history_page, session_id, before_id, limit)
+        self.finish({
+            "session_id": session_id,
+            "messages": [
+                {"id": msg_id, "role": role, "intent": intent, "content": content, "created_at": created_at}
+                for msg_id, role, intent, content, created_at in rows
+            ],
+            "next_before": next_before,
+        })
+
+class SearchHandler(BaseHandler):
+    async def get(self, session_id: str) -> None:
+        query = self.get_argument("q", "")
+        if not query.strip():
+            raise tornado.web.HTTPError(400, reason="q is required")
+        limit = self.int_argument("limit", 20, MAX_SEARCH_HITS)
+        intent = self.get_argument("intent", None) or None
+        hits = await self.blocking(search_messages, query, intent, session_id, limit)
+        for hit in hits:
+            # Plain brackets instead of the control characters db.py marks matches with
+            hit["snippet"] = hit["snippet"].replace(SNIPPET_OPEN, "[").replace(SNIPPET_CLOSE, "]")
+        self.finish({"session_id": session_id, "query": query, "hits": hits})
+
+class FeedbackHandler(BaseHandler):
+    async def post(self) -> None:
+        body = self.json_body()
+        try:
+            message_id = int(body["message_id"])
+            rating = int(body["rating"])
+        except (KeyError, TypeError, ValueError):
+            raise tornado.web.HTTPError(400, reason="message_id and rating are required")
+        if rating not in (1, -1):
+            raise tornado.web.HTTPError(400, reason="rating must be 1 or -1")
+        comment: Optional[str] = body.get("comment")
+        await self.blocking(service.feedback, message_id, rating, comment)
+        self.set_status(204)
+        self.finish()
+
+class HealthHandler(BaseHandler):
+    async def get(self) -> None:
+        # answer_cache.stats() reads SQLite, so it goes to the pool like the other queries
+        answers = await self.blocking(answer_cache.stats)
+        self.finish({
+            "status": "ok",
+            "pool": model.pool_stats(),
+            "prompt_cache": model.prompt_cache_stats(),
+            "answer_cache": answers,
+        })
+
+class MetricsHandler(BaseHandler):
+    def get(self) -> None:
+        pool = model.pool_stats()
+        gauges = {key: pool[key] for key in ("queue_depth", "busy_workers", "workers")}
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.finish(tracing.prometheus_text(gauges))
+
+def make_app() -> tornado.web.Application:
+    return tornado.web.Application([
+        (r"/v1/ask", AskHandler),
+        (r"/v1/sessions/([^/]+)/history", HistoryHandler),
+        (r"/v1/sessions/([^/]+)/search", SearchHandler),
+        (r"/v1/feedback", FeedbackHandler),
+        (r"/v1/health", HealthHandler),
+        (r"/metrics", MetricsHandler),
+    ])
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--address", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8000)
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    import model_manager
+    import retention
+    model_manager.note_import_time(time.perf_counter() - _import_started)
+    model_manager.startup()
+    retention.start()
+    make_app().listen(args.port, args.address)
+    log.info("listening on http://%s:%d", args.address, args.port)
+    tornado.ioloop.IOLoop.current().start()
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,70 @@
 # app.py
+import logging
+import os
+import time
+
 import streamlit as st
-import pandas as pd
 
-from utils import get_session_id, inject_css
-from intents import find_intent, make_system_preamble, INTENT_DEFS
-from db import add_message, get_history, add_feedback
-from model import chat
-from ui import load_styles, show_bg, page_header, chat_bubble
+_import_started = time.perf_counter()
+from utils import get_session_id, RerunTimer
+from intents import INTENT_DEFS, INTENT_EXAMPLES
+from db import search_messages
+from model import GenerationStats, pool_stats
+from structured import STRUCTURED
+import generation_jobs
+import model_manager
+import retention
+import service
+import session_history
+from ui import load_styles, show_bg, page_header, chat_bubble, search_hit
+model_manager.note_import_time(time.perf_counter() - _import_started)
+
+# Show the per-phase server time of every rerun under the page
+SHOW_RERUN_TIMINGS = os.getenv("CAREERGUIDE_RERUN_TIMINGS", "off") == "on"
+log = logging.getLogger("careerguide.app")
 
 st.set_page_config(page_title="CareerGuideAI", page_icon="👾", layout="centered")
+timer = RerunTimer()
 
-inject_css()
 load_styles()
 show_bg()
-page_header()
+model_manager.startup()
+retention.start()
+
+# Poll the model line until the preloaded model is ready (or failed), then stop
+_model_pending = not (model_manager.ready() or model_manager.status()["error"])
+
+@st.fragment(run_every=1.0 if _model_pending else None)
+def model_header() -> None:
+    status = model_manager.status()
+    page_header(status)
+    if _model_pending and (status["ready"] or status["error"]):
+        st.rerun()
+
+model_header()
+
+with st.expander("Model"):
+    available = model_manager.list_models()
+    if available:
+        names = [m.name for m in available]
+        active_name = model_manager.status()["active"]["name"]
+        picked = st.selectbox(
+            "Local models",
+            names,
+            index=names.index(active_name) if active_name in names else 0,
+            format_func=lambda n: next(f"{m.name} ({m.size_mb:.0f} MB)" for m in available if m.name == n),
+        )
+        if st.button("Load model", disabled=picked == active_name):
+            model_manager.activate(available[names.index(picked)].path)
+            st.toast(f"Loading {picked} in the background; answers keep using {active_name} until it is ready.")
+    else:
+        st.caption("No .gguf files in models/.")
+    startup = model_manager.status()["startup"]
+    if startup:
+        st.caption(" · ".join(f"{k.removesuffix('_s').replace('_', ' ')} {v:.2f}s" for k, v in startup.items() if v is not None))
 
 session_id = get_session_id()
 
-intent_examples = {
-    "Skills For Role": "What skills are required for a junior data analyst?",
-    "Popular Roles": "What are the most in-demand roles in data analytics right now?",
-    "Resume Help": "Improve my resume summary for an entry-level data analyst.",
-    "Learning Path": "Give me a 12-week roadmap to become a data analyst.",
-    "Interview Prep": "What topics should I prepare for a data analyst interview?",
-    "Career Switch": "I am a teacher moving into data analysis—what’s my transition plan?",
-    "General Guidance": "How do I pick between data analytics, data science, and BI?",
-}
 intent_labels = [i.name.replace("_", " ").title() for i in INTENT_DEFS]
 
 default_intent = "General Guidance"
@@ -40,6 +79,10 @@ with left_col:
     st.markdown("<h4>Response Style</h4>", unsafe_allow_html=True)
     temperature = st.slider("Creativity (temperature)", 0.0, 1.0, 0.30, 0.05, key="temperature")
     max_tokens = st.slider("Max tokens", 128, 1024, 512, 64, key="max_tokens")
+    structured = st.toggle(
+        "Structured answers", value=STRUCTURED, key="structured",
+        help="Constrain answers to a summary, 4–8 bullets and an optional question.",
+    )
     st.markdown('</div>', unsafe_allow_html=True)
 
 with right_col:
@@ -57,7 +100,7 @@ with right_col:
     )
     if chosen_intent != current_intent:
         st.session_state.selected_intent = chosen_intent
-        st.session_state.user_query = intent_examples.get(chosen_intent, "")
+        st.session_state.user_query = INTENT_EXAMPLES.get(chosen_intent, "")
 
     st.markdown('<p class="muted" style="margin-top:6px">Tip: select a pill to prefill the box, then edit your exact question.</p>', unsafe_allow_html=True)
     st.markdown('</div>', unsafe_allow_html=True)
@@ -82,66 +125,165 @@ st.markdown('</div>', unsafe_allow_html=True)
 status_area = st.empty()
 top_answer_container = st.container()
 
-history_rows = get_history(session_id, limit=20)
-history_sorted = sorted(history_rows, key=lambda r: r[0], reverse=True)
+timer.mark("widgets")
 
-if submit and user_query.strip():
-    intent_name = find_intent(user_query)
-    system_preamble = make_system_preamble(intent_name, user_query)
-    add_message(session_id, "user", intent_name, user_query)
-
-    compact_history = []
-    for _id, role, _intent, content, _ts in sorted(history_rows[-4:], key=lambda r: r[0]):
-        compact_history.append({"role": role, "content": content})
-
-    with open("prompts/system_prompt.txt", "r", encoding="utf-8") as f:
-        base_system = f.read()
-
-    system_prompt = base_system
-    composed_user_prompt = (
-        f"{system_preamble}\n\n"
-        f"User question: {user_query}\n"
-        f"Answer directly. Start with a 1–2 line summary, then 4–8 compact bullets, "
-        f"and end with one clarifying question only if needed."
+# A snapshot: the messages added below must not show up in this run's prompt history
+history_rows = list(session_history.rows(session_id))
+# Newest first for display; the rows come in id order, so reversing is enough
+history_newest = history_rows[::-1]
+answered_now = False
+timer.mark("history")
+
+def _stats_note(gen_stats: GenerationStats) -> str:
+    ttft = f"{gen_stats.ttft_s:.1f}s" if gen_stats.ttft_s is not None else "n/a"
+    echo_note = f" · {gen_stats.echo_discarded_tokens} echoed tokens dropped" if gen_stats.echo_fallback else ""
+    return (
+        f"First token {ttft} · {gen_stats.completion_tokens} tokens "
+        f"· {gen_stats.tokens_per_s:.1f} tok/s{echo_note}"
     )
 
-    with status_area.status("Thinking locally…", expanded=False) as s:
-        answer_text = chat(
-            system_prompt=system_prompt,
-            user_prompt=composed_user_prompt,
-            history=compact_history,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
-        s.update(label="Done", state="complete", expanded=False)
+def _collect(job: generation_jobs.GenerationJob) -> None:
+    """Take a finished job's result into this session's state, once."""
+    if st.session_state.get("collected_job") == job.job_id:
+        return
+    st.session_state.collected_job = job.job_id
+    if job.state == "done":
+        session_history.append(session_id, job.assistant_id, "assistant", job.intent, job.text)
+        st.session_state.last_assistant_id = job.assistant_id
+        st.session_state.last_gen_stats = job.stats
+        st.session_state.answer_note = (job.assistant_id, _stats_note(job.stats))
+    elif job.state == "cancelled":
+        st.session_state.job_message = ("info", "Generation stopped.")
+    else:
+        st.session_state.job_message = ("error", job.error)
+
+@st.fragment(run_every=0.5)
+def live_answer() -> None:
+    """Polls the session's generation job; the whole page reruns once it finishes."""
+    job = generation_jobs.current(session_id)
+    if job is None:
+        return
+    if not job.running:
+        _collect(job)
+        st.rerun()
+    if job.cancel_event.is_set():
+        st.caption("Stopping…")
+    elif not job.text:
+        st.caption("Waiting for a free model worker…" if job.stats.ttft_s is None and pool_stats()["queue_depth"] else "Thinking locally…")
+    if job.text:
+        chat_bubble(None, "assistant", job.intent, job.text, "typing…")
+    if st.button("Cancel", key=f"cancel_{job.job_id}", disabled=job.cancel_event.is_set()):
+        job.cancel()
 
-    assistant_id = add_message(session_id, "assistant", intent_name, answer_text)
+if submit and user_query.strip():
+    question = service.prepare(session_id, user_query, temperature, max_tokens, structured, history_rows)
+    session_history.append(session_id, question.message_id, "user", question.intent, user_query)
+    cached = question.cached
+    if cached:
+        # A new question supersedes whatever is still generating; its result is dropped
+        if generation_jobs.cancel(session_id):
+            st.session_state.collected_job = generation_jobs.current(session_id).job_id
+        status_area.status(f"Answered from cache ({cached.kind} match)", state="complete", expanded=False)
+        assistant_id = service.save_answer(question, cached.answer)
+        session_history.append(session_id, assistant_id, "assistant", question.intent, cached.answer)
+        st.session_state.last_assistant_id = assistant_id
+        answered_now = True
+        with top_answer_container:
+            chat_bubble(assistant_id, "assistant", question.intent, cached.answer, "just now")
+            st.markdown(
+                f'<p class="muted">Served from cache · saved ~{cached.saved_ms / 1000:.1f}s of generation</p>',
+                unsafe_allow_html=True,
+            )
+    else:
+        generation_jobs.start(question)
+
+job = generation_jobs.current(session_id)
+if job is not None and st.session_state.get("collected_job") != job.job_id and not answered_now:
+    if job.running:
+        with top_answer_container:
+            live_answer()
+        answered_now = True
+    else:
+        # Finished between two polls: take the answer and render the page with it
+        _collect(job)
+        st.rerun()
+
+job_message = st.session_state.pop("job_message", None)
+if job_message:
+    kind, text = job_message
+    (status_area.error if kind == "error" else status_area.info)(text)
+
+timer.mark("answer")
+
+# On other reruns (e.g. a feedback click) keep the latest answer on top, next to its feedback row
+if not answered_now and history_newest and history_newest[0][1] == "assistant":
     with top_answer_container:
-        chat_bubble(assistant_id, "assistant", intent_name, answer_text, "just now")
+        chat_bubble(*history_newest[0])
+        note = st.session_state.get("answer_note")
+        if note and note[0] == history_newest[0][0]:
+            st.markdown(f'<p class="muted">{note[1]}</p>', unsafe_allow_html=True)
+    history_newest = history_newest[1:]
 
+# Feedback buttons trigger their own rerun, so render them for the latest answer on every run
+assistant_id = st.session_state.get("last_assistant_id")
+if assistant_id is not None:
     st.markdown('<div class="feedback-row">', unsafe_allow_html=True)
     fb_col1, fb_col2, fb_col3 = st.columns([1, 1, 6])
     with fb_col1:
         if st.button("Helpful", key=f"up_{assistant_id}"):
-            add_feedback(assistant_id, +1, None)
+            service.feedback(assistant_id, +1)
             st.success("Thanks for the feedback!")
     with fb_col2:
         if st.button("Not great", key=f"down_{assistant_id}"):
-            add_feedback(assistant_id, -1, None)
+            service.feedback(assistant_id, -1)
             st.info("Feedback noted.")
     with fb_col3:
         feedback_note = st.text_input("Optional comment about this answer", key=f"c_{assistant_id}")
         if st.button("Save comment", key=f"cs_{assistant_id}"):
-            add_feedback(assistant_id, 0, feedback_note or "")
+            service.feedback(assistant_id, 0, feedback_note or "")
             st.success("Comment saved.")
     st.markdown('</div>', unsafe_allow_html=True)
 
-if history_sorted:
+older_rows = session_history.older(session_id)
+if history_newest or older_rows:
     st.markdown("#### Conversation")
-    latest_assistant_id = None
-    if history_sorted and history_sorted[0][1] == "assistant":
-        latest_assistant_id = history_sorted[0][0]
-    for msg_id, role, intent_name, text, created_at in history_sorted:
-        if latest_assistant_id is not None and msg_id == latest_assistant_id:
-            continue
+    if st.button("Clear conversation", key="clear_history"):
+        session_history.clear(session_id)
+        st.session_state.pop("last_assistant_id", None)
+        st.rerun()
+    for msg_id, role, intent_name, text, created_at in history_newest:
+        chat_bubble(msg_id, role, intent_name, text, created_at)
+    for msg_id, role, intent_name, text, created_at in reversed(older_rows):
         chat_bubble(msg_id, role, intent_name, text, created_at)
+    if session_history.has_older(session_id):
+        # The callback runs before the rerun the click starts, so the new page shows in that same run
+        st.button("Load older messages", key="load_older", on_click=session_history.load_older, args=(session_id,))
+
+timer.mark("conversation")
+
+# The whole conversation, not just the turns loaded above; other sessions stay private
+with st.expander("Search this conversation"):
+    search_col, intent_col = st.columns([3, 2])
+    search_query = search_col.text_input("Search", key="search_query", placeholder="e.g., salary negotiation")
+    search_intent = intent_col.selectbox(
+        "Intent", [None] + [i.name for i in INTENT_DEFS], key="search_intent",
+        format_func=lambda n: "All intents" if n is None else n.replace("_", " ").title(),
+    )
+    if search_query.strip():
+        hits = search_messages(search_query, intent=search_intent, session_id=session_id)
+        if not hits:
+            st.caption("No matching messages.")
+        for hit in hits:
+            search_hit(hit)
+
+timer.mark("search")
+recent = timer.record()
+phases = " · ".join(f"{name} {ms:.1f}" for name, ms in timer.phases.items())
+log.debug("rerun %.1f ms (%s)", timer.total_ms, phases)
+if SHOW_RERUN_TIMINGS:
+    median = sorted(recent)[len(recent) // 2]
+    st.markdown(
+        f'<p class="muted">Server time this run {timer.total_ms:.1f} ms ({phases}) '
+        f'· median of last {len(recent)}: {median:.1f} ms</p>',
+        unsafe_allow_html=True,
+    )
@@ -0,0 +1,116 @@
+"""
+Concurrent-session microbenchmark for db.py.
+
+Each simulated session runs on its own thread and alternates the calls a
+Streamlit rerun makes: add_message (user + assistant) and get_history.
+Run from the repo root:
+
+    python -m benchmarks.db_bench --sessions 8 --turns 200
+    python -m benchmarks.db_bench --legacy         # connect-per-call baseline
+    python -m benchmarks.db_bench --write-behind   # batched background writer
+"""
+from __future__ import annotations
+import argparse
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import db
+
+def _legacy_add_message(path: Path, session_id: str, role: str, intent: str, content: str) -> int:
+    # What db.py did before the pool: a fresh connection per call, never closed
+    conn = sqlite3.connect(path.as_posix(), check_same_thread=False, timeout=10.0)
+    cur = conn.execute(
+        "INSERT INTO messages (session_id, role, intent, content) VALUES (?, ?, ?, ?)",
+        (session_id, role, intent, content),
+    )
+    conn.commit()
+    return cur.lastrowid
+
+def _legacy_get_history(path: Path, session_id: str, limit: int) -> List[Tuple]:
+    conn = sqlite3.connect(path.as_posix(), check_same_thread=False, timeout=10.0)
+    rows = conn.execute(
+        "SELECT id, role, intent, content, created_at FROM messages "
+        "WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+        (session_id, limit),
+    ).fetchall()
+    return rows[::-1]
+
+def run(sessions: int, turns: int, legacy: bool, path: Path, write_behind: bool = False) -> Dict[str, float]:
+    db.WRITE_BEHIND = write_behind
+    db.use_database(path)
+    db.get_history("warmup", limit=1)  # creates the schema
+    answer = "Summary line.\n" + "\n".join(f"- bullet {i} with a few words of advice" for i in range(6))
+    timings = {"insert_s": 0.0, "read_s": 0.0}
+    lock = threading.Lock()
+    start = threading.Barrier(sessions)
+
+    def session() -> None:
+        sid = str(uuid.uuid4())
+        insert_s = read_s = 0.0
+        start.wait()
+        for _ in range(turns):
+            t0 = time.perf_counter()
+            if legacy:
+                _legacy_add_message(path, sid, "user", "learning_path", "Give me a roadmap")
+                _legacy_add_message(path, sid, "assistant", "learning_path", answer)
+            else:
+                db.add_message(sid, "user", "learning_path", "Give me a roadmap")
+                db.add_message(sid, "assistant", "learning_path", answer)
+            t1 = time.perf_counter()
+            if legacy:
+                _legacy_get_history(path, sid, 20)
+            else:
+                db.get_history(sid, limit=20)
+            t2 = time.perf_counter()
+            insert_s += t1 - t0
+            read_s += t2 - t1
+        with lock:
+            timings["insert_s"] += insert_s
+            timings["read_s"] += read_s
+
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    wall = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall
+    db.close_db()
+
+    inserts = sessions * turns * 2
+    reads = sessions * turns
+    return {
+        "mode": "legacy" if legacy else ("write-behind" if write_behind else "pooled"),
+        "sessions": sessions,
+        "turns": turns,
+        "wall_s": round(wall, 3),
+        # Per-thread busy time summed, divided back by the number of threads
+        "inserts_per_s": round(inserts / (timings["insert_s"] / sessions), 1),
+        "history_reads_per_s": round(reads / (timings["read_s"] / sessions), 1),
+    }
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sessions", type=int, default=8)
+    ap.add_argument("--turns", type=int, default=200)
+    ap.add_argument("--legacy", action="store_true", help="also run the connect-per-call baseline")
+    ap.add_argument("--write-behind", action="store_true", help="also run with the batched background writer")
+    args = ap.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        results.append(run(args.sessions, args.turns, False, Path(tmp) / "pooled.db"))
+        if args.write_behind:
+            results.append(run(args.sessions, args.turns, False, Path(tmp) / "write_behind.db", write_behind=True))
+        if args.legacy:
+            results.append(run(args.sessions, args.turns, True, Path(tmp) / "legacy.db"))
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
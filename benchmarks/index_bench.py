@@ -0,0 +1,101 @@
+"""
+Seeds a large messages/feedback database and times the app's read queries
+before and after the index migration.
+
+    python -m benchmarks.index_bench --rows 1000000
+"""
+from __future__ import annotations
+import argparse
+import json
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import db
+from intents import INTENT_DEFS
+
+def seed(conn: sqlite3.Connection, rows: int, turns_per_session: int, feedback_ratio: float) -> List[str]:
+    intents = [i.name for i in INTENT_DEFS]
+    sessions = [f"session-{i:07d}" for i in range(max(1, rows // turns_per_session))]
+    rnd = random.Random(7)
+    # Sessions interleave like real traffic, so a session's rows are spread across the table
+    def message_rows():
+        for n in range(rows):
+            role = "user" if n % 2 == 0 else "assistant"
+            yield (rnd.choice(sessions), role, rnd.choice(intents), f"message {n} " + "lorem ipsum " * 20)
+
+    with conn:
+        conn.executemany(
+            "INSERT INTO messages (session_id, role, intent, content) VALUES (?, ?, ?, ?)",
+            message_rows(),
+        )
+        n_feedback = int(rows * feedback_ratio)
+        conn.executemany(
+            "INSERT INTO feedback (message_id, rating, comment) VALUES (?, ?, NULL)",
+            ((rnd.randrange(1, rows + 1), rnd.choice((1, -1))) for _ in range(n_feedback)),
+        )
+    return sessions
+
+def time_calls(fn: Callable[[str], object], sessions: List[str], samples: int) -> Dict[str, float]:
+    picks = random.Random(11).sample(sessions, min(samples, len(sessions)))
+    times = []
+    for sid in picks:
+        t0 = time.perf_counter()
+        fn(sid)
+        times.append((time.perf_counter() - t0) * 1000.0)
+    times.sort()
+    return {
+        "p50_ms": round(statistics.median(times), 3),
+        "p95_ms": round(times[int(len(times) * 0.95) - 1], 3),
+        "max_ms": round(times[-1], 3),
+    }
+
+def measure(sessions: List[str], samples: int) -> Dict[str, Dict[str, float]]:
+    return {
+        "get_history": time_calls(lambda sid: db.get_history(sid, limit=20), sessions, samples),
+        "get_feedback_summary": time_calls(db.get_feedback_summary, sessions, samples),
+    }
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--turns-per-session", type=int, default=20)
+    ap.add_argument("--feedback-ratio", type=float, default=0.1)
+    ap.add_argument("--samples", type=int, default=50)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.db"
+        # Start from the original, index-free schema
+        conn = sqlite3.connect(path.as_posix())
+        db.migrate(conn, db.MIGRATIONS, target=1)
+        t0 = time.perf_counter()
+        sessions = seed(conn, args.rows, args.turns_per_session, args.feedback_ratio)
+        seed_s = time.perf_counter() - t0
+
+        db.use_database(path, db.MIGRATIONS[:1])
+        before = measure(sessions, args.samples)
+
+        t0 = time.perf_counter()
+        version = db.migrate(conn, db.MIGRATIONS)
+        migrate_s = time.perf_counter() - t0
+        conn.close()
+        db.use_database(path)  # fresh connections see the new indexes
+        after = measure(sessions, args.samples)
+        db.close_db()
+
+    print(json.dumps({
+        "rows": args.rows,
+        "seed_s": round(seed_s, 2),
+        "migrate_to_version": version,
+        "migrate_s": round(migrate_s, 2),
+        "before": before,
+        "after": after,
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Inference benchmark for model.chat. For every combination of the given model
+files and settings it loads the model, then runs a fixed prompt set through
+it: the example question of each intent (intents.INTENT_EXAMPLES), composed
+with its intent template and the system prompt exactly as the app does.
+Prints one JSON document, so runs on different machines can be diffed.
+
+    python -m benchmarks.inference_bench --model models/a.Q4_K_M.gguf models/a.Q8_0.gguf
+    python -m benchmarks.inference_bench --n-threads 2 4 8 --n-ctx 1024 2048
+    python -m benchmarks.inference_bench --chat-format chatml tinyllama --temperature 0.1 0.7
+    python -m benchmarks.inference_bench --draft off prompt-lookup --draft-tokens 2 4
+    python -m benchmarks.inference_bench --structured off on
+    python -m benchmarks.inference_bench --stub --stub-speed 20   # no model file (CI)
+"""
+from __future__ import annotations
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import model
+from intents import INTENT_EXAMPLES, INTENT_TEMPLATES, compose_user_prompt
+
+SYSTEM_PROMPT = Path(__file__).resolve().parent.parent / "prompts" / "system_prompt.txt"
+# Same per-message ChatML overhead context.py budgets with
+MESSAGE_OVERHEAD_TOKENS = 5
+
+def prompt_set() -> List[Tuple[str, str]]:
+    """(intent, composed user prompt) for each intent's example question."""
+    prompts = []
+    for label, question in INTENT_EXAMPLES.items():
+        intent = label.lower().replace(" ", "_")
+        if intent in INTENT_TEMPLATES:
+            prompts.append((intent, compose_user_prompt(intent, question)))
+    return prompts
+
+def _rss_mb() -> Dict[str, float]:
+    current = 0.0
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+    return {"rss_mb": round(current, 1), "peak_rss_mb": round(peak_mb, 1)}
+
+def _pct(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))], 4)
+
+def run_config(
+    settings: Dict[str, Any],
+    prompts: List[Tuple[str, str]],
+    temperature: float,
+    top_p: float,
+    max_tokens: int,
+    repeat: int,
+    warmup: int,
+    structured: bool = False,
+) -> Dict[str, Any]:
+    model.configure(**settings)
+    system_prompt = SYSTEM_PROMPT.read_text(encoding="utf-8")
+
+    # Time until a worker has its model instance: submit a job that does nothing
+    pool = model.get_pool()
+    t0 = time.perf_counter()
+    try:
+        list(pool.results(pool.submit(lambda llm, job: None)))
+    except Exception as e:
+        return {"settings": settings, "error": f"load failed: {e}"}
+    load_s = time.perf_counter() - t0
+
+    system_tokens = model.count_tokens(system_prompt)
+    prompt_tokens = {
+        user_prompt: system_tokens + model.count_tokens(user_prompt) + 3 * MESSAGE_OVERHEAD_TOKENS
+        for _intent, user_prompt in prompts
+    }
+
+    samples: List[Tuple[model.GenerationStats, int]] = []
+    cold_ttft: Optional[float] = None
+    errors: List[str] = []
+    for n in range(warmup + repeat):
+        for _intent, user_prompt in prompts:
+            stats = model.GenerationStats()
+            try:
+                model.chat(system_prompt, user_prompt, [], temperature, top_p, max_tokens, stats, structured)
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            if cold_ttft is None:
+                cold_ttft = stats.ttft_s
+            if n >= warmup:
+                samples.append((stats, prompt_tokens[user_prompt]))
+
+    # Prompt eval is everything before the first token; prefix-cache hits skip part of the prompt
+    eval_tokens = sum(max(0, tokens - s.prompt_tokens_reused) for s, tokens in samples if s.ttft_s)
+    eval_s = sum(s.ttft_s - s.queue_wait_s for s, _tokens in samples if s.ttft_s)
+    # Decode rate from answers without an echo retry, whose time includes a second prompt eval
+    clean = [s for s, _tokens in samples if s.ttft_s and not s.echo_fallback and s.completion_tokens > 1]
+    decode_tokens = sum(s.completion_tokens - 1 for s in clean)
+    decode_s = sum(s.gen_s - s.ttft_s for s in clean)
+    drafted = sum(s.draft_proposed for s, _tokens in samples)
+    drafted_ok = sum(s.draft_accepted for s, _tokens in samples)
+    ttfts = [s.ttft_s for s, _tokens in samples if s.ttft_s is not None]
+    latencies = [s.gen_s for s, _tokens in samples]
+
+    return {
+        "settings": settings,
+        "requests": len(samples),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "load_s": round(load_s, 3),
+        "cold_ttft_s": round(cold_ttft, 4) if cold_ttft is not None else None,
+        "prompt_eval_tokens_per_s": round(eval_tokens / eval_s, 1) if eval_s > 0 else None,
+        "gen_tokens_per_s": round(decode_tokens / decode_s, 1) if decode_s > 0 else None,
+        "ttft_s": {"p50": _pct(ttfts, 0.5), "p95": _pct(ttfts, 0.95)},
+        "latency_s": {"p50": _pct(latencies, 0.5), "p95": _pct(latencies, 0.95)},
+        "avg_completion_tokens": round(sum(s.completion_tokens for s, _t in samples) / len(samples), 1) if samples else None,
+        "avg_prompt_tokens_reused": round(sum(s.prompt_tokens_reused for s, _t in samples) / len(samples), 1) if samples else None,
+        "echo_fallback_rate": round(sum(s.echo_fallback for s, _t in samples) / len(samples), 4) if samples else None,
+        "draft_acceptance_rate": round(drafted_ok / drafted, 4) if drafted else None,
+        **_rss_mb(),
+    }
+
+def _add_speedups(runs: List[Dict[str, Any]]) -> None:
+    """Speculative runs: generation and latency speedup over the same settings with draft off."""
+    def base_key(run: Dict[str, Any]) -> str:
+        rest = {k: v for k, v in run["settings"].items() if k not in ("draft", "draft_tokens")}
+        return json.dumps([rest, run.get("sampler")], sort_keys=True)
+
+    baselines = {base_key(r): r for r in runs if r["settings"]["draft"] == "off" and "error" not in r}
+    for run in runs:
+        base = baselines.get(base_key(run))
+        if run["settings"]["draft"] == "off" or base is None or "error" in run:
+            continue
+        gen, base_gen = run["gen_tokens_per_s"], base["gen_tokens_per_s"]
+        p50, base_p50 = run["latency_s"]["p50"], base["latency_s"]["p50"]
+        run["speedup"] = {
+            "gen_tokens_per_s": round(gen / base_gen, 3) if gen and base_gen else None,
+            "latency_p50": round(base_p50 / p50, 3) if p50 and base_p50 else None,
+        }
+
+def _threads(value: str) -> Optional[int]:
+    return None if value == "auto" else int(value)
+
+def _environment(stub: bool) -> Dict[str, Any]:
+    env: Dict[str, Any] = {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "workers": model.WORKERS,
+        "prompt_cache": model.PROMPT_CACHE_MODE,
+        "backend": "stub" if stub else "llama_cpp",
+    }
+    if not stub:
+        import llama_cpp
+        env["llama_cpp"] = getattr(llama_cpp, "__version__", None)
+    return env
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--model", nargs="+", default=[model.LLM_SETTINGS["model_path"]], help="GGUF files to compare")
+    ap.add_argument("--n-ctx", nargs="+", type=int, default=[model.LLM_SETTINGS["n_ctx"]])
+    ap.add_argument("--n-threads", nargs="+", type=_threads, default=[None], help="thread counts, or 'auto'")
+    ap.add_argument("--chat-format", nargs="+", default=[model.LLM_SETTINGS["chat_format"]])
+    ap.add_argument("--temperature", nargs="+", type=float, default=[0.3])
+    ap.add_argument("--top-p", nargs="+", type=float, default=[0.9])
+    ap.add_argument("--repeat-penalty", nargs="+", type=float, default=[model.SAMPLER_SETTINGS["repeat_penalty"]])
+    ap.add_argument("--draft", nargs="+", default=[model.LLM_SETTINGS["draft"]],
+                    help="speculative decoding: off, prompt-lookup, model:<path>")
+    ap.add_argument("--draft-tokens", nargs="+", type=int, default=[model.LLM_SETTINGS["draft_tokens"]],
+                    help="tokens drafted per step (0 = auto)")
+    ap.add_argument("--structured", nargs="+", choices=["off", "on"], default=["off"],
+                    help="grammar-constrained answers (structured.py)")
+    ap.add_argument("--max-tokens", type=int, default=512)
+    ap.add_argument("--repeat", type=int, default=2, help="timed passes over the prompt set")
+    ap.add_argument("--warmup", type=int, default=1, help="untimed passes first (builds the prompt cache)")
+    ap.add_argument("--stub", action="store_true", help="use the timing stub instead of llama.cpp")
+    ap.add_argument("--stub-speed", type=float, default=1.0, help="speed multiplier for the stub")
+    ap.add_argument("--out", type=Path, help="write the JSON here instead of stdout")
+    args = ap.parse_args()
+
+    if args.stub:
+        from benchmarks import stub_llm
+        stub_llm.SPEED = args.stub_speed
+        model.configure(backend=stub_llm.StubLlama)
+
+    prompts = prompt_set()
+    runs = []
+    grid = itertools.product(
+        args.model, args.n_ctx, args.n_threads, args.chat_format,
+        args.temperature, args.top_p, args.repeat_penalty, args.draft, args.draft_tokens,
+        args.structured,
+    )
+    for (model_path, n_ctx, n_threads, chat_format, temperature, top_p, repeat_penalty,
+         draft, draft_tokens, structured) in grid:
+        if draft == "off" and draft_tokens != args.draft_tokens[0]:
+            continue  # draft_tokens means nothing without a draft
+        settings = {
+            "model_path": model_path,
+            "n_ctx": n_ctx,
+            "n_threads": n_threads,
+            "chat_format": chat_format,
+            "repeat_penalty": repeat_penalty,
+            "draft": draft,
+            "draft_tokens": draft_tokens if draft != "off" else 0,
+        }
+        result = run_config(
+            settings, prompts, temperature, top_p, args.max_tokens, args.repeat, args.warmup, structured == "on"
+        )
+        result["sampler"] = {
+            "temperature": temperature, "top_p": top_p, "max_tokens": args.max_tokens, "structured": structured,
+        }
+        runs.append(result)
+    model.configure()  # shut the last pool down
+    _add_speedups(runs)
+
+    report = json.dumps({"environment": _environment(args.stub), "prompts": len(prompts), "runs": runs}, indent=2)
+    if args.out:
+        args.out.write_text(report + "\n", encoding="utf-8")
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
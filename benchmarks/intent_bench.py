@@ -0,0 +1,70 @@
+"""
+Routing accuracy and throughput of intents.find_intent against the labeled
+corpus in benchmarks/data/intent_corpus.tsv, next to the original
+first-match substring scan.
+
+    python -m benchmarks.intent_bench --repeat 2000
+"""
+from __future__ import annotations
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import intents
+
+CORPUS = Path(__file__).resolve().parent / "data" / "intent_corpus.tsv"
+
+def load_corpus(path: Path = CORPUS) -> List[Tuple[str, str]]:
+    rows = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if not line.strip() or line.startswith("#"):
+            continue
+        label, text = line.split("\t", 1)
+        rows.append((label, text))
+    return rows
+
+def legacy_find_intent(text: str) -> str:
+    # The router as it was: two regex passes, then first RULES entry with any substring hit
+    t = (text or "").lower()
+    t = t.replace("read map", "roadmap").replace("road map", "roadmap")
+    t = intents.PUNCT_RE.sub(" ", t)
+    t = re.sub(r"\s+", " ", t).strip()
+    for name, keys in intents.RULES:
+        if any(n in t for n in keys):
+            return name
+    return "general_guidance"
+
+def evaluate(router: Callable[[str], str], corpus: List[Tuple[str, str]], repeat: int) -> Dict[str, object]:
+    misses = [(label, router(text), text) for label, text in corpus if router(text) != label]
+    texts = [text for _label, text in corpus]
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            router(text)
+    elapsed = time.perf_counter() - t0
+    calls = repeat * len(texts)
+    return {
+        "accuracy": round(1 - len(misses) / len(corpus), 4),
+        "queries_per_s": round(calls / elapsed),
+        "us_per_query": round(elapsed / calls * 1e6, 2),
+        "misrouted": [{"expected": e, "got": g, "text": t} for e, g, t in misses],
+    }
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repeat", type=int, default=1000, help="passes over the corpus for the timing run")
+    ap.add_argument("--corpus", type=Path, default=CORPUS)
+    args = ap.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    print(json.dumps({
+        "corpus_size": len(corpus),
+        "legacy": evaluate(legacy_find_intent, corpus, args.repeat),
+        "compiled": evaluate(intents.find_intent, corpus, args.repeat),
+    }, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
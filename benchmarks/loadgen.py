@@ -0,0 +1,204 @@
+"""
+Open-loop load generator for the HTTP API (api.py). Replays the user
+questions stored in the messages table (the intent corpus when there are
+none) at a target request rate, whether or not earlier requests have
+finished, and reports throughput, latency and time-to-first-token
+percentiles and errors as one JSON document.
+
+    python api.py --port 8000 &
+    python -m benchmarks.loadgen --url http://127.0.0.1:8000 --rps 2 --duration 60
+    python -m benchmarks.loadgen --serve-stub --stub-speed 20 --rps 5 --duration 20   # no model file (CI)
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+
+import db
+from intent_classifier import load_corpus
+
+def stored_questions(limit: int) -> List[str]:
+    """The most recent distinct user questions in the database, oldest first."""
+    db.flush_writes()
+    with db.get_convo() as conn:
+        rows = conn.execute(
+            "SELECT content FROM messages WHERE role = 'user' GROUP BY content ORDER BY MAX(id) DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+    return [content for (content,) in reversed(rows)]
+
+def _pct(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))], 4)
+
+def _summary(values: List[float]) -> Dict[str, Optional[float]]:
+    return {"p50": _pct(values, 0.5), "p90": _pct(values, 0.9), "p99": _pct(values, 0.99)}
+
+class Result:
+    __slots__ = ("status", "latency_s", "ttft_s", "cached", "error")
+
+    def __init__(self) -> None:
+        self.status = 0
+        self.latency_s = 0.0
+        self.ttft_s: Optional[float] = None
+        self.cached = False
+        self.error: Optional[str] = None
+
+async def _one(client: AsyncHTTPClient, url: str, body: Dict[str, Any], timeout_s: float) -> Result:
+    result = Result()
+    t0 = time.perf_counter()
+    buffer = b""
+
+    def on_chunk(chunk: bytes) -> None:
+        nonlocal buffer
+        buffer += chunk
+        while b"\n\n" in buffer:
+            raw, buffer = buffer.split(b"\n\n", 1)
+            lines = raw.decode("utf-8").splitlines()
+            event = lines[0][len("event: "):]
+            data = json.loads(lines[1][len("data: "):])
+            if event == "meta":
+                result.cached = data["cached"]
+            elif event == "delta" and result.ttft_s is None:
+                result.ttft_s = time.perf_counter() - t0
+            elif event == "error":
+                result.error = data["error"]
+                result.status = data["status"]
+
+    request = HTTPRequest(
+        url + "/v1/ask", method="POST", body=json.dumps(body),
+        headers={"Content-Type": "application/json", "Accept": "text/event-stream"},
+        streaming_callback=on_chunk, request_timeout=timeout_s,
+    )
+    try:
+        response = await client.fetch(request)
+        result.status = result.status or response.code
+    except HTTPClientError as e:
+        result.status = e.code
+        result.error = e.message
+    except Exception as e:
+        result.status = 0
+        result.error = str(e)
+    result.latency_s = time.perf_counter() - t0
+    return result
+
+async def run(
+    url: str,
+    questions: List[str],
+    rps: float,
+    duration_s: float,
+    sessions: int,
+    max_tokens: int,
+    timeout_s: float,
+    poisson: bool,
+) -> Dict[str, Any]:
+    client = AsyncHTTPClient(max_clients=10_000)
+    session_ids = [uuid.uuid4().hex for _ in range(sessions)]
+    queries = itertools.cycle(questions)
+    pending = []
+    t0 = time.perf_counter()
+    next_at = 0.0
+    n = 0
+    # Open loop: requests go out on schedule, not when earlier ones finish
+    while next_at < duration_s:
+        delay = t0 + next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        body = {"query": next(queries), "session_id": session_ids[n % sessions], "max_tokens": max_tokens}
+        pending.append(asyncio.ensure_future(_one(client, url, body, timeout_s)))
+        n += 1
+        next_at += random.expovariate(rps) if poisson else 1.0 / rps
+    sent_s = time.perf_counter() - t0
+    results: List[Result] = await asyncio.gather(*pending)
+    wall_s = time.perf_counter() - t0
+
+    ok = [r for r in results if r.status == 200 and r.error is None]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if r not in ok:
+            errors[str(r.status)] = errors.get(str(r.status), 0) + 1
+    first_error = next((r.error for r in results if r.error), None)
+    return {
+        "target_rps": rps,
+        "offered_rps": round(len(results) / sent_s, 3) if sent_s > 0 else None,
+        "requests": len(results),
+        "completed": len(ok),
+        "throughput_rps": round(len(ok) / wall_s, 3) if wall_s > 0 else None,
+        "wall_s": round(wall_s, 3),
+        "latency_s": _summary([r.latency_s for r in ok]),
+        "ttft_s": _summary([r.ttft_s for r in ok if r.ttft_s is not None]),
+        "cache_hit_rate": round(sum(r.cached for r in ok) / len(ok), 4) if ok else None,
+        "errors": errors,
+        "first_error": first_error,
+    }
+
+def _serve_stub(speed: float, answer_cache: bool) -> str:
+    """Start api.py in this process on the timing stub and a scratch database; returns its URL."""
+    import api
+    import answer_cache as cache
+    import model
+    from benchmarks import stub_llm
+    from tornado.httpserver import HTTPServer
+    from tornado.netutil import bind_sockets
+
+    stub_llm.SPEED = speed
+    model.configure(backend=stub_llm.StubLlama)
+    cache.ENABLED = answer_cache
+    db.use_database(Path(tempfile.mkdtemp(prefix="loadgen-")) / "loadgen.db")
+    sockets = bind_sockets(0, "127.0.0.1")
+    server = HTTPServer(api.make_app())
+    server.add_sockets(sockets)
+    return f"http://127.0.0.1:{sockets[0].getsockname()[1]}"
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--rps", type=float, default=1.0, help="target request rate")
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds to send requests for")
+    ap.add_argument("--poisson", action="store_true", help="exponential gaps instead of a fixed interval")
+    ap.add_argument("--sessions", type=int, default=8, help="distinct session ids to spread requests over")
+    ap.add_argument("--questions", type=int, default=500, help="how many stored questions to replay")
+    ap.add_argument("--max-tokens", type=int, default=256)
+    ap.add_argument("--timeout", type=float, default=300.0, help="per-request timeout, seconds")
+    ap.add_argument("--serve-stub", action="store_true", help="start the API in-process on the timing stub")
+    ap.add_argument("--stub-speed", type=float, default=1.0, help="speed multiplier for the stub")
+    ap.add_argument("--answer-cache", choices=["off", "on"], default="off", help="answer cache of the stub server")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", type=Path, help="write the JSON here instead of stdout")
+    args = ap.parse_args()
+    random.seed(args.seed)
+
+    questions = stored_questions(args.questions)
+    source = "messages"
+    if not questions:
+        questions = [text for text, _label, _weight in load_corpus()]
+        source = "intent_corpus"
+    random.shuffle(questions)
+
+    async def go() -> Dict[str, Any]:
+        url = _serve_stub(args.stub_speed, args.answer_cache == "on") if args.serve_stub else args.url.rstrip("/")
+        return await run(
+            url, questions, args.rps, args.duration, args.sessions, args.max_tokens, args.timeout, args.poisson,
+        )
+
+    result = asyncio.run(go())
+    report = json.dumps({"url": "stub" if args.serve_stub else args.url, "questions": len(questions),
+                         "source": source, **result}, indent=2)
+    if args.out:
+        args.out.write_text(report + "\n", encoding="utf-8")
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Seeds a large messages database and times full-text search and history
+paging before and after the FTS migration: a LIKE scan against
+db.search_messages, and OFFSET paging against db.get_history_page's
+keyset cursor, for pages near the start and deep into a long session.
+
+    python -m benchmarks.search_bench --rows 2000000
+"""
+from __future__ import annotations
+import argparse
+import json
+import random
+import re
+import sqlite3
+import statistics
+import tempfile
+import time
+import uuid
+from itertools import accumulate
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import db
+from intents import INTENT_DEFS
+
+CORPUS = Path(__file__).parent / "data" / "intent_corpus.tsv"
+# One session as long as a heavy user's, to page through
+LONG_SESSION = "session-long"
+
+def vocabulary(size: int) -> List[str]:
+    words = sorted({w.lower() for line in CORPUS.read_text(encoding="utf-8").splitlines()[1:]
+                    for w in re.findall(r"[A-Za-z]{3,}", line.split("\t", 1)[-1])})
+    return words + [f"term{i}" for i in range(max(0, size - len(words)))]
+
+def seed(conn: sqlite3.Connection, rows: int, turns_per_session: int, long_session: int, words: int) -> List[str]:
+    intents = [i.name for i in INTENT_DEFS]
+    rnd = random.Random(7)
+    # uuid4 session ids like the app's, so the session filter is as selective as in production
+    sessions = [str(uuid.UUID(int=rnd.getrandbits(128), version=4)) for _ in range(max(1, rows // turns_per_session))]
+    vocab = vocabulary(words)
+    # Zipf-like word frequencies, as in natural text
+    cum = list(accumulate(1.0 / (rank + 1) for rank in range(len(vocab))))
+    def message_rows():
+        for n in range(rows):
+            sid = LONG_SESSION if n % max(1, rows // long_session) == 0 else rnd.choice(sessions)
+            text = " ".join(rnd.choices(vocab, cum_weights=cum, k=rnd.randint(10, 80)))
+            yield (sid, "user" if n % 2 == 0 else "assistant", rnd.choice(intents), text)
+
+    with conn:
+        conn.executemany(
+            "INSERT INTO messages (session_id, role, intent, content) VALUES (?, ?, ?, ?)",
+            message_rows(),
+        )
+    return sessions
+
+def time_calls(fn: Callable[[], object], repeat: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000.0)
+    times.sort()
+    return {
+        "p50_ms": round(statistics.median(times), 3),
+        "max_ms": round(times[-1], 3),
+    }
+
+def queries(sessions: List[str], words: int) -> Dict[str, Dict]:
+    # vocabulary() is in frequency order: rank 0 is the most common word
+    vocab = [w for w in vocabulary(words) if w not in db.STOPWORDS]
+    frequent, mid, rare = vocab[0], vocab[200], vocab[-10]
+    return {
+        "frequent_word": {"query": frequent},
+        "mid_word": {"query": mid},
+        "rare_word": {"query": rare},
+        "question": {"query": f"how do I get {mid} {frequent}?"},
+        "by_intent": {"query": frequent, "intent": INTENT_DEFS[2].name},
+        "in_session": {"query": frequent, "session_id": sessions[len(sessions) // 2]},
+    }
+
+def like_search(query: str, intent: str = None, session_id: str = None, limit: int = 20) -> List:
+    # What a search looks like without an index: a substring scan, newest first
+    sql = "SELECT id FROM messages WHERE content LIKE ?"
+    params: list = [f"%{query}%"]
+    if intent:
+        sql += " AND intent = ?"
+        params.append(intent)
+    if session_id:
+        sql += " AND session_id = ?"
+        params.append(session_id)
+    with db.get_convo() as conn:
+        return conn.execute(sql + " ORDER BY id DESC LIMIT ?", params + [limit]).fetchall()
+
+def offset_page(session_id: str, page: int, size: int) -> List:
+    with db.get_convo() as conn:
+        return conn.execute(
+            "SELECT id, role, intent, content, created_at FROM messages "
+            "WHERE session_id = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+            (session_id, size, page * size),
+        ).fetchall()
+
+def keyset_cursor(session_id: str, page: int, size: int):
+    # The cursor the app holds after `page` clicks of "Load older"
+    if page == 0:
+        return None
+    with db.get_convo() as conn:
+        return conn.execute(
+            "SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+            (session_id, page * size - 1),
+        ).fetchone()[0]
+
+def paging(fetch: Callable[[int], object], deep_page: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    return {name: time_calls(lambda p=page: fetch(p), repeat) for name, page in (("first_page", 0), ("deep_page", deep_page))}
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--turns-per-session", type=int, default=20)
+    ap.add_argument("--long-session", type=int, default=20_000, help="messages in the session that gets paged")
+    ap.add_argument("--words", type=int, default=30_000, help="vocabulary size")
+    ap.add_argument("--page-size", type=int, default=20)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+    deep_page = args.long_session // args.page_size - 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.db"
+        before_fts = [m for m in db.MIGRATIONS if m[0] < 8]
+        conn = sqlite3.connect(path.as_posix())
+        db.migrate(conn, before_fts)
+        t0 = time.perf_counter()
+        sessions = seed(conn, args.rows, args.turns_per_session, args.long_session, args.words)
+        seed_s = time.perf_counter() - t0
+
+        db.use_database(path, before_fts)
+        cases = queries(sessions, args.words)
+        before = {
+            "search": {name: time_calls(lambda q=q: like_search(**q), max(1, args.repeat // 10)) for name, q in cases.items()},
+            "paging": paging(lambda p: offset_page(LONG_SESSION, p, args.page_size), deep_page, args.repeat),
+        }
+
+        t0 = time.perf_counter()
+        version = db.migrate(conn, db.MIGRATIONS)
+        migrate_s = time.perf_counter() - t0
+        conn.close()
+        db.use_database(path)
+        cursors = {p: keyset_cursor(LONG_SESSION, p, args.page_size) for p in (0, deep_page)}
+        after = {
+            "search": {name: time_calls(lambda q=q: db.search_messages(**q), args.repeat) for name, q in cases.items()},
+            "paging": paging(lambda p: db.get_history_page(LONG_SESSION, cursors[p], args.page_size), deep_page, args.repeat),
+        }
+        db.close_db()
+
+    print(json.dumps({
+        "rows": args.rows,
+        "seed_s": round(seed_s, 2),
+        "migrate_to_version": version,
+        "migrate_s": round(migrate_s, 2),
+        "search_window": db.SEARCH_WINDOW,
+        "before": before,
+        "after": after,
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Cold-start benchmark. Each run is a fresh interpreter that imports the
+modules both entry points share (service, model_manager), starts the
+background preload and waits until the model is ready; it reports the import
+time, model load, first token and total, plus whether llama_cpp or pandas
+got imported before the model was needed (neither should). Prints one JSON
+document with the median of every figure.
+
+    python -m benchmarks.startup_bench --runs 5
+    python -m benchmarks.startup_bench --stub     # no model file (CI)
+"""
+from __future__ import annotations
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def child(stub: bool, timeout_s: float) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    import model
+    import model_manager
+    import service  # noqa: F401  (the pipeline's imports are part of the cold start)
+    import_s = time.perf_counter() - t0
+    heavy = {name: name in sys.modules for name in ("llama_cpp", "pandas", "numpy")}
+    model_manager.note_import_time(import_s)
+
+    if stub:
+        from benchmarks import stub_llm
+        model.configure(backend=stub_llm.StubLlama)
+    model_manager.AUTOTUNE = False
+    model_manager.startup()
+    deadline = time.monotonic() + timeout_s
+    while not model_manager.ready():
+        if model_manager.status()["error"] or time.monotonic() > deadline:
+            return {"error": model_manager.status()["error"] or "timed out"}
+        time.sleep(0.01)
+    report: Dict[str, Any] = dict(model_manager.status()["startup"])
+    report["total_s"] = round(time.perf_counter() - t0, 3)
+    report["imported_before_load"] = heavy
+    return report
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--stub", action="store_true", help="use the timing stub instead of llama.cpp")
+    ap.add_argument("--timeout", type=float, default=300.0)
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--out", type=Path, help="write the JSON here instead of stdout")
+    args = ap.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args.stub, args.timeout)))
+        return
+
+    cmd = [sys.executable, "-m", "benchmarks.startup_bench", "--child", "--timeout", str(args.timeout)]
+    if args.stub:
+        cmd.append("--stub")
+    runs: List[Dict[str, Any]] = []
+    for _ in range(args.runs):
+        t0 = time.perf_counter()
+        out = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        run = json.loads(out.strip().splitlines()[-1])
+        run["process_s"] = round(time.perf_counter() - t0, 3)
+        runs.append(run)
+
+    ok = [r for r in runs if "error" not in r]
+    keys = ("import_s", "load_s", "first_token_s", "total_s", "process_s")
+    median = {k: round(statistics.median(r[k] for r in ok), 3) for k in keys if ok and all(r.get(k) is not None for r in ok)}
+    report = json.dumps({
+        "backend": "stub" if args.stub else "llama_cpp",
+        "runs": len(runs),
+        "errors": [r["error"] for r in runs if "error" in r],
+        "median": median,
+        "imported_before_load": ok[0]["imported_before_load"] if ok else None,
+        "all": runs,
+    }, indent=2)
+    if args.out:
+        args.out.write_text(report + "\n", encoding="utf-8")
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+A stand-in for llama_cpp.Llama that needs no model file. It keeps a
+token-level KV "cache" like llama.cpp (a prompt only pays for the tokens past
+its common prefix with the previous one) and sleeps for load, prompt
+evaluation and each generated token at rates that scale with n_threads the
+way a small quantized model does on CPU. The numbers are only plausible, not
+measured; the stub is for exercising the benchmark and the serving code in
+CI, not for comparing hardware.
+
+    python -m benchmarks.inference_bench --stub
+"""
+from __future__ import annotations
+import os
+import random
+import re
+import time
+import zlib
+from array import array
+from typing import Any, Dict, Iterator, List, Optional
+
+# Rough TinyLlama Q4_K_M figures for one thread
+LOAD_S = 0.4
+PROMPT_TOKENS_PER_S = 60.0
+GEN_TOKENS_PER_S = 9.0
+# Multiplies every rate (and divides load time); raise it to make CI runs fast
+SPEED = 1.0
+# Share of answers that start by echoing the instructions
+ECHO_RATE = 0.1
+
+_WORD_RE = re.compile(r"\S+\s*|\s+")
+
+_ANSWER = (
+    "Start with SQL, spreadsheets and one BI tool, then build two small portfolio projects.\n"
+    "- Learn SQL joins, window functions and aggregation on a public dataset\n"
+    "- Practice Excel or Google Sheets pivots, lookups and charts\n"
+    "- Pick Power BI or Tableau and rebuild a dashboard you like\n"
+    "- Learn basic statistics: distributions, sampling and A/B tests\n"
+    "- Write up each project as a short case study with the business question first\n"
+    "- Tailor your resume bullets to results, tools and numbers\n"
+    "Which industry would you like your projects to focus on?"
+)
+# What the structured-mode grammar lets through for the same answer
+_STRUCTURED_ANSWER = _ANSWER.replace("\nWhich industry", "\nQuestion: Which industry")
+_ECHO = "Purpose: You are CareerGuide, a helpful assistant. Style: concise bullets.\n"
+
+def _thread_speedup(n_threads: Optional[int]) -> float:
+    # Prompt eval is compute bound and scales well; returns diminish past ~8 threads
+    n = n_threads or min(os.cpu_count() or 1, 8)
+    return n ** 0.8
+
+class StubLlama:
+    """Implements the parts of the Llama API the app uses."""
+
+    def __init__(
+        self,
+        model_path: str = "stub",
+        n_ctx: int = 2048,
+        n_threads: Optional[int] = None,
+        vocab_only: bool = False,
+        draft_model: Any = None,
+        seed: int = 7,
+        **_ignored: Any,
+    ):
+        self.model_path = model_path
+        self.draft_model = draft_model
+        self._n_ctx = n_ctx
+        speedup = _thread_speedup(n_threads)
+        self.prompt_tps = PROMPT_TOKENS_PER_S * speedup * SPEED
+        # Generation is memory bound; extra threads help much less
+        self.gen_tps = GEN_TOKENS_PER_S * speedup ** 0.5 * SPEED
+        self._rng = random.Random(seed)
+        self._vocab: Dict[int, bytes] = {}
+        self._ids: List[int] = []
+        if not vocab_only:
+            time.sleep(LOAD_S / SPEED)
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    @property
+    def input_ids(self) -> array:
+        return array("i", self._ids)
+
+    @property
+    def n_tokens(self) -> int:
+        return len(self._ids)
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        ids = [1] if add_bos else []
+        for word in _WORD_RE.findall(text.decode("utf-8", errors="ignore")):
+            raw = word.encode("utf-8")
+            tid = 3 + zlib.crc32(raw) % 31997
+            self._vocab.setdefault(tid, raw)
+            ids.append(tid)
+        return ids
+
+    def detokenize(self, tokens: List[int]) -> bytes:
+        return b"".join(self._vocab.get(t, b"") for t in tokens)
+
+    def reset(self) -> None:
+        self._ids = []
+
+    def eval(self, tokens: List[int]) -> None:
+        time.sleep(len(tokens) / self.prompt_tps)
+        self._ids.extend(tokens)
+
+    def save_state(self) -> List[int]:
+        return list(self._ids)
+
+    def load_state(self, state: List[int]) -> None:
+        self._ids = list(state)
+
+    def _format(self, messages: List[Dict[str, str]]) -> str:
+        # Like llama-cpp-python's chatml formatter: only the first system message is kept
+        messages = [m for i, m in enumerate(messages) if m["role"] != "system" or i == 0]
+        text = "".join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages)
+        return text + "<|im_start|>assistant\n"
+
+    def create_chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        stream: bool = False,
+        max_tokens: int = 512,
+        **_sampling: Any,
+    ) -> Iterator[Dict[str, Any]]:
+        if not stream:
+            raise NotImplementedError("StubLlama only streams")
+        prompt = self.tokenize(self._format(messages).encode("utf-8"), add_bos=True, special=True)
+        if len(prompt) + max_tokens > self._n_ctx:
+            raise ValueError(f"Requested tokens ({len(prompt) + max_tokens}) exceed context window of {self._n_ctx}")
+        reused = 0
+        for a, b in zip(self._ids, prompt):
+            if a != b:
+                break
+            reused += 1
+        # llama.cpp always re-evaluates at least the last prompt token
+        reused = min(reused, len(prompt) - 1)
+        self._ids = self._ids[:reused]
+        self.eval(prompt[reused:])
+
+        # Like the real model, only the long headed system prompt gets echoed, not the fallback one
+        headed = messages[0]["role"] == "system" and "\nPurpose" in messages[0]["content"]
+        echo = headed and self._rng.random() < ECHO_RATE
+        # A grammar keeps the answer's shape but still admits an echoed first line
+        answer = _STRUCTURED_ANSWER if _sampling.get("grammar") is not None else _ANSWER
+        answer = (_ECHO + answer) if echo else answer
+        return self._generate(_WORD_RE.findall(answer)[:max_tokens])
+
+    def _generate(self, pieces: List[str]) -> Iterator[Dict[str, Any]]:
+        ids = [self.tokenize(p.encode("utf-8"), add_bos=False)[0] for p in pieces]
+        i = 0
+        while i < len(pieces):
+            # One decode step samples a token; with a draft it also verifies the
+            # drafted tokens in the same batch, which costs a little extra per token
+            accepted = 0
+            step_s = 1.0 / self.gen_tps
+            if self.draft_model is not None:
+                import numpy as np
+                draft = list(self.draft_model(np.array(self._ids, dtype=np.intc)))
+                for want, got in zip(ids[i:], draft):
+                    if want != got:
+                        break
+                    accepted += 1
+                step_s *= 1 + 0.1 * len(draft)
+            time.sleep(step_s)
+            for piece, tid in zip(pieces[i:i + accepted + 1], ids[i:i + accepted + 1]):
+                self._ids.append(tid)
+                yield {"choices": [{"delta": {"content": piece}}]}
+            i += accepted + 1
@@ -0,0 +1,86 @@
+# context.py
+from __future__ import annotations
+from typing import Dict, List, Optional, Sequence, Tuple
+import os
+
+from db import get_token_counts, save_token_counts
+from model import N_CTX, count_tokens, truncate_tokens
+
+# Upper bound on history tokens, on top of what n_ctx leaves after the prompt and max_tokens
+HISTORY_TOKEN_BUDGET = int(os.getenv("CAREERGUIDE_HISTORY_TOKENS", "1024"))
+# ChatML wraps each message in <|im_start|>role\n ... <|im_end|>\n
+MESSAGE_OVERHEAD_TOKENS = 5
+# Headroom for tokenization differences once messages are formatted together
+SAFETY_MARGIN_TOKENS = 32
+# Don't bother keeping a truncated turn shorter than this
+MIN_TRUNCATED_TOKENS = 48
+
+_counts: Dict[int, int] = {}
+
+def message_tokens(rows: Sequence[Tuple]) -> Dict[int, int]:
+    """Token counts for history rows: process cache, then the messages table, then the tokenizer."""
+    if len(_counts) > 100_000:
+        _counts.clear()
+    ids = [r[0] for r in rows if r[0] not in _counts]
+    if ids:
+        _counts.update(get_token_counts(ids))
+    fresh = {r[0]: count_tokens(r[3]) for r in rows if r[0] not in _counts}
+    if fresh:
+        save_token_counts(fresh)
+        _counts.update(fresh)
+    return {r[0]: _counts[r[0]] for r in rows}
+
+def history_budget(system_prompt: str, user_prompt: str, max_tokens: int, n_ctx: int = N_CTX) -> int:
+    prompt = count_tokens(system_prompt) + count_tokens(user_prompt) + 3 * MESSAGE_OVERHEAD_TOKENS
+    free = n_ctx - max_tokens - prompt - SAFETY_MARGIN_TOKENS
+    return max(0, min(HISTORY_TOKEN_BUDGET, free))
+
+def pack_history(
+    rows: Sequence[Tuple],
+    system_prompt: str,
+    user_prompt: str,
+    max_tokens: int,
+    n_ctx: int = N_CTX,
+    summary: Optional[Tuple[int, str]] = None,
+) -> List[Dict[str, str]]:
+    """
+    Most recent turns that fit next to the prompt and the reserved answer
+    tokens, oldest first. The turn that doesn't fit is cut to the remaining
+    budget; anything older is dropped.
+    rows: (id, role, intent, content, created_at) as returned by db.get_history.
+    summary: (upto_message_id, text) from db.get_summary; it replaces the turns
+    it covers and leads the oldest kept user turn (or a user turn of its own).
+    Not a second system message: the chatml formatter keeps only the first,
+    and the system prompt itself stays the same for every session, so its
+    KV cache prefix (prompt_cache.py) is still shared.
+    """
+    budget = history_budget(system_prompt, user_prompt, max_tokens, n_ctx)
+    note: Optional[str] = None
+    if summary is not None:
+        upto_id, text = summary
+        rows = [r for r in rows if r[0] > upto_id]
+        note = f"Earlier in this conversation: {text}"
+        cost = count_tokens(note) + MESSAGE_OVERHEAD_TOKENS
+        if cost <= budget:
+            budget -= cost
+        else:
+            note = None
+    counts = message_tokens(rows)
+    packed: List[Dict[str, str]] = []
+    for msg_id, role, _intent, content, _ts in sorted(rows, key=lambda r: r[0], reverse=True):
+        cost = counts[msg_id] + MESSAGE_OVERHEAD_TOKENS
+        if cost <= budget:
+            packed.append({"role": role, "content": content})
+            budget -= cost
+            continue
+        room = budget - MESSAGE_OVERHEAD_TOKENS
+        if room >= MIN_TRUNCATED_TOKENS:
+            packed.append({"role": role, "content": truncate_tokens(content, room - 1) + "…"})
+        break
+    packed.reverse()
+    if note is not None:
+        if packed and packed[0]["role"] == "user":
+            packed[0] = {"role": "user", "content": f"{note}\n\n{packed[0]['content']}"}
+        else:
+            packed.insert(0, {"role": "user", "content": note})
+    return packed
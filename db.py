@@ -1,12 +1,35 @@
 # db.py
+import atexit
+import logging
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional, List, Tuple, Dict, Any
+from typing import Optional, List, Tuple, Dict, Any, Iterator
 
 DB_PATH = Path("career_advisor.db")
 
+# Write-behind: queue inserts and let a background thread commit them in batches.
+# Message ids are handed out by this process, so only one process may write the file.
+WRITE_BEHIND = os.getenv("CAREERGUIDE_DB_WRITE_BEHIND", "off") == "on"
+FLUSH_INTERVAL_S = float(os.getenv("CAREERGUIDE_DB_FLUSH_INTERVAL", "0.05"))
+FLUSH_BATCH = int(os.getenv("CAREERGUIDE_DB_FLUSH_BATCH", "256"))
+# Message ids a write-behind process reserves at a time
+ID_BLOCK = int(os.getenv("CAREERGUIDE_DB_ID_BLOCK", "256"))
+
+# search_messages() ranks the newest this many matches; 0 = all of them
+SEARCH_WINDOW = int(os.getenv("CAREERGUIDE_SEARCH_WINDOW", "2000"))
+# Marks the matched terms in search_messages() snippets; the UI turns them into <mark>
+SNIPPET_OPEN, SNIPPET_CLOSE = "\x02", "\x03"
+
+log = logging.getLogger(__name__)
+
 SCHEMA = """
-PRAGMA journal_mode=WAL;
 CREATE TABLE IF NOT EXISTS messages (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   session_id TEXT NOT NULL,
@@ -26,44 +49,677 @@ CREATE TABLE IF NOT EXISTS feedback (
 );
 """
 
-def get_convo() -> sqlite3.Connection:
-    init_needed = not DB_PATH.exists()
-    conn = sqlite3.connect(DB_PATH.as_posix(), check_same_thread=False)
-    if init_needed:
-        conn.executescript(SCHEMA)
+# Recounts the rollups table from the rows in messages and feedback; run by
+# migration 6 and by analytics.rebuild(). Expects an empty rollups table.
+# Migration 6 has shipped with this text: change it by adding a migration.
+ROLLUP_BACKFILL = """
+INSERT INTO rollups (dim, key, questions, answers)
+SELECT 'intent', intent, SUM(role = 'user'), SUM(role = 'assistant') FROM messages GROUP BY intent
+UNION ALL
+SELECT 'day', substr(created_at, 1, 10), SUM(role = 'user'), SUM(role = 'assistant') FROM messages GROUP BY 2
+UNION ALL
+SELECT 'model', model, 0, COUNT(*) FROM messages WHERE model IS NOT NULL GROUP BY model
+UNION ALL
+SELECT 'prompt_version', prompt_version, 0, COUNT(*) FROM messages WHERE prompt_version IS NOT NULL GROUP BY prompt_version;
+
+INSERT INTO rollups (dim, key, upvotes, downvotes)
+SELECT dim, key, SUM(rating = 1), SUM(rating = -1) FROM (
+  SELECT 'intent' AS dim, m.intent AS key, f.rating AS rating FROM feedback f JOIN messages m ON m.id = f.message_id
+  UNION ALL SELECT 'day', substr(m.created_at, 1, 10), f.rating FROM feedback f JOIN messages m ON m.id = f.message_id
+  UNION ALL SELECT 'model', m.model, f.rating FROM feedback f JOIN messages m ON m.id = f.message_id
+  UNION ALL SELECT 'prompt_version', m.prompt_version, f.rating FROM feedback f JOIN messages m ON m.id = f.message_id
+)
+WHERE key IS NOT NULL
+GROUP BY dim, key
+ON CONFLICT (dim, key) DO UPDATE SET upvotes = excluded.upvotes, downvotes = excluded.downvotes;
+"""
+
+# Versioned schema changes, applied in order and tracked in PRAGMA user_version.
+# Append new entries; never edit one that has shipped. Each one runs in a
+# single write transaction after re-checking the version, so processes racing
+# to upgrade the same file apply it exactly once.
+MIGRATIONS: List[Tuple[int, str]] = [
+    (1, SCHEMA),
+    (2, """
+CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id, id);
+CREATE INDEX IF NOT EXISTS idx_messages_intent ON messages (intent);
+CREATE INDEX IF NOT EXISTS idx_feedback_message_id ON feedback (message_id);
+"""),
+    (3, """
+-- Prompt tokens of the content under the model's tokenizer, filled in lazily
+ALTER TABLE messages ADD COLUMN token_count INTEGER;
+"""),
+    (4, """
+CREATE TABLE IF NOT EXISTS summaries (
+  session_id TEXT PRIMARY KEY,
+  upto_message_id INTEGER NOT NULL,   -- last message folded into the summary
+  content TEXT NOT NULL,
+  updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+"""),
+    (5, """
+-- One row per answer: stage timings (tracing.py) and token counts
+CREATE TABLE IF NOT EXISTS metrics (
+  message_id INTEGER PRIMARY KEY,     -- the assistant message
+  session_id TEXT NOT NULL,
+  intent TEXT NOT NULL,
+  model TEXT NOT NULL,
+  cached INTEGER NOT NULL,            -- 1 if served from the answer cache
+  total_ms REAL NOT NULL,
+  ttft_ms REAL,
+  prompt_tokens INTEGER,
+  prompt_tokens_reused INTEGER,
+  completion_tokens INTEGER,
+  echo_fallback INTEGER NOT NULL DEFAULT 0,
+  spans TEXT NOT NULL,                -- JSON {stage: ms}
+  created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_metrics_created_at ON metrics (created_at);
+"""),
+    (6, """
+-- Which model and system prompt produced an answer (NULL on questions and older rows)
+ALTER TABLE messages ADD COLUMN model TEXT;
+ALTER TABLE messages ADD COLUMN prompt_version TEXT;
+
+-- Running counters per intent, day, model and prompt version (see analytics.py).
+-- Kept by the triggers below; deletes don't decrement, analytics.rebuild() recounts.
+CREATE TABLE IF NOT EXISTS rollups (
+  dim TEXT NOT NULL,                  -- 'intent' | 'day' | 'model' | 'prompt_version'
+  key TEXT NOT NULL,
+  questions INTEGER NOT NULL DEFAULT 0,
+  answers INTEGER NOT NULL DEFAULT 0,
+  upvotes INTEGER NOT NULL DEFAULT 0,
+  downvotes INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (dim, key)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS rollups_message AFTER INSERT ON messages
+BEGIN
+  INSERT INTO rollups (dim, key, questions, answers)
+  VALUES ('intent', NEW.intent, NEW.role = 'user', NEW.role = 'assistant'),
+         ('day', substr(NEW.created_at, 1, 10), NEW.role = 'user', NEW.role = 'assistant')
+  ON CONFLICT (dim, key) DO UPDATE SET
+    questions = questions + excluded.questions, answers = answers + excluded.answers;
+  INSERT INTO rollups (dim, key, answers)
+  SELECT 'model', NEW.model, 1 WHERE NEW.model IS NOT NULL
+  UNION ALL
+  SELECT 'prompt_version', NEW.prompt_version, 1 WHERE NEW.prompt_version IS NOT NULL
+  ON CONFLICT (dim, key) DO UPDATE SET answers = answers + excluded.answers;
+END;
+
+-- Feedback counts on the answer's intent, day, model and prompt version
+CREATE TRIGGER IF NOT EXISTS rollups_feedback AFTER INSERT ON feedback
+BEGIN
+  INSERT INTO rollups (dim, key, upvotes, downvotes)
+  SELECT dim, key, NEW.rating = 1, NEW.rating = -1 FROM (
+    SELECT 'intent' AS dim, intent AS key FROM messages WHERE id = NEW.message_id
+    UNION ALL SELECT 'day', substr(created_at, 1, 10) FROM messages WHERE id = NEW.message_id
+    UNION ALL SELECT 'model', model FROM messages WHERE id = NEW.message_id
+    UNION ALL SELECT 'prompt_version', prompt_version FROM messages WHERE id = NEW.message_id
+  )
+  WHERE key IS NOT NULL
+  ON CONFLICT (dim, key) DO UPDATE SET
+    upvotes = upvotes + excluded.upvotes, downvotes = downvotes + excluded.downvotes;
+END;
+""" + ROLLUP_BACKFILL),
+    (7, """
+-- Session messages moved out to the archive files (retention.py), one row per archived chunk
+CREATE TABLE IF NOT EXISTS archived_sessions (
+  session_id TEXT NOT NULL,
+  first_id INTEGER NOT NULL,          -- id range of the chunk's messages
+  last_id INTEGER NOT NULL,
+  archive TEXT NOT NULL,              -- file name in the archive directory
+  messages INTEGER NOT NULL,
+  archived_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (session_id, first_id)
+) WITHOUT ROWID;
+"""),
+    (8, """
+-- Full-text index over messages (search_messages). External content: the text
+-- lives once, in messages. session_id is indexed too: a session's uuid tokens
+-- are near unique, so filtering by session intersects two short posting lists.
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+  content, session_id,
+  content='messages', content_rowid='id', tokenize='porter unicode61'
+);
+
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+BEGIN
+  INSERT INTO messages_fts (rowid, content, session_id) VALUES (NEW.id, NEW.content, NEW.session_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+BEGIN
+  INSERT INTO messages_fts (messages_fts, rowid, content, session_id)
+  VALUES ('delete', OLD.id, OLD.content, OLD.session_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content, session_id ON messages
+BEGIN
+  INSERT INTO messages_fts (messages_fts, rowid, content, session_id)
+  VALUES ('delete', OLD.id, OLD.content, OLD.session_id);
+  INSERT INTO messages_fts (rowid, content, session_id) VALUES (NEW.id, NEW.content, NEW.session_id);
+END;
+
+INSERT INTO messages_fts (messages_fts) VALUES ('rebuild');
+"""),
+    (9, """
+-- A relabelled message (intent_classifier relabel --apply) moves its counts, feedback
+-- included, from the old intent's rollup to the new one
+CREATE TRIGGER IF NOT EXISTS rollups_message_intent AFTER UPDATE OF intent ON messages
+WHEN OLD.intent IS NOT NEW.intent
+BEGIN
+  UPDATE rollups SET
+    questions = questions - (OLD.role = 'user'),
+    answers = answers - (OLD.role = 'assistant'),
+    upvotes = upvotes - (SELECT COUNT(*) FROM feedback WHERE message_id = OLD.id AND rating = 1),
+    downvotes = downvotes - (SELECT COUNT(*) FROM feedback WHERE message_id = OLD.id AND rating = -1)
+  WHERE dim = 'intent' AND key = OLD.intent;
+  DELETE FROM rollups
+  WHERE dim = 'intent' AND key = OLD.intent AND questions = 0 AND answers = 0 AND upvotes = 0 AND downvotes = 0;
+  INSERT INTO rollups (dim, key, questions, answers, upvotes, downvotes)
+  VALUES (
+    'intent', NEW.intent, NEW.role = 'user', NEW.role = 'assistant',
+    (SELECT COUNT(*) FROM feedback WHERE message_id = NEW.id AND rating = 1),
+    (SELECT COUNT(*) FROM feedback WHERE message_id = NEW.id AND rating = -1)
+  )
+  ON CONFLICT (dim, key) DO UPDATE SET
+    questions = questions + excluded.questions, answers = answers + excluded.answers,
+    upvotes = upvotes + excluded.upvotes, downvotes = downvotes + excluded.downvotes;
+END;
+"""),
+    (10, """
+-- Tokens generated before an instruction echo was caught and thrown away (NULL on cache hits)
+ALTER TABLE metrics ADD COLUMN echo_discarded_tokens INTEGER;
+"""),
+]
+
+def _statements(script: str) -> Iterator[str]:
+    buf = ""
+    for line in script.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            yield buf
+            buf = ""
+    if buf.strip():
+        yield buf
+
+def migrate(conn: sqlite3.Connection, migrations: List[Tuple[int, str]], target: Optional[int] = None) -> int:
+    """Bring the database up to `target` (default: latest) and return its version."""
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, script in migrations:
+        if version <= current or (target is not None and version > target):
+            continue
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version > current:
+                for stmt in _statements(script):
+                    conn.execute(stmt)
+                conn.execute(f"PRAGMA user_version = {version}")
+                current = version
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+    return current
+
+class ConnectionPool:
+    """
+    A small pool of SQLite connections to one file. Streamlit runs every rerun
+    on a fresh thread, so connections are checked out per call rather than
+    kept thread-local. Each connection gets WAL and synchronous=NORMAL when
+    opened and keeps its own prepared-statement cache; migrations run once
+    per process. New files are created with incremental auto-vacuum, so
+    retention.py can hand freed pages back to the file system.
+    """
+
+    def __init__(self, path: Path, migrations: List[Tuple[int, str]], size: int = 8):
+        self.path = Path(path)
+        self.migrations = migrations
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self._closed = False
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path.as_posix(), check_same_thread=False, timeout=10.0, cached_statements=256)
+        # Only takes effect before the first table exists; older files need one full VACUUM
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._schema_ready:
+            with self._lock:
+                if not self._schema_ready:
+                    migrate(conn, self.migrations)
+                    self._schema_ready = True
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                if self._closed:
+                    raise queue.Full
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close_all(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pool = ConnectionPool(DB_PATH, MIGRATIONS)
+
+_FLUSH = ("", ())
+
+class WriteBehind:
+    """
+    Background writer that batches queued INSERTs into one transaction per
+    time/size window. Message ids are handed out from blocks reserved in the
+    database, so callers get them back immediately and other processes on
+    the same file (api.py next to the app) never get the same ones.
+    """
+
+    def __init__(self, interval_s: float = FLUSH_INTERVAL_S, batch_size: int = FLUSH_BATCH, id_block: int = ID_BLOCK):
+        self.interval_s = interval_s
+        self.batch_size = batch_size
+        self.id_block = max(1, id_block)
+        self._q: "queue.Queue[Optional[Tuple[str, tuple]]]" = queue.Queue()
+        self._id_lock = threading.Lock()
+        self._next_id = 1
+        self._block_end = 0
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def _reserve_ids(self) -> None:
+        """
+        Move the messages AUTOINCREMENT counter past a block of ids and keep
+        the block. Other write-behind processes reserve after it, and plain
+        INSERTs (synchronous mode) number their rows after it.
+        """
+        with get_convo() as conn:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                # sqlite_sequence also covers ids whose rows were since deleted
+                start = conn.execute(
+                    "SELECT MAX(COALESCE((SELECT MAX(id) FROM messages), 0), "
+                    "COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'messages'), 0)) + 1"
+                ).fetchone()[0]
+                end = start + self.id_block - 1
+                if not conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'messages'", (end,)).rowcount:
+                    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('messages', ?)", (end,))
+                conn.commit()
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+        self._next_id, self._block_end = start, end
+
+    def next_message_id(self) -> int:
+        with self._id_lock:
+            if self._next_id > self._block_end:
+                self._reserve_ids()
+            msg_id = self._next_id
+            self._next_id += 1
+            return msg_id
+
+    def enqueue(self, sql: str, params: tuple) -> None:
+        self._q.put((sql, params))
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            taken = [self._q.get()]
+            deadline = time.monotonic() + self.interval_s
+            # Collect until the window closes, the batch is full, or a flush/close marker arrives
+            while taken[-1] is not None and taken[-1] is not _FLUSH and len(taken) < self.batch_size:
+                try:
+                    taken.append(self._q.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            stop = taken[-1] is None
+            batch = [t for t in taken if t is not None and t is not _FLUSH]
+            if batch:
+                self._write(batch)
+            for _ in taken:
+                self._q.task_done()
+
+    def _write(self, batch: List[Tuple[str, tuple]]) -> None:
+        with get_convo() as conn:
+            try:
+                with conn:
+                    for sql, params in batch:
+                        conn.execute(sql, params)
+            except sqlite3.Error:
+                # One bad row shouldn't take the whole batch down with it
+                for sql, params in batch:
+                    try:
+                        with conn:
+                            conn.execute(sql, params)
+                    except sqlite3.Error:
+                        log.exception("write-behind insert failed: %s %r", sql, params)
+
+    def flush(self) -> None:
+        """Commit everything queued so far without waiting out the window."""
+        if self._q.unfinished_tasks:
+            self._q.put(_FLUSH)
+            self._q.join()
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._q.put(None)
+            self._q.join()
+            self._thread.join()
+
+_writer: Optional[WriteBehind] = None
+_writer_lock = threading.Lock()
+
+def _get_writer() -> Optional[WriteBehind]:
+    global _writer
+    if not WRITE_BEHIND:
+        return None
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = WriteBehind()
+    return _writer
+
+def flush_writes() -> None:
+    """Wait for pending write-behind inserts; a no-op in synchronous mode."""
+    if _writer is not None:
+        _writer.flush()
+
+def _utc_now() -> str:
+    # Same format as SQLite's CURRENT_TIMESTAMP, taken when the write is queued
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+def use_database(path: Path, migrations: Optional[List[Tuple[int, str]]] = None) -> None:
+    """Point the module at another database file (benchmarks, maintenance scripts)."""
+    global _pool, _writer, DB_PATH
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+    _pool.close_all()
+    DB_PATH = Path(path)
+    _pool = ConnectionPool(DB_PATH, MIGRATIONS if migrations is None else migrations)
+
+def get_convo():
+    """Check out a pooled connection: `with get_convo() as conn: ...`."""
+    return _pool.connection()
+
+def close_db() -> None:
+    """Flush pending writes and close every idle pooled connection (called at interpreter exit)."""
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+    _pool.close_all()
+
+atexit.register(close_db)
+
+def add_message(
+    session_id: str,
+    role: str,
+    intent: str,
+    content: str,
+    model: Optional[str] = None,
+    prompt_version: Optional[str] = None,
+) -> int:
+    writer = _get_writer()
+    if writer is not None:
+        msg_id = writer.next_message_id()
+        writer.enqueue(
+            "INSERT INTO messages (id, session_id, role, intent, content, model, prompt_version, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (msg_id, session_id, role, intent, content, model, prompt_version, _utc_now()),
+        )
+        return msg_id
+    with get_convo() as conn:
+        cur = conn.execute(
+            "INSERT INTO messages (session_id, role, intent, content, model, prompt_version) VALUES (?, ?, ?, ?, ?, ?)",
+            (session_id, role, intent, content, model, prompt_version),
+        )
         conn.commit()
-    return conn
-
-def add_message(session_id: str, role: str, intent: str, content: str) -> int:
-    conn = get_convo()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO messages (session_id, role, intent, content) VALUES (?, ?, ?, ?)",
-        (session_id, role, intent, content),
-    )
-    conn.commit()
-    return cur.lastrowid
+        return cur.lastrowid
 
 def get_history(session_id: str, limit: int = 10) -> List[Tuple]:
-    conn = get_convo()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, role, intent, content, created_at FROM messages "
-        "WHERE session_id = ? ORDER BY id DESC LIMIT ?",
-        (session_id, limit),
-    )
-    return cur.fetchall()[::-1]
+    flush_writes()
+    with get_convo() as conn:
+        rows = conn.execute(
+            "SELECT id, role, intent, content, created_at FROM messages "
+            "WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+            (session_id, limit),
+        ).fetchall()
+    return rows[::-1]
+
+def get_history_page(session_id: str, before_id: Optional[int] = None, limit: int = 20) -> Tuple[List[Tuple], Optional[int]]:
+    """
+    Keyset page of a session's messages: the `limit` newest with id < before_id
+    (the newest overall without it), oldest first, plus the cursor for the next
+    older page (None when there is none). A range seek on idx_messages_session_id,
+    so page 1000 costs what page 1 does.
+    """
+    flush_writes()
+    with get_convo() as conn:
+        rows = conn.execute(
+            "SELECT id, role, intent, content, created_at FROM messages "
+            "WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (session_id, before_id if before_id is not None else 2**63 - 1, limit + 1),
+        ).fetchall()
+    more = len(rows) > limit
+    page = rows[:limit][::-1]
+    return page, (page[0][0] if more else None)
+
+_SEARCH_TERM = re.compile(r"\w+")
+# Words in most messages: bm25 gives them no weight, yet counts every row
+# holding them before it can score anything, so they are left out of queries
+STOPWORDS = frozenset("""
+a about an and are as at be but by can do for from how i in is it me my of on or
+should so that the this to was what when where which who why will with you your
+""".split())
+# Newest matches looked at to tell whether a word is in most messages
+_DENSITY_PROBE = 256
+
+def _query_terms(text: str) -> List[str]:
+    # User text becomes quoted terms, so FTS5 operators and syntax errors can't
+    # leak in. No prefix queries: the porter stemmer already folds word forms,
+    # and a short prefix would merge thousands of posting lists per lookup.
+    words = _SEARCH_TERM.findall(text.lower())
+    return ['"' + w + '"' for w in ([w for w in words if w not in STOPWORDS] or words)]
+
+def _is_dense(conn: sqlite3.Connection, term: str) -> bool:
+    """Whether `term` is in over half the newest messages, where bm25's idf bottoms out."""
+    n, span = conn.execute(
+        "SELECT count(*), max(rowid) - min(rowid) + 1 FROM ("
+        "  SELECT rowid FROM messages_fts WHERE messages_fts MATCH ? ORDER BY rowid DESC LIMIT ?"
+        ")",
+        ("{content}: " + term, _DENSITY_PROBE),
+    ).fetchone()
+    return n == _DENSITY_PROBE and span < 2 * n
+
+def search_messages(
+    query: str,
+    intent: Optional[str] = None,
+    session_id: Optional[str] = None,
+    limit: int = 20,
+) -> List[Dict[str, Any]]:
+    """
+    Messages matching the words of `query`, optionally only of one intent and/or
+    session, best bm25 first. Only the newest SEARCH_WINDOW matches are scored,
+    so ranking and snippets cost the same at any database size. Words in most
+    messages are dropped like stop words (if the query has nothing else, its
+    matches come newest first, unscored). Each hit carries a `snippet` of the
+    content with the matched terms between SNIPPET_OPEN and SNIPPET_CLOSE.
+    """
+    terms = _query_terms(query)
+    if not terms:
+        return []
+    cols = ("id", "session_id", "role", "intent", "created_at", "snippet", "score")
+    flush_writes()
+    with get_convo() as conn:
+        # bm25 counts every row holding each word before it scores one, so a word
+        # in half the table would cost more than the rest of the search
+        ranked = [t for t in terms if not _is_dense(conn, t)]
+        match = "{content}: (" + " ".join(ranked or terms) + ")"
+        if session_id:
+            match += ' AND {session_id}: "' + session_id.replace('"', '""') + '"'
+        score = "bm25(messages_fts, 1.0, 0.0)" if ranked else "NULL"
+        # The window streams newest first (intent is a column check on the way,
+        # as its tokens are in a good share of all rows); the snippet then runs
+        # for the top `limit` only, each one a rowid seek into the index
+        rows = conn.execute(
+            "SELECT m.id, m.session_id, m.role, m.intent, m.created_at, "
+            "snippet(messages_fts, 0, ?, ?, '…', 16), hits.score FROM ("
+            "  SELECT rowid, score FROM ("
+            f"    SELECT messages_fts.rowid, {score} AS score FROM messages_fts"
+            "    JOIN messages w ON w.id = messages_fts.rowid"
+            "    WHERE messages_fts MATCH ? AND w.intent = coalesce(?, w.intent)"
+            "    ORDER BY messages_fts.rowid DESC LIMIT ?"
+            "  ) ORDER BY score, rowid DESC LIMIT ?"
+            ") AS hits "
+            "CROSS JOIN messages_fts ON messages_fts.rowid = hits.rowid AND messages_fts MATCH ? "
+            "JOIN messages m ON m.id = hits.rowid "
+            "ORDER BY hits.score, hits.rowid DESC",
+            (SNIPPET_OPEN, SNIPPET_CLOSE, match, intent or None,
+             SEARCH_WINDOW if SEARCH_WINDOW > 0 else -1, limit, match),
+        ).fetchall()
+    return [dict(zip(cols, r)) for r in rows]
+
+def count_messages_after(session_id: str, after_id: int) -> int:
+    flush_writes()
+    with get_convo() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM messages WHERE session_id = ? AND id > ?",
+            (session_id, after_id),
+        ).fetchone()[0]
+
+def get_messages_after(session_id: str, after_id: int) -> List[Tuple]:
+    """A session's messages with id > after_id, oldest first."""
+    flush_writes()
+    with get_convo() as conn:
+        return conn.execute(
+            "SELECT id, role, intent, content, created_at FROM messages "
+            "WHERE session_id = ? AND id > ? ORDER BY id",
+            (session_id, after_id),
+        ).fetchall()
+
+def get_summary(session_id: str) -> Optional[Tuple[int, str]]:
+    """(upto_message_id, content) of the session's rolling summary, if any."""
+    with get_convo() as conn:
+        return conn.execute(
+            "SELECT upto_message_id, content FROM summaries WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+
+def save_summary(session_id: str, upto_message_id: int, content: str) -> bool:
+    """Store a summary unless its last message is gone (history cleared meanwhile)."""
+    with get_convo() as conn:
+        cur = conn.execute(
+            "INSERT INTO summaries (session_id, upto_message_id, content, updated_at) "
+            "SELECT ?, ?, ?, CURRENT_TIMESTAMP WHERE EXISTS "
+            "(SELECT 1 FROM messages WHERE id = ? AND session_id = ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET upto_message_id = excluded.upto_message_id, "
+            "content = excluded.content, updated_at = excluded.updated_at",
+            (session_id, upto_message_id, content, upto_message_id, session_id),
+        )
+        conn.commit()
+        return cur.rowcount > 0
+
+def clear_history(session_id: str) -> None:
+    """Delete a session's messages, their feedback and its summary."""
+    flush_writes()
+    with get_convo() as conn:
+        conn.execute(
+            "DELETE FROM feedback WHERE message_id IN (SELECT id FROM messages WHERE session_id = ?)",
+            (session_id,),
+        )
+        conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+        conn.commit()
+
+def get_token_counts(message_ids: List[int]) -> Dict[int, int]:
+    """Cached token counts for the given messages (ids without one are left out)."""
+    if not message_ids:
+        return {}
+    marks = ",".join("?" * len(message_ids))
+    with get_convo() as conn:
+        rows = conn.execute(
+            f"SELECT id, token_count FROM messages WHERE id IN ({marks}) AND token_count IS NOT NULL",
+            list(message_ids),
+        ).fetchall()
+    return dict(rows)
+
+def save_token_counts(counts: Dict[int, int]) -> None:
+    if not counts:
+        return
+    with get_convo() as conn:
+        conn.executemany(
+            "UPDATE messages SET token_count = ? WHERE id = ?",
+            [(n, msg_id) for msg_id, n in counts.items()],
+        )
+        conn.commit()
 
 def add_feedback(message_id: int, rating: int, comment: Optional[str]) -> None:
-    conn = get_convo()
-    conn.execute(
-        "INSERT INTO feedback (message_id, rating, comment) VALUES (?, ?, ?)",
-        (message_id, rating, comment),
+    writer = _get_writer()
+    if writer is not None:
+        writer.enqueue(
+            "INSERT INTO feedback (message_id, rating, comment, created_at) VALUES (?, ?, ?, ?)",
+            (message_id, rating, comment, _utc_now()),
+        )
+        return
+    with get_convo() as conn:
+        conn.execute(
+            "INSERT INTO feedback (message_id, rating, comment) VALUES (?, ?, ?)",
+            (message_id, rating, comment),
+        )
+        conn.commit()
+
+METRIC_COLUMNS = (
+    "message_id", "session_id", "intent", "model", "cached", "total_ms", "ttft_ms",
+    "prompt_tokens", "prompt_tokens_reused", "completion_tokens", "echo_fallback", "echo_discarded_tokens", "spans",
+)
+
+def add_metrics(row: Dict[str, Any]) -> None:
+    """Store one answer's trace; `row` has the METRIC_COLUMNS keys."""
+    params = tuple(row[c] for c in METRIC_COLUMNS) + (_utc_now(),)
+    sql = (
+        f"INSERT OR REPLACE INTO metrics ({', '.join(METRIC_COLUMNS)}, created_at) "
+        f"VALUES ({', '.join('?' * (len(METRIC_COLUMNS) + 1))})"
     )
-    conn.commit()
+    writer = _get_writer()
+    if writer is not None:
+        writer.enqueue(sql, params)
+        return
+    with get_convo() as conn:
+        conn.execute(sql, params)
+        conn.commit()
+
+def get_metrics(since: Optional[str] = None, limit: int = 10_000) -> List[Dict[str, Any]]:
+    """The most recent traces (created_at >= since, 'YYYY-MM-DD HH:MM:SS' UTC), newest first."""
+    flush_writes()
+    cols = METRIC_COLUMNS + ("created_at",)
+    with get_convo() as conn:
+        rows = conn.execute(
+            f"SELECT {', '.join(cols)} FROM metrics WHERE created_at >= ? ORDER BY message_id DESC LIMIT ?",
+            (since or "", limit),
+        ).fetchall()
+    return [dict(zip(cols, r)) for r in rows]
 
 def get_feedback_summary(session_id: str) -> Dict[str, Any]:
-    conn = get_convo()
     q = """
     SELECT m.intent,
            SUM(CASE WHEN f.rating = 1 THEN 1 ELSE 0 END) as upvotes,
@@ -74,5 +730,14 @@ def get_feedback_summary(session_id: str) -> Dict[str, Any]:
     GROUP BY m.intent
     ORDER BY upvotes - downvotes DESC
     """
-    rows = conn.execute(q, (session_id,)).fetchall()
+    flush_writes()
+    with get_convo() as conn:
+        rows = conn.execute(q, (session_id,)).fetchall()
     return {"by_intent": rows}
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1:
+        use_database(Path(sys.argv[1]))
+    with get_convo() as conn:
+        print(f"{DB_PATH}: schema version {conn.execute('PRAGMA user_version').fetchone()[0]}")
@@ -0,0 +1,115 @@
+# generation_jobs.py
+"""
+Answer generation as background jobs, at most one live job per session. The
+Streamlit script starts a job and carries on; a fragment polls it and renders
+the text as it grows. Starting a new job for a session cancels the one in
+flight, and cancel() stops llama.cpp at the next token, so no compute goes
+to answers nobody will read. A finished job stores its own answer, so it
+isn't lost when the page goes away mid-answer.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+import itertools
+import logging
+import threading
+import time
+
+import service
+from inference import PoolBusy
+from model import GenerationStats
+
+# Finished jobs nobody collected are dropped after this long
+KEEP_FINISHED_S = 600.0
+
+log = logging.getLogger(__name__)
+
+_ids = itertools.count(1)
+
+@dataclass
+class GenerationJob:
+    job_id: int
+    question: service.Question
+    text: str = ""
+    state: str = "running"            # running | done | cancelled | error
+    error: Optional[str] = None
+    assistant_id: Optional[int] = None
+    stats: GenerationStats = field(default_factory=GenerationStats)
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: Optional[float] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+
+    @property
+    def session_id(self) -> str:
+        return self.question.session_id
+
+    @property
+    def intent(self) -> str:
+        return self.question.intent
+
+    @property
+    def running(self) -> bool:
+        return self.state == "running"
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+_jobs: Dict[str, GenerationJob] = {}
+_lock = threading.Lock()
+
+def _run(job: GenerationJob) -> None:
+    try:
+        for piece in service.generate(job.question, job.stats, job.cancel_event):
+            job.text = "" if piece is None else job.text + piece
+        if job.cancel_event.is_set():
+            job.state = "cancelled"
+            return
+        answer = job.text.strip()
+        if not answer:
+            job.state, job.error = "error", "The model returned an empty answer."
+            return
+        job.assistant_id = service.save_answer(job.question, answer, job.stats)
+        job.text = answer
+        job.state = "done"
+    except PoolBusy:
+        job.state, job.error = "error", "The local model is busy with other questions. Please try again in a moment."
+    except TimeoutError:
+        job.state, job.error = "error", "The answer took too long and was stopped. Try fewer max tokens."
+    except Exception as e:
+        log.exception("generation job %s failed", job.job_id)
+        job.state, job.error = "error", f"Generation failed: {e}"
+    finally:
+        job.finished_at = time.monotonic()
+
+def start(question: service.Question) -> GenerationJob:
+    """Start generating the answer to a prepared question, superseding the session's running job."""
+    session_id = question.session_id
+    job = GenerationJob(next(_ids), question)
+    now = time.monotonic()
+    with _lock:
+        previous = _jobs.get(session_id)
+        _jobs[session_id] = job
+        stale = [sid for sid, j in _jobs.items() if j.finished_at is not None and now - j.finished_at > KEEP_FINISHED_S]
+        for sid in stale:
+            del _jobs[sid]
+    if previous is not None and previous.running:
+        previous.cancel()
+    threading.Thread(
+        target=_run,
+        args=(job,),
+        name=f"generate-{job.job_id}",
+        daemon=True,
+    ).start()
+    return job
+
+def current(session_id: str) -> Optional[GenerationJob]:
+    """The session's latest job, running or finished."""
+    with _lock:
+        return _jobs.get(session_id)
+
+def cancel(session_id: str) -> bool:
+    job = current(session_id)
+    if job is None or not job.running:
+        return False
+    job.cancel()
+    return True
@@ -0,0 +1,193 @@
+# inference.py
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import queue
+import threading
+import time
+
+class PoolBusy(RuntimeError):
+    """Raised when the request queue is full; callers should ask the user to retry."""
+
+    def __init__(self, queue_depth: int):
+        super().__init__(f"Inference queue is full ({queue_depth} requests waiting)")
+        self.queue_depth = queue_depth
+
+_DONE = object()
+
+class Job:
+    """One queued request. The worker emits items; the client iterates them."""
+
+    def __init__(self, fn: Callable[[Any, "Job"], None], timeout_s: float, cancel: Optional[threading.Event] = None):
+        self.fn = fn
+        self.submitted_at = time.perf_counter()
+        self.deadline = self.submitted_at + timeout_s
+        self.started_at: Optional[float] = None
+        self.cancelled = threading.Event()
+        self._external_cancel = cancel  # set by whoever started the request to abandon it
+        self._out: "queue.Queue[Any]" = queue.Queue()
+
+    @property
+    def wait_s(self) -> float:
+        end = self.started_at if self.started_at is not None else time.perf_counter()
+        return end - self.submitted_at
+
+    def emit(self, item: Any) -> None:
+        self._out.put(item)
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+
+    def is_cancelled(self) -> bool:
+        return self.cancelled.is_set() or (self._external_cancel is not None and self._external_cancel.is_set())
+
+    def should_stop(self) -> bool:
+        return self.is_cancelled() or time.perf_counter() > self.deadline
+
+class InferencePool:
+    """
+    A fixed set of worker threads, each owning its own model instance built by
+    `factory`. llama.cpp releases the GIL while it evaluates, so workers run in
+    parallel, and with use_mmap the GGUF weights are shared through the page cache.
+    Requests wait in a bounded queue; when it is full, submit() raises PoolBusy.
+    """
+
+    def __init__(self, factory: Callable[[], Any], workers: int = 1, max_queue: int = 8, timeout_s: float = 180.0):
+        self.factory = factory
+        self.workers = max(1, workers)
+        self.timeout_s = timeout_s
+        self._queue: "queue.Queue[Optional[Job]]" = queue.Queue(maxsize=max_queue)
+        self._closing = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._started_at = time.perf_counter()
+        self._busy_s = 0.0
+        self._busy_now = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._waits = 0
+        self._wait_total_s = 0.0
+        self._wait_max_s = 0.0
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"inference-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _worker(self) -> None:
+        llm, load_error = None, None
+        try:
+            llm = self.factory()
+        except Exception as e:
+            load_error = e
+        while True:
+            # After shutdown() a worker drains what is queued and exits instead of waiting for more
+            try:
+                job = self._queue.get_nowait() if self._closing.is_set() else self._queue.get()
+            except queue.Empty:
+                return
+            if job is None:  # shutdown(); dropping llm frees the model instance
+                try:
+                    self._queue.put_nowait(None)  # wake the next idle worker
+                except queue.Full:
+                    pass
+                return
+            job.started_at = time.perf_counter()
+            with self._lock:
+                self._waits += 1
+                self._wait_total_s += job.wait_s
+                self._wait_max_s = max(self._wait_max_s, job.wait_s)
+            if load_error is not None:
+                job.emit(load_error)
+                job.emit(_DONE)
+                continue
+            if job.should_stop():
+                if not job.is_cancelled():
+                    with self._lock:
+                        self._timed_out += 1
+                    job.emit(TimeoutError("Request timed out waiting for a model worker"))
+                job.emit(_DONE)
+                continue
+
+            with self._lock:
+                self._busy_now += 1
+            try:
+                job.fn(llm, job)
+            except Exception as e:
+                job.emit(e)
+            finally:
+                with self._lock:
+                    self._busy_now -= 1
+                    self._busy_s += time.perf_counter() - job.started_at
+                    self._completed += 1
+                job.emit(_DONE)
+
+    def submit(
+        self,
+        fn: Callable[[Any, Job], None],
+        timeout_s: Optional[float] = None,
+        cancel: Optional[threading.Event] = None,
+    ) -> Job:
+        """Queue `fn(llm, job)`; setting `cancel` drops the job if queued and stops it if running."""
+        self._ensure_started()
+        job = Job(fn, timeout_s if timeout_s is not None else self.timeout_s, cancel)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise PoolBusy(self._queue.qsize())
+        return job
+
+    def results(self, job: Job) -> Iterator[Any]:
+        """Yield what the job emits; cancels it if the consumer stops early or time runs out."""
+        try:
+            while True:
+                remaining = job.deadline - time.perf_counter()
+                try:
+                    item = job._out.get(timeout=max(remaining, 0.0) + 1.0)
+                except queue.Empty:
+                    with self._lock:
+                        self._timed_out += 1
+                    raise TimeoutError("Model worker did not answer in time")
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            job.cancel()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the workers once the jobs already queued are done. Never blocks unless `wait`."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        self._closing.set()
+        try:
+            # Wakes workers idle on an empty queue; with a full one they see _closing when it runs dry
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        if wait:
+            for t in threads:
+                t.join()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = time.perf_counter() - self._started_at
+            return {
+                "workers": self.workers,
+                "busy_workers": self._busy_now,
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "avg_wait_s": self._wait_total_s / self._waits if self._waits else 0.0,
+                "max_wait_s": self._wait_max_s,
+                "utilization": self._busy_s / (elapsed * self.workers) if elapsed > 0 else 0.0,
+            }
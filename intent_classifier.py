@@ -0,0 +1,239 @@
+# intent_classifier.py
+"""
+Optional local intent classifier: hashed word/char n-gram features and a
+multinomial logistic regression, trained from stored questions whose answer
+was rated up plus the labeled corpus. The keyword router in
+intents.py stays in charge whenever the classifier isn't confident.
+
+    python -m intent_classifier train [--holdout 0.2]
+    python -m intent_classifier eval  [--corpus benchmarks/data/intent_corpus.tsv]
+    python -m intent_classifier relabel [--apply]
+"""
+from __future__ import annotations
+import argparse
+import json
+import math
+import os
+import random
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from intents import INTENT_DEFS, _normalize, find_intent
+
+MODEL_PATH = Path(os.getenv("CAREERGUIDE_INTENT_MODEL", "models/intent_classifier.json"))
+CONFIDENCE = float(os.getenv("CAREERGUIDE_INTENT_CONFIDENCE", "0.6"))
+CORPUS_PATH = Path(__file__).resolve().parent / "benchmarks" / "data" / "intent_corpus.tsv"
+
+DIM = 1 << 18
+LABELS = [i.name for i in INTENT_DEFS]
+
+def features(text: str) -> Dict[int, float]:
+    """Hashed word unigrams, bigrams and char trigrams, L2-normalized."""
+    words = _normalize(text).split()
+    grams = [f"w:{w}" for w in words]
+    grams += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    for w in words:
+        padded = f"<{w}>"
+        grams += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    feats: Dict[int, float] = {}
+    for g in grams:
+        idx = zlib.crc32(g.encode("utf-8")) & (DIM - 1)
+        feats[idx] = feats.get(idx, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in feats.values())) or 1.0
+    return {k: v / norm for k, v in feats.items()}
+
+class IntentClassifier:
+    def __init__(self, labels: List[str], weights: Optional[Dict[int, List[float]]] = None, bias: Optional[List[float]] = None):
+        self.labels = labels
+        self.weights = weights or {}
+        self.bias = bias or [0.0] * len(labels)
+
+    def _probs(self, feats: Dict[int, float]) -> List[float]:
+        logits = list(self.bias)
+        for idx, val in feats.items():
+            row = self.weights.get(idx)
+            if row is not None:
+                for c, w in enumerate(row):
+                    logits[c] += w * val
+        top = max(logits)
+        exps = [math.exp(x - top) for x in logits]
+        total = sum(exps)
+        return [e / total for e in exps]
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        probs = self._probs(features(text))
+        best = max(range(len(probs)), key=probs.__getitem__)
+        return self.labels[best], probs[best]
+
+    def predict_batch(self, texts: List[str]) -> List[Tuple[str, float]]:
+        return [self.predict(t) for t in texts]
+
+    def fit(self, examples: List[Tuple[str, str, float]], epochs: int = 20, lr: float = 0.5, l2: float = 1e-5, seed: int = 13) -> None:
+        """Plain SGD on (text, label, weight) examples."""
+        data = [(features(text), self.labels.index(label), weight) for text, label, weight in examples]
+        rnd = random.Random(seed)
+        n = len(self.labels)
+        for epoch in range(epochs):
+            rnd.shuffle(data)
+            step = lr / (1.0 + epoch * 0.2)
+            for feats, y, weight in data:
+                probs = self._probs(feats)
+                grad = [probs[c] - (1.0 if c == y else 0.0) for c in range(n)]
+                for c in range(n):
+                    self.bias[c] -= step * weight * grad[c]
+                for idx, val in feats.items():
+                    row = self.weights.setdefault(idx, [0.0] * n)
+                    for c in range(n):
+                        row[c] -= step * (weight * grad[c] * val + l2 * row[c])
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {
+            "dim": DIM,
+            "labels": self.labels,
+            "bias": self.bias,
+            "weights": {str(k): [round(w, 6) for w in v] for k, v in self.weights.items()},
+        }
+        path.write_text(json.dumps(payload), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path: Path) -> "IntentClassifier":
+        payload = json.loads(path.read_text(encoding="utf-8"))
+        if payload.get("dim") != DIM:
+            raise ValueError(f"{path} was trained with a different feature size")
+        weights = {int(k): v for k, v in payload["weights"].items()}
+        return cls(payload["labels"], weights, payload["bias"])
+
+_model: Optional[IntentClassifier] = None
+_model_loaded = False
+
+def get_classifier() -> Optional[IntentClassifier]:
+    """The trained model, or None when no model file has been trained yet."""
+    global _model, _model_loaded
+    if not _model_loaded:
+        _model = IntentClassifier.load(MODEL_PATH) if MODEL_PATH.exists() else None
+        _model_loaded = True
+    return _model
+
+def route_with(model: IntentClassifier, text: str) -> str:
+    label, confidence = model.predict(text)
+    return label if confidence >= CONFIDENCE else find_intent(text)
+
+def route(text: str) -> str:
+    """Classifier label when it is confident, otherwise the keyword router."""
+    model = get_classifier()
+    return route_with(model, text) if model is not None else find_intent(text)
+
+# --- Training data ---
+
+def load_corpus(path: Path = CORPUS_PATH) -> List[Tuple[str, str, float]]:
+    rows = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if line.strip() and not line.startswith("#"):
+            label, text = line.split("\t", 1)
+            rows.append((text, label, 1.0))
+    return rows
+
+def load_history() -> List[Tuple[str, str, float]]:
+    """
+    User questions with the intent they were routed to, where the answer was
+    rated up. Unrated ones are left out: their intent is only the rule
+    router's guess (often its fall-through to general_guidance), which is
+    what the classifier is there to improve on. Questions whose answer was
+    rated down are left out too, since the routing may be what went wrong.
+    """
+    from db import get_convo, flush_writes
+    flush_writes()
+    q = """
+    SELECT u.content, u.intent
+    FROM messages u
+    JOIN messages a ON a.id = (
+        SELECT MIN(id) FROM messages
+        WHERE session_id = u.session_id AND id > u.id AND role = 'assistant'
+    )
+    JOIN feedback f ON f.message_id = a.id AND f.rating != 0
+    WHERE u.role = 'user'
+    GROUP BY u.id
+    HAVING SUM(f.rating) > 0
+    """
+    with get_convo() as conn:
+        rows = conn.execute(q).fetchall()
+    return [(content, intent, 1.0) for content, intent in rows if intent in LABELS]
+
+def _accuracy(model: IntentClassifier, examples: List[Tuple[str, str, float]]) -> Dict[str, float]:
+    if not examples:
+        return {}
+    t0 = time.perf_counter()
+    predicted = model.predict_batch([text for text, _label, _w in examples])
+    elapsed = time.perf_counter() - t0
+    routed = [route_with(model, text) for text, _label, _w in examples]
+    return {
+        "examples": len(examples),
+        "classifier_accuracy": round(sum(p[0] == e[1] for p, e in zip(predicted, examples)) / len(examples), 4),
+        "routed_accuracy": round(sum(r == e[1] for r, e in zip(routed, examples)) / len(examples), 4),
+        "rules_accuracy": round(sum(find_intent(e[0]) == e[1] for e in examples) / len(examples), 4),
+        "us_per_query": round(elapsed / len(examples) * 1e6, 1),
+    }
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    t = sub.add_parser("train", help="train from stored messages + the labeled corpus")
+    t.add_argument("--corpus", type=Path, default=CORPUS_PATH)
+    t.add_argument("--no-history", action="store_true", help="train on the corpus only")
+    t.add_argument("--holdout", type=float, default=0.0, help="fraction kept out of training for evaluation")
+    t.add_argument("--epochs", type=int, default=20)
+    t.add_argument("--out", type=Path, default=MODEL_PATH)
+    e = sub.add_parser("eval", help="evaluate the saved model on a labeled TSV")
+    e.add_argument("--corpus", type=Path, default=CORPUS_PATH)
+    r = sub.add_parser("relabel", help="re-route stored questions (and their answers) in batch")
+    r.add_argument("--apply", action="store_true", help="write the new intents back to the database")
+    r.add_argument("--batch", type=int, default=1000)
+    args = ap.parse_args()
+
+    if args.cmd == "train":
+        examples = load_corpus(args.corpus) + ([] if args.no_history else load_history())
+        random.Random(3).shuffle(examples)
+        cut = int(len(examples) * (1 - args.holdout))
+        model = IntentClassifier(LABELS)
+        t0 = time.perf_counter()
+        model.fit(examples[:cut], epochs=args.epochs)
+        model.save(args.out)
+        report = {"trained_on": cut, "train_s": round(time.perf_counter() - t0, 2), "saved": str(args.out)}
+        if cut < len(examples):
+            report["holdout"] = _accuracy(model, examples[cut:])
+        print(json.dumps(report, indent=2))
+    elif args.cmd == "eval":
+        model = get_classifier()
+        if model is None:
+            raise SystemExit(f"No model at {MODEL_PATH}; run `python -m intent_classifier train` first")
+        print(json.dumps(_accuracy(model, load_corpus(args.corpus)), indent=2))
+    elif args.cmd == "relabel":
+        from db import get_convo
+        model = get_classifier()
+        if model is None:
+            raise SystemExit(f"No model at {MODEL_PATH}; run `python -m intent_classifier train` first")
+        changed = []
+        with get_convo() as conn:
+            cur = conn.execute("SELECT id, intent, content FROM messages WHERE role = 'user' ORDER BY id")
+            while True:
+                rows = cur.fetchmany(args.batch)
+                if not rows:
+                    break
+                labels = [route_with(model, content) for _id, _intent, content in rows]
+                changed += [(new, msg_id) for (msg_id, old, _c), new in zip(rows, labels) if new != old]
+            if args.apply and changed:
+                # The answer to a question carries the question's intent
+                conn.executemany(
+                    "UPDATE messages SET intent = ?1 WHERE id = ?2 OR id = ("
+                    "SELECT MIN(a.id) FROM messages a JOIN messages u ON u.id = ?2 "
+                    "WHERE a.session_id = u.session_id AND a.id > u.id AND a.role = 'assistant')",
+                    changed,
+                )
+                conn.commit()
+        print(json.dumps({"changed": len(changed), "applied": bool(args.apply)}, indent=2))
+
+if __name__ == "__main__":
+    main()
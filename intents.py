@@ -1,7 +1,7 @@
 
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Optional, List
+from typing import Optional, List, Tuple
 import re
 
 @dataclass
@@ -69,24 +69,51 @@ def _normalize(text: str) -> str:
     t = (text or "").lower()
     t = t.replace("read map", "roadmap").replace("road map", "roadmap")
     t = PUNCT_RE.sub(" ", t)
-    t = re.sub(r"\s+", " ", t).strip()
-    return t
+    return " ".join(t.split())
 
-def _contains_any(haystack: str, needles: list[str]) -> bool:
-    return any(n in haystack for n in needles)
+# --- Compiled matcher ---
+# Every RULES keyword goes into one alternation, built once at import. Keywords
+# are normalized like the text, matched from a word start and may carry a
+# plural/verb suffix ("interviews", "learning"), so "ats" no longer hits "stats".
+
+_PRIORITY = {name: rank for rank, (name, _keys) in enumerate(RULES)}
+
+def _compile_rules():
+    owners: dict = {}
+    for name, keys in RULES:
+        for key in keys:
+            names = owners.setdefault(_normalize(key), [])
+            if name not in names:
+                names.append(name)
+    # Longest first, so "mock interview" wins over "interview" at the same position
+    alternation = "|".join(re.escape(k) for k in sorted(owners, key=len, reverse=True))
+    return re.compile(rf"\b({alternation})(?:s|es|ed|ing|er|ers)?\b"), owners
+
+_KEYWORD_RE, _KEYWORD_OWNERS = _compile_rules()
+
+def rank_intents(text: str) -> List[Tuple[str, float]]:
+    """
+    All matching intents with scores, best first. A keyword scores one point
+    per word, so specific phrases outweigh single words; ties keep the RULES
+    order. Empty when nothing matches.
+    """
+    scores: dict = {}
+    for m in _KEYWORD_RE.finditer(_normalize(text)):
+        key = m.group(1)
+        weight = float(key.count(" ") + 1)
+        for name in _KEYWORD_OWNERS[key]:
+            scores[name] = scores.get(name, 0.0) + weight
+    return sorted(scores.items(), key=lambda kv: (-kv[1], _PRIORITY[kv[0]]))
 
 # --- Public API -----
 
 def find_intent(text: str) -> str:
     """
     Deterministic keyword router with light normalization.
-    Falls back to 'general_guidance' if nothing matches.
+    Picks the highest-scoring intent; falls back to 'general_guidance' if nothing matches.
     """
-    t = _normalize(text)
-    for name, keys in RULES:
-        if _contains_any(t, keys):
-            return name
-    return "general_guidance"
+    ranked = rank_intents(text)
+    return ranked[0][0] if ranked else "general_guidance"
 
 def make_system_preamble(intent: str, user_query: str) -> str:
     """
@@ -105,4 +132,28 @@ def make_system_preamble(intent: str, user_query: str) -> str:
         "Do not repeat or reference any instructions."
     )
 
+def compose_user_prompt(intent: str, user_query: str) -> str:
+    """The user turn sent to the model: intent preamble, the question, and the answer shape."""
+    return (
+        f"{make_system_preamble(intent, user_query)}\n\n"
+        f"User question: {user_query}\n"
+        f"Answer directly. Start with a 1–2 line summary, then 4–8 compact bullets, "
+        f"and end with one clarifying question only if needed."
+    )
+
+def template_heads() -> List[str]:
+    """Fixed text each intent preamble starts with (the template up to {query})."""
+    return [t.split("{query}")[0] for t in INTENT_TEMPLATES.values()]
+
+# One example question per intent; the UI pills prefill these, the inference benchmark runs them
+INTENT_EXAMPLES = {
+    "Skills For Role": "What skills are required for a junior data analyst?",
+    "Popular Roles": "What are the most in-demand roles in data analytics right now?",
+    "Resume Help": "Improve my resume summary for an entry-level data analyst.",
+    "Learning Path": "Give me a 12-week roadmap to become a data analyst.",
+    "Interview Prep": "What topics should I prepare for a data analyst interview?",
+    "Career Switch": "I am a teacher moving into data analysis—what’s my transition plan?",
+    "General Guidance": "How do I pick between data analytics, data science, and BI?",
+}
+
 INTENT_NAMES_FOR_UI = [i.name.replace("_", " ").title() for i in INTENT_DEFS]
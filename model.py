@@ -1,100 +1,376 @@
 # model.py
 from __future__ import annotations
-from typing import List, Dict, Optional
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, List, Dict, Optional, Iterator
 from pathlib import Path
+import os
 import re
-from llama_cpp import Llama
+import threading
+import time
+
+from inference import InferencePool, Job
+from intents import template_heads
+from prompt_cache import PrefixCache
+from structured import get_grammar
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
 
 # Default model path (update if you use another model)
 DEFAULT_MODEL_PATH = "./models/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf"
+# Model the process starts with; model_manager.activate() switches at runtime
+START_MODEL_PATH = os.getenv("CAREERGUIDE_MODEL", DEFAULT_MODEL_PATH)
+
+# Prompt-prefix KV cache: "intent" (system prompt + each intent head), "system", or "off".
+# Every cached prefix holds a full llama.cpp state, so "intent" costs a few hundred MB of RAM.
+PROMPT_CACHE_MODE = os.getenv("CAREERGUIDE_PROMPT_CACHE", "intent")
+# Set to a directory to keep the cached prefix states across restarts
+PROMPT_CACHE_DIR = os.getenv("CAREERGUIDE_PROMPT_CACHE_DIR") or None
+
+# Context window of every model instance; the history packer budgets against it
+N_CTX = int(os.getenv("CAREERGUIDE_N_CTX", "2048"))
 
-_llm: Optional[Llama] = None
+# Inference pool: model instances, waiting requests before PoolBusy, seconds per request
+WORKERS = int(os.getenv("CAREERGUIDE_WORKERS", "1"))
+MAX_QUEUE = int(os.getenv("CAREERGUIDE_QUEUE_SIZE", "8"))
+REQUEST_TIMEOUT_S = float(os.getenv("CAREERGUIDE_REQUEST_TIMEOUT", "180"))
+
+# How every model instance is built; configure() changes these (the benchmark sweeps them)
+LLM_SETTINGS: Dict[str, Any] = {
+    "model_path": START_MODEL_PATH,
+    "n_ctx": N_CTX,
+    "n_threads": None,        # None = split the cores between workers
+    "n_gpu_layers": 0,        # 0 = CPU-only
+    "chat_format": "chatml",  # TRY this first; alternatives: "tinyllama", "llama-2"
+    # Speculative decoding: "off", "prompt-lookup" or "model:<small gguf>" (see speculative.py)
+    "draft": os.getenv("CAREERGUIDE_DRAFT", "off"),
+    # Tokens drafted per step; 0 = 2 on CPU, 10 with GPU layers (llama-cpp-python's advice)
+    "draft_tokens": int(os.getenv("CAREERGUIDE_DRAFT_TOKENS", "0")),
+}
+# Sampler settings sent with every completion, next to temperature/top_p
+SAMPLER_SETTINGS: Dict[str, Any] = {
+    "repeat_penalty": 1.08,
+}
+# Model class, called like llama_cpp.Llama; benchmarks swap in a stub.
+# None = llama_cpp.Llama, imported on first use: the import alone takes a
+# noticeable part of a cold start and the page can render without it.
+_backend: Optional[Callable[..., Any]] = None
+
+_pool: Optional[InferencePool] = None
+_pool_lock = threading.Lock()
+_tokenizer: Optional[Llama] = None
+_prefix_cache: Optional[PrefixCache] = None
+if PROMPT_CACHE_MODE != "off":
+    _prefix_cache = PrefixCache(
+        template_heads(),
+        cache_dir=PROMPT_CACHE_DIR,
+        per_intent=PROMPT_CACHE_MODE == "intent",
+    )
 
 FORBIDDEN_HEADINGS = [
     "purpose", "style", "guardrails", "do not", "output format", "quality hints",
     "context", "output requirements"
 ]
 
-def _resolve_model_path() -> str:
-    p = Path(DEFAULT_MODEL_PATH)
-    if p.exists():
+def _get_backend() -> Callable[..., Any]:
+    if _backend is not None:
+        return _backend
+    from llama_cpp import Llama
+    return Llama
+
+def _resolve_model_path(model_path: Optional[str] = None) -> str:
+    p = Path(model_path or LLM_SETTINGS["model_path"])
+    if p.exists() or _backend is not None:  # stub backends don't read the file
         return str(p)
+    if str(p) != DEFAULT_MODEL_PATH:
+        # An explicitly chosen model must not be silently replaced by another one
+        raise ValueError(f"No model file at {p}")
     models_dir = Path(__file__).resolve().parent / "models"
     ggufs = sorted(models_dir.glob("*.gguf"))
     if not ggufs:
         raise ValueError(f"No .gguf model found in {models_dir}")
     return str(ggufs[0])
 
-def load_llm(model_path: str = DEFAULT_MODEL_PATH, n_ctx: int = 2048, n_gpu_layers: int = 0) -> Llama:
+def load_llm(
+    model_path: Optional[str] = None,
+    n_ctx: Optional[int] = None,
+    n_gpu_layers: Optional[int] = None,
+    settings: Optional[Dict[str, Any]] = None,
+) -> Llama:
     """
+    Build one model instance from `settings` (LLM_SETTINGS by default); each
+    inference worker calls this once.
     Use a chat_format that tiny chat models obey. TinyLlama usually works with 'chatml'.
     If it still echoes, try chat_format='tinyllama' or 'llama-2'.
     """
-    global _llm
-    if _llm is None:
-        resolved_path = _resolve_model_path()
-        _llm = Llama(
-            model_path=resolved_path,
-            n_ctx=n_ctx,
-            n_threads=None,        # auto
-            n_gpu_layers=n_gpu_layers,  # 0 = CPU-only
-            use_mmap=True,
-            use_mlock=False,
-            verbose=False,
-            chat_format="chatml",  # TRY this first; alternatives: "tinyllama", "llama-2"
-            repeat_penalty=1.08,
-            penalize_nl=True,
-        )
-    return _llm
+    settings = settings or LLM_SETTINGS
+    n_threads = settings["n_threads"]
+    if n_threads is None and WORKERS > 1:
+        # Split the cores between workers; a single worker keeps llama.cpp's default
+        n_threads = max(1, (os.cpu_count() or 1) // WORKERS)
+    n_ctx = n_ctx or settings["n_ctx"]
+    n_gpu_layers = settings["n_gpu_layers"] if n_gpu_layers is None else n_gpu_layers
+    draft_model = None
+    if settings["draft"] != "off":
+        from speculative import make_draft
+        draft_tokens = settings["draft_tokens"] or (10 if n_gpu_layers else 2)
+        draft_model = make_draft(settings["draft"], draft_tokens, n_ctx, n_threads)
+    return _get_backend()(
+        model_path=_resolve_model_path(model_path or settings["model_path"]),
+        n_ctx=n_ctx,
+        n_threads=n_threads,
+        n_gpu_layers=n_gpu_layers,
+        use_mmap=True,         # workers share the GGUF pages
+        use_mlock=False,
+        verbose=False,
+        chat_format=settings["chat_format"],
+        draft_model=draft_model,
+    )
+
+def configure(backend: Optional[Callable[..., Any]] = None, **settings: Any) -> None:
+    """
+    Change how model instances are built (LLM_SETTINGS keys) or sampled
+    (SAMPLER_SETTINGS keys). The running pool is shut down; the next request
+    loads fresh instances.
+    """
+    global _backend, _pool, _tokenizer
+    for key, value in settings.items():
+        if key in LLM_SETTINGS:
+            LLM_SETTINGS[key] = value
+        elif key in SAMPLER_SETTINGS:
+            SAMPLER_SETTINGS[key] = value
+        else:
+            raise TypeError(f"Unknown model setting: {key}")
+    if backend is not None:
+        _backend = backend
+    with _pool_lock:
+        old, _pool = _pool, None
+        _tokenizer = None
+    if old is not None:
+        old.shutdown()
+
+def get_tokenizer() -> Llama:
+    """Vocab-only instance of the model: tokenizes without loading weights or a context."""
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = _get_backend()(model_path=_resolve_model_path(), vocab_only=True, verbose=False)
+    return _tokenizer
+
+def count_tokens(text: str) -> int:
+    return len(get_tokenizer().tokenize(text.encode("utf-8"), add_bos=False, special=False))
+
+def truncate_tokens(text: str, n_tokens: int) -> str:
+    """The longest head of `text` that fits in `n_tokens` tokens."""
+    tok = get_tokenizer()
+    ids = tok.tokenize(text.encode("utf-8"), add_bos=False, special=False)
+    if len(ids) <= n_tokens:
+        return text
+    return tok.detokenize(ids[:n_tokens]).decode("utf-8", errors="ignore")
+
+def new_pool(settings: Optional[Dict[str, Any]] = None) -> InferencePool:
+    """An inference pool whose workers build their model from a fixed copy of `settings`."""
+    frozen = dict(settings or LLM_SETTINGS)
+    return InferencePool(
+        lambda: load_llm(settings=frozen), workers=WORKERS, max_queue=MAX_QUEUE, timeout_s=REQUEST_TIMEOUT_S
+    )
+
+def get_pool() -> InferencePool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = new_pool()
+        return _pool
+
+def swap_pool(pool: InferencePool, settings: Dict[str, Any]) -> Optional[InferencePool]:
+    """
+    Make `pool` (built with `settings`) serve all new requests. Requests already
+    queued on the previous pool finish there; it is returned for the caller to
+    keep or shut down.
+    """
+    global _pool, _tokenizer
+    with _pool_lock:
+        old, _pool = _pool, pool
+        LLM_SETTINGS.update(settings)
+        _tokenizer = None
+    return old
+
+def pool_stats() -> Dict[str, float]:
+    """Queue depth, wait times and worker utilization of the inference pool."""
+    return get_pool().stats()
+
+def prompt_cache_stats() -> Dict[str, int]:
+    """Counters of the prompt-prefix cache (empty when it is off or not loaded yet)."""
+    return _prefix_cache.stats() if _prefix_cache is not None else {}
+
+def forget_prompt_cache(model_path: str) -> int:
+    """Release the cached prefix states of a model that was unloaded."""
+    return _prefix_cache.forget(model_path) if _prefix_cache is not None else 0
+
+# How many leading characters the echo check looks at
+ECHO_WINDOW = 600
 
 def _looks_like_echo(text: str) -> bool:
-    head = text.strip()[:600].lower()
+    head = text.strip()[:ECHO_WINDOW].lower()
     return any(h in head for h in FORBIDDEN_HEADINGS) or "i am careerguide" in head
 
-def chat(
+@dataclass
+class GenerationStats:
+    """Timing for one answer, filled in while the stream is consumed."""
+    ttft_s: Optional[float] = None     # time to first token
+    gen_s: float = 0.0                 # wall time of the whole stream
+    completion_tokens: int = 0
+    tokens_per_s: float = 0.0
+    echo_fallback: bool = False
+    echo_discarded_tokens: int = 0     # tokens generated before an echo was caught
+    prompt_tokens: int = 0             # prompt tokens in the context when the first token came
+    prompt_tokens_reused: int = 0      # prompt tokens restored from the prefix cache
+    queue_wait_s: float = 0.0          # time spent waiting for a free model worker
+    draft_proposed: int = 0            # speculative tokens drafted
+    draft_accepted: int = 0            # ... and kept by the model
+    echo_s: float = 0.0                # time spent on the fallback after an echo
+    model: Optional[str] = None        # file name of the model that ran it (the active one may change meanwhile)
+
+FALLBACK_SYSTEM_PROMPT = (
+    "You are a concise career advisor. Answer the user directly in bullets. "
+    "Do not repeat or reference any meta-instructions or headings."
+)
+
+def _stream_completion(llm: Llama, messages: List[Dict[str, str]], **params) -> Iterator[str]:
+    stream = llm.create_chat_completion(messages=messages, stream=True, **params)
+    try:
+        for chunk in stream:
+            piece = chunk["choices"][0]["delta"].get("content")
+            if piece:
+                yield piece
+    finally:
+        # Closing the llama.cpp generator stops token generation right away
+        stream.close()
+
+def _answer_pieces(
+    llm: Llama,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    top_p: float,
+    max_tokens: int,
+    stats: GenerationStats,
+    started: float,
+    structured: bool = False,
+) -> Iterator[Optional[str]]:
+    # Cached prefixes are ChatML text; other chat formats wouldn't line up with them
+    if _prefix_cache is not None and LLM_SETTINGS["chat_format"] == "chatml":
+        stats.prompt_tokens_reused = _prefix_cache.prepare(llm, messages)
+    draft = getattr(llm, "draft_model", None)
+    drafted = (draft.proposed, draft.accepted) if hasattr(draft, "proposed") else None
+    params = dict(SAMPLER_SETTINGS)
+    if structured:
+        params["grammar"] = get_grammar()
+    text = ""
+    echoed = False
+    primary = _stream_completion(llm, messages, temperature=temperature, top_p=top_p, max_tokens=max_tokens, **params)
+    try:
+        for piece in primary:
+            if stats.ttft_s is None:
+                stats.ttft_s = time.perf_counter() - started
+                # input_ids is an n_ctx-sized buffer; n_tokens is how much of it the prompt filled
+                stats.prompt_tokens = llm.n_tokens
+            stats.completion_tokens += 1
+            yield piece
+            # The echo check only ever looks at the head, so run it while the
+            # head is still being generated and abort as soon as it fires.
+            if len(text.lstrip()) < ECHO_WINDOW:
+                text += piece
+                if _looks_like_echo(text):
+                    echoed = True
+                    break
+    finally:
+        primary.close()
+
+    # Fallback: if the model echoed instructions, re-ask crisply without the big system block
+    if echoed:
+        stats.echo_fallback = True
+        stats.echo_discarded_tokens = stats.completion_tokens
+        fallback_started = time.perf_counter()
+        yield None
+        fallback_messages = [
+            {"role": "system", "content": FALLBACK_SYSTEM_PROMPT},
+            {"role": "user", "content": messages[-1]["content"]},
+        ]
+        for piece in _stream_completion(
+            llm, fallback_messages, temperature=0.2, top_p=0.9, max_tokens=max_tokens, **params
+        ):
+            stats.completion_tokens += 1
+            yield piece
+        stats.echo_s = time.perf_counter() - fallback_started
+
+    if drafted is not None:
+        stats.draft_proposed = draft.proposed - drafted[0]
+        stats.draft_accepted = draft.accepted - drafted[1]
+    stats.gen_s = time.perf_counter() - started
+    if stats.gen_s > 0:
+        stats.tokens_per_s = stats.completion_tokens / stats.gen_s
+
+def chat_stream(
     system_prompt: str,
     user_prompt: str,
     history: List[Dict[str, str]],
     temperature: float = 0.3,
     top_p: float = 0.9,
     max_tokens: int = 512,
-) -> str:
+    stats: Optional[GenerationStats] = None,
+    structured: bool = False,
+    cancel: Optional[threading.Event] = None,
+) -> Iterator[Optional[str]]:
     """
-    Run a chat completion with local llama.cpp model.
-    history: list of {role: 'user'|'assistant', content: str}
+    Streaming variant of chat(): yields text pieces as llama.cpp produces them.
+    A None item means the text shown so far was an instruction echo and the
+    answer restarts from the fallback prompt (discard what you rendered).
+    structured=True constrains the answer to the shape in structured.py.
+    Setting `cancel` from another thread stops generation at the next token
+    (or drops the request while it is still queued); the stream then just ends.
+    The request runs on the inference pool; raises inference.PoolBusy when the
+    queue is full and TimeoutError when it can't finish within the request timeout.
     """
-    llm = load_llm()
+    stats = stats if stats is not None else GenerationStats()
 
     messages = [{"role": "system", "content": system_prompt}]
     messages.extend(history)
     messages.append({"role": "user", "content": user_prompt})
 
-    out = llm.create_chat_completion(
-        messages=messages,
-        temperature=temperature,
-        top_p=top_p,
-        max_tokens=max_tokens,
-    )
-    answer = out["choices"][0]["message"]["content"].strip()
+    def run(llm: Llama, job: Job) -> None:
+        stats.queue_wait_s = job.wait_s
+        stats.model = Path(llm.model_path).name
+        pieces = _answer_pieces(llm, messages, temperature, top_p, max_tokens, stats, job.submitted_at, structured)
+        try:
+            for piece in pieces:
+                if job.should_stop():
+                    if not job.is_cancelled():
+                        job.emit(TimeoutError("Generation ran past the request timeout"))
+                    break
+                job.emit(piece)
+        finally:
+            pieces.close()
 
-    # Fallback: if the model echoed instructions, re-ask crisply without the big system block
-    if _looks_like_echo(answer):
-        fallback_messages = [
-            {
-                "role": "system",
-                "content": (
-                    "You are a concise career advisor. Answer the user directly in bullets. "
-                    "Do not repeat or reference any meta-instructions or headings."
-                ),
-            },
-            {"role": "user", "content": user_prompt},
-        ]
-        out2 = llm.create_chat_completion(
-            messages=fallback_messages,
-            temperature=0.2,
-            top_p=0.9,
-            max_tokens=max_tokens,
-        )
-        answer = out2["choices"][0]["message"]["content"].strip()
-
-    return answer
+    pool = get_pool()
+    yield from pool.results(pool.submit(run, cancel=cancel))
+
+def chat(
+    system_prompt: str,
+    user_prompt: str,
+    history: List[Dict[str, str]],
+    temperature: float = 0.3,
+    top_p: float = 0.9,
+    max_tokens: int = 512,
+    stats: Optional[GenerationStats] = None,
+    structured: bool = False,
+) -> str:
+    """
+    Run a chat completion with local llama.cpp model.
+    history: list of {role: 'user'|'assistant', content: str}
+    """
+    parts: List[str] = []
+    for piece in chat_stream(system_prompt, user_prompt, history, temperature, top_p, max_tokens, stats, structured):
+        if piece is None:
+            parts = []
+        else:
+            parts.append(piece)
+    return "".join(parts).strip()
@@ -0,0 +1,338 @@
+# model_manager.py
+"""
+Local model registry. Lists the GGUF files in models/, loads a model on a
+background thread, warms it up and swaps it in atomically (requests never
+wait on a cold load), tunes n_threads once per model and machine, and keeps
+recently used models resident under a memory cap so switching back is
+instant. startup() starts loading the configured model as soon as the
+process comes up and records how long the cold start took.
+"""
+from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import model
+from inference import InferencePool
+
+MODELS_DIR = Path(__file__).resolve().parent / "models"
+# Measured thread counts, keyed by model file and machine
+TUNING_PATH = Path(os.getenv("CAREERGUIDE_TUNING_PATH", str(MODELS_DIR / "tuning.json")))
+AUTOTUNE = os.getenv("CAREERGUIDE_AUTOTUNE", "on") != "off"
+# Resident models (active + standby) are evicted least recently used first above this
+MEMORY_CAP_MB = float(os.getenv("CAREERGUIDE_MODEL_MEMORY_MB", "4096"))
+
+WARMUP_QUESTION = "Name one skill every data analyst needs."
+TUNE_MAX_TOKENS = 16
+
+log = logging.getLogger(__name__)
+
+_QUANT_RE = re.compile(r"[.-]((?:I?Q\d[\w]*)|F16|BF16|F32)\.gguf$", re.IGNORECASE)
+
+@dataclass
+class ModelInfo:
+    path: str
+    name: str
+    size_mb: float
+    quant: Optional[str]
+
+@dataclass
+class _Resident:
+    pool: InferencePool
+    settings: Dict[str, Any]
+    rss_mb: float
+    last_used: float
+
+_lock = threading.Lock()
+_resident: Dict[str, _Resident] = {}   # model_path -> loaded pool
+_loading: Optional[Dict[str, str]] = None
+_last_error: Optional[str] = None
+_started = False
+_ready = threading.Event()
+# Cold start: import_s (the app's own imports), load_s (first model instance), first_token_s
+_startup: Dict[str, Optional[float]] = {}
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+
+def list_models(models_dir: Path = MODELS_DIR) -> List[ModelInfo]:
+    models = []
+    for p in sorted(models_dir.glob("*.gguf")):
+        m = _QUANT_RE.search(p.name)
+        models.append(ModelInfo(
+            path=str(p),
+            name=p.name,
+            size_mb=round(p.stat().st_size / 2**20, 1),
+            quant=m.group(1).upper() if m else None,
+        ))
+    return models
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+def _file_mb(path: str) -> float:
+    try:
+        return os.path.getsize(path) / 2**20
+    except OSError:
+        return 0.0
+
+# --- Thread tuning ---
+
+def _tuning_key(path: str) -> str:
+    return f"{Path(path).name}|{int(_file_mb(path))}MB|cpus={os.cpu_count()}|workers={model.WORKERS}"
+
+def _load_tuning() -> Dict[str, Any]:
+    try:
+        return json.loads(TUNING_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+def tuned_threads(path: str) -> Optional[int]:
+    entry = _load_tuning().get(_tuning_key(path))
+    return entry["n_threads"] if entry else None
+
+def _candidates() -> List[int]:
+    top = max(1, (os.cpu_count() or 1) // model.WORKERS)
+    counts = {top}
+    n = 1
+    while n < top:
+        counts.add(n)
+        n *= 2
+    return sorted(counts)
+
+def _timed_request(llm: Any, max_tokens: int) -> float:
+    t0 = time.perf_counter()
+    stream = llm.create_chat_completion(
+        messages=[{"role": "user", "content": WARMUP_QUESTION}],
+        stream=True, temperature=0.0, max_tokens=max_tokens,
+    )
+    try:
+        for _chunk in stream:
+            pass
+    finally:
+        stream.close()
+    return time.perf_counter() - t0
+
+def tune_threads(path: str) -> Dict[str, Any]:
+    """
+    Time a short request with each candidate thread count (1, 2, 4, … up to the
+    cores each worker gets) and store the fastest. The GGUF is mmapped, so
+    reloading it per candidate only costs the first read.
+    """
+    timings: Dict[str, float] = {}
+    for n_threads in _candidates():
+        settings = dict(model.LLM_SETTINGS, model_path=path, n_threads=n_threads, n_ctx=512)
+        llm = model.load_llm(settings=settings)
+        _timed_request(llm, 2)  # first-touch page faults don't count
+        timings[str(n_threads)] = round(_timed_request(llm, TUNE_MAX_TOKENS), 4)
+        del llm
+    best = int(min(timings, key=timings.get))
+    entry = {"n_threads": best, "seconds": timings, "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    tuning = _load_tuning()
+    tuning[_tuning_key(path)] = entry
+    TUNING_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = TUNING_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps(tuning, indent=2), encoding="utf-8")
+    tmp.replace(TUNING_PATH)
+    return entry
+
+# --- Loading and swapping ---
+
+def _warm_up(pool: InferencePool) -> Optional[float]:
+    """One short request per worker: every instance loads and touches its weights. Returns the fastest first token."""
+    system_prompt = (Path(__file__).resolve().parent / "prompts" / "system_prompt.txt").read_text(encoding="utf-8")
+    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": WARMUP_QUESTION}]
+    first_token: List[float] = []
+
+    def run(llm: Any, job: Any) -> None:
+        t0 = time.perf_counter()
+        stream = llm.create_chat_completion(messages=messages, stream=True, temperature=0.0, max_tokens=4)
+        try:
+            for _chunk in stream:
+                if len(first_token) < pool.workers:
+                    first_token.append(time.perf_counter() - t0)
+        finally:
+            stream.close()
+
+    jobs = [pool.submit(run) for _ in range(pool.workers)]
+    for job in jobs:
+        list(pool.results(job))
+    return min(first_token) if first_token else None
+
+def _set_loading(path: Optional[str], stage: str = "") -> None:
+    global _loading
+    with _lock:
+        _loading = {"path": path, "name": Path(path).name, "stage": stage} if path else None
+
+def _activate(path: str, overrides: Dict[str, Any]) -> None:
+    global _last_error
+    try:
+        n_threads = overrides.get("n_threads", model.LLM_SETTINGS["n_threads"])
+        if n_threads is None and AUTOTUNE:
+            n_threads = tuned_threads(path)
+            if n_threads is None:
+                _set_loading(path, "tuning threads")
+                n_threads = tune_threads(path)["n_threads"]
+        settings = dict(model.LLM_SETTINGS, **overrides)
+        settings.update(model_path=path, n_threads=n_threads)
+
+        with _lock:
+            resident = _resident.get(path)
+        if resident is not None and resident.settings == settings:
+            pool = resident.pool
+        else:
+            _set_loading(path, "loading")
+            before = _rss_mb()
+            pool = model.new_pool(settings)
+            _warm_up(pool)
+            rss = max(_rss_mb() - before, _file_mb(path))
+            resident = _Resident(pool, settings, rss, time.monotonic())
+
+        old_settings = dict(model.LLM_SETTINGS)
+        old = model.swap_pool(pool, settings)
+        displaced: List[InferencePool] = []
+        with _lock:
+            if old is not None and old is not pool and not any(r.pool is old for r in _resident.values()):
+                # The pool the process started with becomes a standby like any other
+                old_path = old_settings["model_path"]
+                if old_path == path:
+                    displaced.append(old)
+                else:
+                    _resident[old_path] = _Resident(old, old_settings, _file_mb(old_path), time.monotonic())
+            previous = _resident.get(path)
+            if previous is not None and previous.pool is not pool:
+                # Same model reloaded with other settings
+                displaced.append(previous.pool)
+            resident.last_used = time.monotonic()
+            _resident[path] = resident
+            _last_error = None
+        for p in displaced:
+            p.shutdown(wait=False)
+        _evict()
+        _ready.set()
+        log.info("model %s active (n_threads=%s)", path, n_threads)
+    except Exception as e:
+        log.exception("activating %s failed", path)
+        with _lock:
+            _last_error = f"{Path(path).name}: {e}"
+    finally:
+        _set_loading(None)
+
+def _evict() -> None:
+    """Unload least recently used standby models until the resident set fits the cap."""
+    active = model.LLM_SETTINGS["model_path"]
+    with _lock:
+        victims = []
+        total = sum(r.rss_mb for r in _resident.values())
+        for path, r in sorted(_resident.items(), key=lambda kv: kv[1].last_used):
+            if total <= MEMORY_CAP_MB:
+                break
+            if path != active:
+                victims.append((path, r))
+                total -= r.rss_mb
+        for path, _r in victims:
+            del _resident[path]
+    for path, r in victims:
+        # Queued requests still finish; the workers exit after them
+        r.pool.shutdown(wait=False)
+        model.forget_prompt_cache(path)
+        log.info("evicted model %s (%.0f MB)", path, r.rss_mb)
+
+def activate(path: str, **overrides: Any) -> Future:
+    """Load `path` in the background (tuning threads first if needed), warm it up and swap it in."""
+    return _executor.submit(_activate, path, overrides)
+
+def _preload(path: str) -> None:
+    """Load and warm the configured model into the pool requests already use, so none waits on a second load."""
+    global _last_error
+    try:
+        _set_loading(path, "loading")
+        pool = model.get_pool()
+        t0 = time.perf_counter()
+        # A no-op job only runs once its worker has built the model
+        list(pool.results(pool.submit(lambda llm, job: None)))
+        _startup["load_s"] = round(time.perf_counter() - t0, 3)
+        _set_loading(path, "warming up")
+        first_token = _warm_up(pool)
+        _startup["first_token_s"] = round(first_token, 3) if first_token is not None else None
+        model.get_tokenizer()
+        _ready.set()
+        log.info(
+            "startup: imports %ss, model load %ss, first token %ss",
+            _startup.get("import_s"), _startup["load_s"], _startup["first_token_s"],
+        )
+    except Exception as e:
+        log.exception("preloading %s failed", path)
+        with _lock:
+            _last_error = f"{Path(path).name}: {e}"
+    finally:
+        _set_loading(None)
+
+def note_import_time(seconds: float) -> None:
+    """The entry point's import time, for the startup report (the first call counts)."""
+    _startup.setdefault("import_s", round(seconds, 3))
+
+def startup() -> None:
+    """
+    Once per process: start loading the configured model in the background,
+    with the stored thread count for this machine. If there is none yet, it
+    loads with the default count so requests can be served, then tunes
+    threads and swaps the tuned pool in.
+    """
+    global _started, _last_error
+    with _lock:
+        if _started:
+            return
+        _started = True
+    try:
+        path = model._resolve_model_path()
+    except ValueError as e:
+        with _lock:
+            _last_error = str(e)
+        return
+    n_threads = model.LLM_SETTINGS["n_threads"]
+    if AUTOTUNE and n_threads is None:
+        n_threads = tuned_threads(path)
+    # The resolved path, so the tuned pool replaces this one rather than keeping it as a standby
+    model.LLM_SETTINGS.update(model_path=path, n_threads=n_threads)
+    _executor.submit(_preload, path)
+    if AUTOTUNE and n_threads is None:
+        # Runs after the preload on the same executor
+        activate(path)
+
+def ready() -> bool:
+    """Whether a warmed-up model is serving (questions asked before that wait in the queue)."""
+    return _ready.is_set()
+
+def status() -> Dict[str, Any]:
+    """Active model and settings, a load in progress, resident models, last error."""
+    settings = model.LLM_SETTINGS
+    with _lock:
+        return {
+            "active": {
+                "name": Path(settings["model_path"]).name,
+                "path": settings["model_path"],
+                "n_threads": settings["n_threads"] or "auto",
+                "n_ctx": settings["n_ctx"],
+                "chat_format": settings["chat_format"],
+                "workers": model.WORKERS,
+            },
+            "loading": dict(_loading) if _loading else None,
+            "resident": {Path(p).name: round(r.rss_mb) for p, r in _resident.items()},
+            "memory_cap_mb": MEMORY_CAP_MB,
+            "error": _last_error,
+            "ready": _ready.is_set(),
+            "startup": dict(_startup),
+        }
@@ -0,0 +1,70 @@
+# pages/1_Metrics.py
+"""
+Latency dashboard over the metrics table (tracing.py): p50/p95 of the whole
+request, time to first token and each stage, by intent and by model.
+"""
+from datetime import datetime, timedelta, timezone
+import json
+
+import pandas as pd
+import streamlit as st
+
+from db import get_metrics
+from tracing import TRACING
+from ui import load_styles
+
+STAGES = ["db_read", "route", "prompt", "cache_lookup", "queue_wait", "prompt_eval", "generate", "echo_fallback", "db_write"]
+
+st.set_page_config(page_title="CareerGuideAI · Metrics", page_icon="👾", layout="wide")
+load_styles()
+st.title("Latency")
+if not TRACING:
+    st.info("Tracing is off (CAREERGUIDE_TRACING=off); only earlier requests are shown.")
+
+@st.cache_data(ttl=30, show_spinner=False)
+def load(since: str) -> pd.DataFrame:
+    df = pd.DataFrame(get_metrics(since))
+    if df.empty:
+        return df
+    spans = pd.DataFrame([json.loads(s) for s in df.pop("spans")], index=df.index)
+    return df.join(spans.reindex(columns=STAGES).add_suffix("_ms"))
+
+def percentiles(df: pd.DataFrame, by: str) -> pd.DataFrame:
+    cols = ["total_ms", "ttft_ms"] + [f"{s}_ms" for s in STAGES if df[f"{s}_ms"].notna().any()]
+    grouped = df.groupby(by)
+    table = grouped[cols].quantile([0.5, 0.95]).unstack()
+    table.columns = [f"{c[:-3]} p{round(q * 100)}" for c, q in table.columns]
+    table.insert(0, "requests", grouped.size())
+    return table.round(1)
+
+left, right = st.columns(2)
+days = left.selectbox("Window", [1, 7, 30], index=1, format_func=lambda d: f"Last {d} day{'s' if d > 1 else ''}")
+include_cached = right.toggle("Include cache hits", value=False)
+# Rounded to the minute so the cached query is reused across reruns
+since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:00")
+df = load(since)
+
+if df.empty:
+    st.caption("No traced requests in this window yet.")
+    st.stop()
+
+a, b, c, d = st.columns(4)
+a.metric("Answers", len(df))
+b.metric("Cache hits", f"{df['cached'].mean():.0%}")
+generated = df[df["cached"] == 0]
+c.metric("Echo fallbacks", f"{generated['echo_fallback'].mean():.0%}" if len(generated) else "n/a")
+d.metric("Median first token", f"{generated['ttft_ms'].median() / 1000:.1f}s" if len(generated) else "n/a")
+
+view = df if include_cached else generated
+if view.empty:
+    st.caption("Every answer in this window came from the cache.")
+    st.stop()
+
+st.subheader("By intent (ms)")
+st.dataframe(percentiles(view, "intent"), use_container_width=True)
+st.subheader("By model (ms)")
+st.dataframe(percentiles(view, "model"), use_container_width=True)
+
+st.subheader("Median stage time by model (ms)")
+stage_cols = [f"{s}_ms" for s in STAGES if view[f"{s}_ms"].notna().any()]
+st.bar_chart(view.groupby("model")[stage_cols].median().rename(columns=lambda c: c[:-3]))
@@ -0,0 +1,53 @@
+# pages/2_Analytics.py
+"""
+Admin analytics over the rollup counters (analytics.py): questions, answers
+and feedback by intent, day, model and prompt version. Every table is a
+primary-key read of the rollups, so the page costs the same at any
+database size.
+"""
+from typing import List
+
+import pandas as pd
+import streamlit as st
+
+import analytics
+from ui import load_styles
+
+st.set_page_config(page_title="CareerGuideAI · Analytics", page_icon="👾", layout="wide")
+load_styles()
+st.title("Analytics")
+
+def frame(rows: List[analytics.Rollup], label: str) -> pd.DataFrame:
+    df = pd.DataFrame(
+        [(r.key, r.questions, r.answers, r.upvotes, r.downvotes, r.approval) for r in rows],
+        columns=[label, "questions", "answers", "👍", "👎", "approval"],
+    )
+    return df.set_index(label)
+
+totals = analytics.totals()
+a, b, c, d = st.columns(4)
+a.metric("Questions", f"{totals.questions:,}")
+b.metric("Answers", f"{totals.answers:,}")
+c.metric("Rated answers", f"{totals.rated:,}")
+d.metric("Approval", f"{totals.approval:.0%}" if totals.approval is not None else "n/a")
+
+days = st.selectbox("Daily window", [7, 30, 90, 365], index=1, format_func=lambda n: f"Last {n} days")
+daily = frame(analytics.daily(days), "day")
+if daily.empty:
+    st.caption("No messages in this window.")
+else:
+    st.line_chart(daily[["questions", "👍", "👎"]])
+
+column_config = {"approval": st.column_config.ProgressColumn("approval", format="%.2f", min_value=0.0, max_value=1.0)}
+for dim, title in (("intent", "By intent"), ("model", "By model"), ("prompt_version", "By prompt version")):
+    st.subheader(title)
+    table = frame(analytics.by(dim), dim)
+    if table.empty:
+        st.caption("Nothing recorded yet.")
+    else:
+        st.dataframe(table, use_container_width=True, column_config=column_config)
+
+st.caption(
+    "Counters include archived and deleted sessions. `python analytics.py --rebuild` recounts them "
+    "(it drops the deleted ones and holds off writers while it runs)."
+)
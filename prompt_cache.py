@@ -0,0 +1,151 @@
+# prompt_cache.py
+from __future__ import annotations
+from typing import TYPE_CHECKING, List, Dict, Optional, Sequence, Tuple
+from pathlib import Path
+import hashlib
+import pickle
+import threading
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama, LlamaState
+
+# ChatML pieces, must match the chat_format the model is loaded with
+IM_START = "<|im_start|>"
+IM_END = "<|im_end|>"
+
+def _common_prefix(a: Sequence[int], b: Sequence[int]) -> int:
+    # Same as Llama.longest_token_prefix, without importing llama_cpp here
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+def _chatml_prefix(system_prompt: str, user_head: Optional[str] = None) -> str:
+    text = f"{IM_START}system\n{system_prompt}{IM_END}\n"
+    if user_head is not None:
+        text += f"{IM_START}user\n{user_head}"
+    return text
+
+def _chatml_prompt(messages: List[Dict[str, str]]) -> str:
+    text = "".join(f"{IM_START}{m['role']}\n{m['content']}{IM_END}\n" for m in messages)
+    return text + f"{IM_START}assistant\n"
+
+class PrefixCache:
+    """
+    Keeps the evaluated llama.cpp state of shared prompt prefixes (the system
+    prompt alone, and the system prompt plus each intent template head) and
+    restores the longest matching one before a completion, so only the tail
+    of the prompt goes through prompt evaluation.
+
+    States are built lazily the first time a prefix is seen and, if
+    `cache_dir` is set, written to disk so a restarted process starts warm.
+    """
+
+    def __init__(self, user_heads: List[str], cache_dir: Optional[str] = None, per_intent: bool = True):
+        self.user_heads = [h for h in user_heads if h] if per_intent else []
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self._states: Dict[str, LlamaState] = {}
+        self._tokens: Dict[str, List[int]] = {}
+        self._owners: Dict[str, str] = {}  # key -> model_path
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.tokens_skipped = 0
+
+    def _key(self, llm: Llama, prefix_text: str) -> str:
+        ident = f"{llm.model_path}|{llm.n_ctx()}|{prefix_text}"
+        return hashlib.sha1(ident.encode("utf-8")).hexdigest()[:20]
+
+    def _candidates(self, messages: List[Dict[str, str]]) -> List[str]:
+        if not messages or messages[0]["role"] != "system":
+            return []
+        system_prompt = messages[0]["content"]
+        found = [_chatml_prefix(system_prompt)]
+        # Intent heads only line up with the prompt when no history sits in between
+        if len(messages) == 2 and messages[1]["role"] == "user":
+            user_text = messages[1]["content"]
+            found += [_chatml_prefix(system_prompt, h) for h in self.user_heads if user_text.startswith(h)]
+        return found
+
+    def _state_for(self, llm: Llama, key: str, prefix_text: str) -> Tuple[LlamaState, List[int]]:
+        with self._lock:
+            if key in self._states:
+                self.hits += 1
+                return self._states[key], self._tokens[key]
+
+        tokens = llm.tokenize(prefix_text.encode("utf-8"), add_bos=True, special=True)
+        state = self._load(key)
+        if state is None:
+            llm.reset()
+            llm.eval(tokens)
+            state = llm.save_state()
+            self._save(key, state)
+        with self._lock:
+            self.misses += 1
+            self._states[key] = state
+            self._tokens[key] = tokens
+            self._owners[key] = llm.model_path
+        return state, tokens
+
+    def _load(self, key: str) -> Optional[LlamaState]:
+        if self.cache_dir is None:
+            return None
+        path = self.cache_dir / f"{key}.state"
+        if not path.exists():
+            return None
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def _save(self, key: str, state: LlamaState) -> None:
+        if self.cache_dir is None:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_dir / f"{key}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp.replace(self.cache_dir / f"{key}.state")
+
+    def prepare(self, llm: Llama, messages: List[Dict[str, str]]) -> int:
+        """
+        Make sure `llm` holds the longest cached prefix of `messages`.
+        Returns the number of prompt tokens that won't be evaluated again.
+        """
+        candidates = self._candidates(messages)
+        if not candidates:
+            return 0
+        prefix_text = max(candidates, key=len)
+        state, tokens = self._state_for(llm, self._key(llm, prefix_text), prefix_text)
+
+        # input_ids is an n_ctx-sized buffer; past n_tokens it holds stale ids
+        resident = _common_prefix(llm.input_ids[:llm.n_tokens].tolist(), tokens)
+        if resident < len(tokens):
+            llm.load_state(state)
+        # The prompt can tokenize differently where the prefix ends; only the
+        # common part is reused, and llama.cpp always evaluates the last prompt token
+        prompt = llm.tokenize(_chatml_prompt(messages).encode("utf-8"), add_bos=True, special=True)
+        reused = min(_common_prefix(prompt, tokens), len(prompt) - 1)
+        with self._lock:
+            self.tokens_skipped += reused
+        return reused
+
+    def forget(self, model_path: str) -> int:
+        """Drop the in-memory states of one model (after it was unloaded); returns how many."""
+        with self._lock:
+            keys = [k for k, owner in self._owners.items() if owner == model_path]
+            for k in keys:
+                del self._states[k], self._tokens[k], self._owners[k]
+        return len(keys)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._states),
+                "hits": self.hits,
+                "misses": self.misses,
+                "tokens_skipped": self.tokens_skipped,
+            }
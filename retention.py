@@ -0,0 +1,308 @@
+# retention.py
+"""
+Retention for career_advisor.db. Sessions idle for longer than RETENTION_DAYS
+(or beyond the MAX_HOT_SESSIONS most recent ones) move out of the hot
+database into per-month archive files, one zlib-packed row per session chunk;
+the hot file keeps only an index row (archived_sessions) per chunk, so
+get_history() and get_history_page() still find the whole conversation by
+session_id (full-text search covers the hot rows only). A background thread
+runs this every MAINTENANCE_INTERVAL_S, together with a WAL checkpoint and an
+incremental vacuum, which keeps the hot file, its WAL and the write latency
+flat over time.
+
+    python retention.py                 # one maintenance pass now
+    python retention.py --dry-run       # which sessions would be archived
+    python retention.py --vacuum-full   # once, for files created before incremental auto-vacuum
+"""
+from __future__ import annotations
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import db
+from db import flush_writes, get_convo
+
+# Sessions whose last message is older than this are archived; 0 = never by age
+RETENTION_DAYS = float(os.getenv("CAREERGUIDE_RETENTION_DAYS", "90"))
+# Only this many most recent sessions stay hot; 0 = no limit
+MAX_HOT_SESSIONS = int(os.getenv("CAREERGUIDE_RETENTION_MAX_SESSIONS", "0"))
+# Defaults to archive/ next to the database
+ARCHIVE_DIR = os.getenv("CAREERGUIDE_ARCHIVE_DIR") or None
+MAINTENANCE_INTERVAL_S = float(os.getenv("CAREERGUIDE_MAINTENANCE_INTERVAL", "3600"))
+# Each session moves in its own short write transaction; pause after this many
+ARCHIVE_BATCH = 50
+# Free pages handed back to the file system per pass
+VACUUM_PAGES = 2000
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+  session_id TEXT NOT NULL,
+  first_id INTEGER NOT NULL,
+  last_id INTEGER NOT NULL,
+  last_at TEXT NOT NULL,
+  data BLOB NOT NULL,                 -- zlib(JSON {"messages": [...], "feedback": [...], "summary": ...})
+  PRIMARY KEY (session_id, first_id)
+) WITHOUT ROWID;
+"""
+
+MESSAGE_COLUMNS = ("id", "role", "intent", "content", "created_at", "model", "prompt_version")
+
+def archive_dir() -> Path:
+    return Path(ARCHIVE_DIR) if ARCHIVE_DIR else db.DB_PATH.resolve().parent / "archive"
+
+def _open_archive(name: str) -> sqlite3.Connection:
+    path = archive_dir() / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path.as_posix(), timeout=10.0)
+    conn.executescript(ARCHIVE_SCHEMA)
+    return conn
+
+def _cutoff(days: float) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+# --- Archiving ---
+
+def candidates(days: float = RETENTION_DAYS, max_sessions: int = MAX_HOT_SESSIONS) -> List[Tuple[str, int, str]]:
+    """(session_id, last message id, last message time) of the hot sessions due for the archive."""
+    flush_writes()
+    with get_convo() as conn:
+        sessions = conn.execute(
+            "SELECT session_id, MAX(id), MAX(created_at) FROM messages GROUP BY session_id ORDER BY MAX(id) DESC"
+        ).fetchall()
+    cutoff = _cutoff(days) if days > 0 else None
+    return [
+        row for rank, row in enumerate(sessions)
+        if (cutoff is not None and row[2] < cutoff) or (max_sessions > 0 and rank >= max_sessions)
+    ]
+
+def _archive_session(session_id: str, last_id: int, last_at: str) -> int:
+    with get_convo() as conn:
+        messages = conn.execute(
+            f"SELECT {', '.join(MESSAGE_COLUMNS)} FROM messages WHERE session_id = ? AND id <= ? ORDER BY id",
+            (session_id, last_id),
+        ).fetchall()
+        feedback = conn.execute(
+            "SELECT f.message_id, f.rating, f.comment, f.created_at FROM feedback f "
+            "JOIN messages m ON m.id = f.message_id WHERE m.session_id = ? AND m.id <= ?",
+            (session_id, last_id),
+        ).fetchall()
+        summary = conn.execute(
+            "SELECT upto_message_id, content FROM summaries WHERE session_id = ?", (session_id,)
+        ).fetchone()
+    if not messages:
+        return 0
+    first_id = messages[0][0]
+    name = f"messages-{last_at[:7]}.db"
+    data = zlib.compress(json.dumps({"messages": messages, "feedback": feedback, "summary": summary}).encode("utf-8"), 6)
+
+    # The archive copy is committed before the hot rows go; a crash in between
+    # leaves the session in both places and the next pass replaces the copy
+    with closing(_open_archive(name)) as archive:
+        archive.execute(
+            "INSERT OR REPLACE INTO chunks (session_id, first_id, last_id, last_at, data) VALUES (?, ?, ?, ?, ?)",
+            (session_id, first_id, last_id, last_at, data),
+        )
+        archive.commit()
+    with get_convo() as conn:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO archived_sessions (session_id, first_id, last_id, archive, messages) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (session_id, first_id, last_id, name, len(messages)),
+            )
+            conn.execute(
+                "DELETE FROM feedback WHERE message_id IN "
+                "(SELECT id FROM messages WHERE session_id = ? AND id <= ?)",
+                (session_id, last_id),
+            )
+            conn.execute("DELETE FROM messages WHERE session_id = ? AND id <= ?", (session_id, last_id))
+            conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+            conn.commit()
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+    return len(messages)
+
+def archive_old_sessions(days: float = RETENTION_DAYS, max_sessions: int = MAX_HOT_SESSIONS) -> Dict[str, int]:
+    due = candidates(days, max_sessions)
+    moved = 0
+    for i, (session_id, last_id, last_at) in enumerate(due):
+        moved += _archive_session(session_id, last_id, last_at)
+        if (i + 1) % ARCHIVE_BATCH == 0:
+            time.sleep(0.05)  # let queued writers in between batches
+    return {"sessions": len(due), "messages": moved}
+
+def prune_metrics(days: float = RETENTION_DAYS) -> int:
+    """Traces are telemetry, not history: past the cutoff they are dropped, not archived."""
+    if days <= 0:
+        return 0
+    with get_convo() as conn:
+        cur = conn.execute("DELETE FROM metrics WHERE created_at < ?", (_cutoff(days),))
+        conn.commit()
+        return cur.rowcount
+
+# --- Compaction ---
+
+def checkpoint() -> Dict[str, int]:
+    """Copy the WAL into the database and truncate it (skipped while readers hold it)."""
+    with get_convo() as conn:
+        busy, wal_pages, moved = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    return {"busy": busy, "wal_pages": wal_pages, "checkpointed": moved}
+
+def incremental_vacuum(pages: int = VACUUM_PAGES) -> int:
+    """Give up to `pages` free pages back to the file system; returns how many were free."""
+    with get_convo() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if free:
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    return free
+
+def vacuum_full() -> None:
+    """Rewrite the file with incremental auto-vacuum on; locks the database while it runs."""
+    flush_writes()
+    with get_convo() as conn:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+
+def run_maintenance() -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    report: Dict[str, Any] = {
+        "archived": archive_old_sessions(RETENTION_DAYS, MAX_HOT_SESSIONS),
+        "metrics_pruned": prune_metrics(RETENTION_DAYS),
+    }
+    # Vacuum first: the pages it frees leave the file when the checkpoint truncates the WAL
+    report["free_pages"] = incremental_vacuum()
+    report["checkpoint"] = checkpoint()
+    report["hot_mb"] = round(db.DB_PATH.stat().st_size / 1e6, 2) if db.DB_PATH.exists() else 0.0
+    report["took_s"] = round(time.perf_counter() - t0, 3)
+    return report
+
+_started = False
+_start_lock = threading.Lock()
+
+def _loop() -> None:
+    while True:
+        time.sleep(MAINTENANCE_INTERVAL_S)
+        try:
+            log.info("maintenance: %s", run_maintenance())
+        except Exception:
+            log.exception("maintenance pass failed")
+
+def start() -> None:
+    """Once per process: run maintenance in the background every MAINTENANCE_INTERVAL_S."""
+    global _started
+    with _start_lock:
+        if _started or MAINTENANCE_INTERVAL_S <= 0:
+            return
+        _started = True
+    threading.Thread(target=_loop, name="db-maintenance", daemon=True).start()
+
+# --- Reads ---
+
+@lru_cache(maxsize=64)
+def _load_chunk(name: str, session_id: str, first_id: int) -> Dict[str, Any]:
+    # Archived chunks never change once written, so decoding them once is enough
+    path = archive_dir() / name
+    with closing(sqlite3.connect(f"file:{path.as_posix()}?mode=ro", uri=True)) as conn:
+        row = conn.execute(
+            "SELECT data FROM chunks WHERE session_id = ? AND first_id = ?", (session_id, first_id)
+        ).fetchone()
+    return json.loads(zlib.decompress(row[0])) if row else {"messages": [], "feedback": [], "summary": None}
+
+def read_archive(name: str) -> Iterator[Tuple[str, int, Dict[str, Any]]]:
+    """(session_id, first_id, decoded chunk) of every chunk in one archive file, bypassing the cache."""
+    path = archive_dir() / name
+    if not path.exists():
+        return
+    with closing(sqlite3.connect(f"file:{path.as_posix()}?mode=ro", uri=True)) as conn:
+        for session_id, first_id, data in conn.execute("SELECT session_id, first_id, data FROM chunks"):
+            yield session_id, first_id, json.loads(zlib.decompress(data))
+
+def archived_chunks(session_id: str) -> List[Tuple[int, str]]:
+    """(first_id, archive file) of the session's archived chunks, newest first."""
+    with get_convo() as conn:
+        return conn.execute(
+            "SELECT first_id, archive FROM archived_sessions WHERE session_id = ? ORDER BY first_id DESC",
+            (session_id,),
+        ).fetchall()
+
+def get_history(session_id: str, limit: int = 10) -> List[Tuple]:
+    """db.get_history that reaches into the archive when the hot rows don't fill `limit`."""
+    rows = db.get_history(session_id, limit=limit)
+    if len(rows) >= limit:
+        return rows
+    older: List[Tuple] = []
+    for first_id, name in archived_chunks(session_id):
+        chunk = _load_chunk(name, session_id, first_id)["messages"]
+        older = [tuple(m[:5]) for m in chunk] + older
+        if len(older) + len(rows) >= limit:
+            break
+    return (older + list(rows))[-limit:]
+
+def get_history_page(session_id: str, before_id: Optional[int] = None, limit: int = 20) -> Tuple[List[Tuple], Optional[int]]:
+    """db.get_history_page that carries on into the archive once the hot rows run out."""
+    rows, cursor = db.get_history_page(session_id, before_id, limit)
+    if cursor is not None:
+        return rows, cursor
+    # Archived messages are all older than the hot ones; one more than needed tells whether to go on
+    bound = rows[0][0] if rows else before_id
+    need = limit - len(rows)
+    older: List[Tuple] = []
+    for first_id, name in archived_chunks(session_id):
+        if bound is not None and first_id >= bound:
+            continue
+        chunk = _load_chunk(name, session_id, first_id)["messages"]
+        older = [tuple(m[:5]) for m in chunk if bound is None or m[0] < bound] + older
+        if len(older) > need:
+            break
+    page = (older[-need:] if need else []) + list(rows)
+    return page, (page[0][0] if len(older) > need else None)
+
+def clear_history(session_id: str) -> None:
+    """db.clear_history plus the session's archived chunks."""
+    chunks = archived_chunks(session_id)
+    for first_id, name in chunks:
+        path = archive_dir() / name
+        if path.exists():
+            with closing(_open_archive(name)) as archive:
+                archive.execute("DELETE FROM chunks WHERE session_id = ? AND first_id = ?", (session_id, first_id))
+                archive.commit()
+    _load_chunk.cache_clear()
+    with get_convo() as conn:
+        conn.execute("DELETE FROM archived_sessions WHERE session_id = ?", (session_id,))
+        conn.commit()
+    db.clear_history(session_id)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", type=Path, help="database file (default: db.DB_PATH)")
+    ap.add_argument("--days", type=float, default=RETENTION_DAYS, help="archive sessions idle this long")
+    ap.add_argument("--max-sessions", type=int, default=MAX_HOT_SESSIONS, help="keep this many sessions hot")
+    ap.add_argument("--dry-run", action="store_true", help="list the sessions that would be archived")
+    ap.add_argument("--vacuum-full", action="store_true", help="enable incremental auto-vacuum (full rewrite)")
+    args = ap.parse_args()
+    if args.db:
+        db.use_database(args.db)
+    RETENTION_DAYS, MAX_HOT_SESSIONS = args.days, args.max_sessions
+    if args.dry_run:
+        print(json.dumps([{"session_id": s, "last_id": i, "last_at": t} for s, i, t in candidates(args.days, args.max_sessions)], indent=2))
+    else:
+        if args.vacuum_full:
+            vacuum_full()
+        print(json.dumps(run_maintenance(), indent=2))
@@ -0,0 +1,172 @@
+# service.py
+"""
+The question → answer pipeline, shared by the Streamlit app, the HTTP API
+(api.py) and the load generator: route the intent, store the question, try
+pack the history, try the answer cache, generate, store the answer.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import hashlib
+import threading
+
+import answer_cache
+import summaries
+import tracing
+from answer_cache import CachedAnswer
+from context import pack_history
+from db import add_feedback, add_message, get_summary
+from intent_classifier import route
+from intents import compose_user_prompt
+from model import GenerationStats, chat_stream
+from retention import get_history
+from tracing import NULL_TRACE, Trace
+from utils import read_text_cached
+
+SYSTEM_PROMPT_PATH = Path(__file__).resolve().parent / "prompts" / "system_prompt.txt"
+HISTORY_LIMIT = 20
+
+def system_prompt() -> str:
+    """The base system prompt, re-read only when the file changes."""
+    return read_text_cached(str(SYSTEM_PROMPT_PATH))
+
+@lru_cache(maxsize=4)
+def _version(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:10]
+
+def prompt_version() -> str:
+    """Short hash of the system prompt, stored with every answer for the analytics rollups."""
+    return _version(system_prompt())
+
+@dataclass
+class Question:
+    """A stored question, ready to be answered from the cache or by the model."""
+    session_id: str
+    query: str
+    intent: str
+    message_id: int
+    temperature: float
+    max_tokens: int
+    structured: bool
+    system_prompt: str
+    user_prompt: str
+    cached: Optional[CachedAnswer] = None
+    history: List[Dict[str, str]] = field(default_factory=list)
+    trace: Trace = field(default=NULL_TRACE, repr=False)
+
+def prepare(
+    session_id: str,
+    query: str,
+    temperature: float = 0.3,
+    max_tokens: int = 512,
+    structured: bool = False,
+    history_rows: Optional[Sequence[Tuple]] = None,
+) -> Question:
+    """
+    Route and store the question and pack the prompt history; a question
+    asked without any history is then looked up in the answer cache (one
+    with history depends on it, so it is never served from or stored to the
+    cache). history_rows: the session's recent rows if the caller already
+    has them (not including this question).
+    """
+    trace = tracing.start()
+    if history_rows is None:
+        with trace.span("db_read"):
+            history_rows = get_history(session_id, limit=HISTORY_LIMIT)
+    with trace.span("route"):
+        intent = route(query)
+    with trace.span("db_write"):
+        message_id = add_message(session_id, "user", intent, query)
+    with trace.span("prompt"):
+        q = Question(
+            session_id=session_id,
+            query=query,
+            intent=intent,
+            message_id=message_id,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            structured=structured,
+            system_prompt=system_prompt(),
+            user_prompt=compose_user_prompt(intent, query),
+            trace=trace,
+        )
+    with trace.span("prompt"):
+        q.history = pack_history(
+            history_rows, q.system_prompt, q.user_prompt, max_tokens, summary=get_summary(session_id)
+        )
+    if not q.history:
+        with trace.span("cache_lookup"):
+            q.cached = answer_cache.lookup(intent, query, temperature, max_tokens, structured)
+    return q
+
+def generate(q: Question, stats: GenerationStats, cancel: Optional[threading.Event] = None) -> Iterator[Optional[str]]:
+    """The model's answer to `q` as a stream (see model.chat_stream for the None reset item)."""
+    return chat_stream(
+        system_prompt=q.system_prompt,
+        user_prompt=q.user_prompt,
+        history=q.history,
+        temperature=q.temperature,
+        max_tokens=q.max_tokens,
+        stats=stats,
+        structured=q.structured,
+        cancel=cancel,
+    )
+
+def save_answer(q: Question, answer: str, stats: Optional[GenerationStats] = None) -> int:
+    """
+    Store the answer (and, if it was generated without history, cache it)
+    and close the question's trace; returns the answer's message id.
+    """
+    # A cache hit is credited to the model that generated the cached answer
+    model = q.cached.model if q.cached else stats.model if stats else None
+    with q.trace.span("db_write"):
+        if q.cached:
+            entry_id = q.cached.entry_id
+        elif q.history:
+            entry_id = None  # the answer follows from this session's conversation
+        else:
+            entry_id = answer_cache.store(
+                q.intent, q.query, q.temperature, q.max_tokens, answer, stats.gen_s if stats else 0.0, q.structured, model
+            )
+        message_id = add_message(
+            q.session_id, "assistant", q.intent, answer, model=model, prompt_version=_version(q.system_prompt)
+        )
+        answer_cache.link_message(entry_id, message_id)
+    summaries.maybe_schedule(q.session_id)
+    tracing.finish(q.trace, message_id, q.session_id, q.intent, q.cached is not None, stats, model)
+    return message_id
+
+def feedback(message_id: int, rating: int, comment: Optional[str] = None) -> None:
+    """
+    Record a rating (+1, -1, or 0 for a bare comment) on an answer; a thumbs
+    down also stops the answer cache from serving that answer again.
+    """
+    add_feedback(message_id, rating, comment)
+    if rating < 0:
+        answer_cache.invalidate_message(message_id)
+
+def ask(
+    session_id: str,
+    query: str,
+    temperature: float = 0.3,
+    max_tokens: int = 512,
+    structured: bool = False,
+    stats: Optional[GenerationStats] = None,
+) -> Tuple[Question, str, int]:
+    """The whole pipeline, blocking: (question, answer, answer message id)."""
+    q = prepare(session_id, query, temperature, max_tokens, structured)
+    if q.cached:
+        return q, q.cached.answer, save_answer(q, q.cached.answer)
+    stats = stats if stats is not None else GenerationStats()
+    parts: List[str] = []
+    for piece in generate(q, stats):
+        if piece is None:
+            parts = []
+        else:
+            parts.append(piece)
+    answer = "".join(parts).strip()
+    if not answer:
+        raise RuntimeError("The model returned an empty answer")
+    return q, answer, save_answer(q, answer, stats)
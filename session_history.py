@@ -0,0 +1,73 @@
+# session_history.py
+"""
+The recent messages of the current session, kept in st.session_state. The
+database is read once per session; after that the app appends what it
+inserts, so a rerun (a slider nudge, a feedback click) costs no query.
+Only this session writes its messages, so the copy can't go stale.
+Older messages are loaded a page at a time on request (load_older), each
+page a keyset read before the oldest message already loaded.
+"""
+from __future__ import annotations
+from typing import Any, Dict, List, Tuple
+
+import streamlit as st
+
+from db import _utc_now
+from retention import clear_history, get_history, get_history_page
+
+HISTORY_LIMIT = 20
+
+def _key(session_id: str) -> str:
+    return f"history_rows:{session_id}"
+
+def rows(session_id: str) -> List[Tuple]:
+    """(id, role, intent, content, created_at), oldest first, at most HISTORY_LIMIT."""
+    key = _key(session_id)
+    if key not in st.session_state:
+        st.session_state[key] = list(get_history(session_id, limit=HISTORY_LIMIT))
+    return st.session_state[key]
+
+def _older(session_id: str) -> Dict[str, Any]:
+    key = f"history_older:{session_id}"
+    if key not in st.session_state:
+        # Fewer than a full window means get_history found nothing further back
+        st.session_state[key] = {"rows": [], "more": len(rows(session_id)) >= HISTORY_LIMIT}
+    return st.session_state[key]
+
+def older(session_id: str) -> List[Tuple]:
+    """Messages before rows(), oldest first, as far back as load_older() has gone."""
+    return _older(session_id)["rows"]
+
+def has_older(session_id: str) -> bool:
+    return _older(session_id)["more"]
+
+def load_older(session_id: str, page_size: int = HISTORY_LIMIT) -> None:
+    """Fetch the page of messages before the oldest one loaded so far."""
+    state = _older(session_id)
+    shown = state["rows"] or rows(session_id)
+    if not shown:
+        state["more"] = False
+        return
+    page, cursor = get_history_page(session_id, before_id=shown[0][0], limit=page_size)
+    state["rows"][:0] = page
+    state["more"] = cursor is not None
+
+def append(session_id: str, msg_id: int, role: str, intent: str, content: str) -> None:
+    """Record a message the app just stored with db.add_message."""
+    cached = rows(session_id)
+    if cached and cached[-1][0] >= msg_id:
+        return
+    cached.append((msg_id, role, intent, content, _utc_now()))
+    if len(cached) > HISTORY_LIMIT:
+        # Once older pages are shown, what drops out of the window joins them, leaving no gap
+        state = _older(session_id)
+        if state["rows"]:
+            state["rows"].extend(cached[:-HISTORY_LIMIT])
+        else:
+            state["more"] = True
+        del cached[:-HISTORY_LIMIT]
+
+def clear(session_id: str) -> None:
+    clear_history(session_id)
+    st.session_state[_key(session_id)] = []
+    st.session_state.pop(f"history_older:{session_id}", None)
@@ -0,0 +1,77 @@
+# speculative.py
+"""
+Draft models for llama-cpp-python's speculative decoding. The main model
+verifies every drafted token by sampling it itself and keeps only the ones
+that match, so answers follow exactly the same distribution as without a
+draft; only the number of sequential decode steps changes.
+
+  "prompt-lookup"   n-gram matches against the prompt and the answer so far.
+                    Free to run, and our answers repeat a lot of template and
+                    history phrasing.
+  "model:<path>"    a small GGUF with the same vocabulary, run greedily.
+"""
+from __future__ import annotations
+from typing import Any, Optional
+
+import numpy as np
+import numpy.typing as npt
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+class SmallModelDraft(LlamaDraftModel):
+    """Greedy continuation from a smaller model; it keeps its own KV cache across calls."""
+
+    def __init__(self, model_path: str, num_pred_tokens: int, n_ctx: int, n_threads: Optional[int] = None):
+        self.num_pred_tokens = num_pred_tokens
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], /, **kwargs: Any) -> npt.NDArray[np.intc]:
+        draft = []
+        # generate() only evaluates the part of input_ids its cache doesn't hold yet
+        gen = self.llm.generate(input_ids.tolist(), temp=0.0, top_k=1, reset=True)
+        try:
+            for token in gen:
+                draft.append(token)
+                if len(draft) >= self.num_pred_tokens:
+                    break
+        finally:
+            gen.close()
+        return np.array(draft, dtype=np.intc)
+
+class CountingDraft(LlamaDraftModel):
+    """
+    Wraps a draft model and counts proposed vs accepted tokens. Each call's
+    input is the previous input plus the tokens the main model kept, so the
+    accepted part of the previous proposal is their common prefix.
+    """
+
+    def __init__(self, inner: LlamaDraftModel):
+        self.inner = inner
+        self.proposed = 0
+        self.accepted = 0
+        self._last_input: Optional[npt.NDArray[np.intc]] = None
+        self._last_draft: Optional[npt.NDArray[np.intc]] = None
+
+    def __call__(self, input_ids: npt.NDArray[np.intc], /, **kwargs: Any) -> npt.NDArray[np.intc]:
+        last, pending = self._last_input, self._last_draft
+        if last is not None and pending is not None and len(pending) and len(input_ids) > len(last) \
+                and np.array_equal(input_ids[: len(last)], last):
+            kept = input_ids[len(last):]
+            n = min(len(kept), len(pending))
+            mismatch = np.flatnonzero(kept[:n] != pending[:n])
+            self.proposed += len(pending)
+            self.accepted += int(mismatch[0]) if len(mismatch) else n
+        draft = self.inner(input_ids, **kwargs)
+        self._last_input = np.array(input_ids, copy=True)
+        self._last_draft = np.asarray(draft)
+        return draft
+
+def make_draft(spec: str, num_pred_tokens: int, n_ctx: int, n_threads: Optional[int] = None) -> Optional[CountingDraft]:
+    """Draft model for a CAREERGUIDE_DRAFT value, or None when it is "off"."""
+    if not spec or spec == "off":
+        return None
+    if spec == "prompt-lookup":
+        return CountingDraft(LlamaPromptLookupDecoding(num_pred_tokens=num_pred_tokens))
+    if spec.startswith("model:"):
+        return CountingDraft(SmallModelDraft(spec[len("model:"):], num_pred_tokens, n_ctx, n_threads))
+    raise ValueError(f"Unknown draft mode {spec!r}; use off, prompt-lookup or model:<path>")
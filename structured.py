@@ -0,0 +1,70 @@
+# structured.py
+"""
+Structured answer mode: a llama.cpp GBNF grammar that only admits a 1–2 line
+summary, 4–8 "- " bullets and an optional closing "Question: …?" line. There
+is no room for headings or extra sections, lines are length-bounded, and
+once the eighth bullet or the question is complete the only token left is
+end-of-text, so generation stops there instead of running to max_tokens.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+import os
+import threading
+
+# Default for the "Structured answers" toggle
+STRUCTURED = os.getenv("CAREERGUIDE_STRUCTURED", "off") == "on"
+
+QUESTION_PREFIX = "Question: "
+
+ANSWER_GBNF = r"""
+root     ::= summary bullet bullet bullet bullet bullet? bullet? bullet? bullet? question?
+summary  ::= line line?
+line     ::= [^-#*\n ] [^\n]{0,220} "\n"
+bullet   ::= "- " [^\n]{4,200} "\n"
+question ::= "Question: " [^\n?]{3,160} "?"
+"""
+
+_grammar: Any = None
+_grammar_lock = threading.Lock()
+
+def get_grammar() -> Any:
+    """The parsed LlamaGrammar, built once per process."""
+    global _grammar
+    with _grammar_lock:
+        if _grammar is None:
+            from llama_cpp import LlamaGrammar
+            _grammar = LlamaGrammar.from_string(ANSWER_GBNF, verbose=False)
+        return _grammar
+
+@dataclass
+class StructuredAnswer:
+    summary: str
+    bullets: List[str] = field(default_factory=list)
+    question: Optional[str] = None
+
+def parse(text: str) -> Optional[StructuredAnswer]:
+    """
+    Split an answer in the grammar's shape into its parts; None for free-form
+    text. Partial answers (still streaming) parse as soon as a bullet exists.
+    """
+    summary: List[str] = []
+    bullets: List[str] = []
+    question = None
+    for line in (text or "").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if question is not None:
+            return None
+        if line.startswith("- "):
+            bullets.append(line[2:].strip())
+        elif line.startswith(QUESTION_PREFIX.strip()):
+            question = line[len(QUESTION_PREFIX.strip()):].strip()
+        elif not bullets and len(summary) < 2:
+            summary.append(line)
+        else:
+            return None
+    if not summary or not bullets:
+        return None
+    return StructuredAnswer(" ".join(summary), bullets, question)
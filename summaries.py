@@ -0,0 +1,153 @@
+# summaries.py
+"""
+Rolling per-session conversation summaries. After every few turns a
+background thread folds the older messages of a session into its stored
+summary, so prompts carry summary + recent turns instead of either losing
+context or growing without bound. Jobs only use the model when the inference
+pool is idle, and a pass stops as soon as a user request queues behind it,
+so they don't add latency to user requests.
+"""
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Set, Tuple
+import logging
+import os
+import threading
+import time
+
+from db import count_messages_after, get_messages_after, get_summary, save_summary
+from model import N_CTX, chat_stream, pool_stats, truncate_tokens
+
+# Summarize once this many turns (question + answer) have piled up past the summary
+SUMMARY_EVERY_TURNS = int(os.getenv("CAREERGUIDE_SUMMARY_EVERY", "3"))
+# The newest messages always stay verbatim in the prompt
+KEEP_RECENT_MESSAGES = int(os.getenv("CAREERGUIDE_SUMMARY_KEEP_RECENT", "4"))
+SUMMARY_MAX_TOKENS = 160
+# Summarizer system prompt, previous summary and framing
+PROMPT_RESERVE_TOKENS = 400
+# Each message folded in keeps at least this much; "Role: " and the newline cost the overhead
+FOLD_MIN_TOKENS = 32
+LINE_OVERHEAD_TOKENS = 4
+# How long a job waits for the model pool to go idle before giving up until next time
+IDLE_WAIT_S = 120.0
+# Passes a job starts over after giving way to a user request
+PREEMPTED_RETRIES = 3
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You condense career-advice conversations. Write a short plain summary (under 120 words) "
+    "of what the user wants, their background, and the advice already given. No headings."
+)
+
+log = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+_pending: Set[str] = set()
+# Answers per session since its last check, in this process
+_answers: Dict[str, int] = {}
+_pending_lock = threading.Lock()
+
+def _wait_for_idle_pool() -> bool:
+    deadline = time.monotonic() + IDLE_WAIT_S
+    while time.monotonic() < deadline:
+        load = pool_stats()
+        if load["busy_workers"] == 0 and load["queue_depth"] == 0:
+            return True
+        time.sleep(0.5)
+    return False
+
+def _generate(user_prompt: str) -> Optional[str]:
+    """The summary, or None if a user request queued up meanwhile and the pass was dropped."""
+    cancel = threading.Event()
+    parts = []
+    stream = chat_stream(
+        system_prompt=SUMMARY_SYSTEM_PROMPT,
+        user_prompt=user_prompt,
+        history=[],
+        temperature=0.1,
+        max_tokens=SUMMARY_MAX_TOKENS,
+        cancel=cancel,
+    )
+    try:
+        for piece in stream:
+            if pool_stats()["queue_depth"] > 0:
+                cancel.set()
+                return None
+            if piece is None:
+                parts = []
+            else:
+                parts.append(piece)
+    finally:
+        stream.close()
+    return "".join(parts).strip()
+
+def summarize_session(session_id: str) -> Optional[Tuple[int, str]]:
+    """Fold the messages before the recent window (as many as fit, oldest first) into the session summary; runs synchronously."""
+    current = get_summary(session_id)
+    after_id = current[0] if current else 0
+    rows = get_messages_after(session_id, after_id)
+    older = rows[:-KEEP_RECENT_MESSAGES] if KEEP_RECENT_MESSAGES else rows
+    if not older:
+        return current
+
+    # Share what the context has left between the messages being folded in; past
+    # the number that still get FOLD_MIN_TOKENS each, the oldest go first and
+    # the rest wait for the next pass, so the prompt always fits n_ctx
+    room = N_CTX - SUMMARY_MAX_TOKENS - PROMPT_RESERVE_TOKENS
+    older = older[:max(1, room // (FOLD_MIN_TOKENS + LINE_OVERHEAD_TOKENS))]
+    per_message = room // len(older) - LINE_OVERHEAD_TOKENS
+    transcript = "\n".join(
+        f"{role.title()}: {truncate_tokens(content, per_message)}"
+        for _id, role, _intent, content, _ts in older
+    )
+    previous = f"Summary so far: {current[1]}\n\n" if current else ""
+    prompt = f"{previous}New messages:\n{transcript}\n\nUpdated summary:"
+    for _attempt in range(1 + PREEMPTED_RETRIES):
+        if not _wait_for_idle_pool():
+            return current
+        text = _generate(prompt)
+        if text is not None:
+            break
+    else:
+        return current
+    upto_id = older[-1][0]
+    if text and save_summary(session_id, upto_id, text):
+        return upto_id, text
+    return get_summary(session_id)
+
+def _due(session_id: str) -> bool:
+    current = get_summary(session_id)
+    after_id = current[0] if current else 0
+    unsummarized = count_messages_after(session_id, after_id) - KEEP_RECENT_MESSAGES
+    return unsummarized >= SUMMARY_EVERY_TURNS * 2
+
+def _run(session_id: str) -> None:
+    try:
+        # Counting reads the database (and flushes write-behind), so it happens here, off the request path
+        # A long backlog takes several passes, each folding in what fits
+        while _due(session_id):
+            before = get_summary(session_id)
+            if summarize_session(session_id) == before:
+                break
+    except Exception:
+        log.exception("summarizing session %s failed", session_id)
+    finally:
+        with _pending_lock:
+            _pending.discard(session_id)
+
+def maybe_schedule(session_id: str) -> bool:
+    """
+    Count an answer; every SUMMARY_EVERY_TURNS of a session queue a background
+    check of whether a summary is due. No database access, so it is cheap
+    enough for every request.
+    """
+    with _pending_lock:
+        if len(_answers) > 100_000:
+            _answers.clear()
+        answers = _answers.get(session_id, 0) + 1
+        if answers < SUMMARY_EVERY_TURNS or session_id in _pending:
+            _answers[session_id] = answers
+            return False
+        _answers.pop(session_id, None)
+        _pending.add(session_id)
+    _executor.submit(_run, session_id)
+    return True
@@ -0,0 +1,57 @@
+# tests/test_analytics.py
+"""Rollup counters kept by triggers versus analytics.rebuild(), with archived sessions."""
+from dataclasses import asdict
+
+import pytest
+
+import analytics
+import db
+import retention
+
+OLD = "11111111-2222-4333-8444-555555555555"
+NEW = "66666666-7777-4888-8999-000000000000"
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    db.use_database(tmp_path / "t.db")
+    monkeypatch.setattr(retention, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    retention._load_chunk.cache_clear()
+    yield
+    retention._load_chunk.cache_clear()
+    db.close_db()
+
+def _turn(session_id, intent, rating=None):
+    db.add_message(session_id, "user", intent, "question")
+    answer_id = db.add_message(session_id, "assistant", intent, "answer", model="m.gguf", prompt_version="v1")
+    if rating is not None:
+        db.add_feedback(answer_id, rating, None)
+
+def _counters():
+    return {dim: [asdict(r) for r in analytics.by(dim)] for dim in analytics.DIMENSIONS}
+
+def test_rebuild_keeps_archived_sessions(database):
+    _turn(OLD, "resume_help", 1)
+    _turn(OLD, "salary_negotiation", -1)
+    with db.get_convo() as conn:
+        conn.execute("UPDATE messages SET created_at = '2020-01-01 00:00:00'")
+        conn.commit()
+    analytics.rebuild()  # the backdating bypassed the day counters
+    assert retention.archive_old_sessions(days=90)["messages"] == 4
+    _turn(NEW, "resume_help", 1)
+    _turn(NEW, "general_guidance")
+    before = _counters()
+    analytics.rebuild()
+    assert _counters() == before
+    assert analytics.totals().questions == 4
+
+def test_relabel_moves_counts_to_the_new_intent(database):
+    _turn(NEW, "general_guidance", -1)
+    with db.get_convo() as conn:
+        conn.execute("UPDATE messages SET intent = 'resume_help'")
+        conn.commit()
+    after_update = _counters()
+    analytics.rebuild()
+    assert _counters() == after_update
+    by_intent = {r.key: r for r in analytics.by("intent")}
+    assert (by_intent["resume_help"].questions, by_intent["resume_help"].downvotes) == (1, 1)
+    assert "general_guidance" not in by_intent
@@ -0,0 +1,54 @@
+# tests/test_retention.py
+"""History paging across the hot database and the archive (retention.py)."""
+import pytest
+
+import db
+import retention
+
+SESSION = "11111111-2222-4333-8444-555555555555"
+
+@pytest.fixture
+def split_session(tmp_path, monkeypatch):
+    """SESSION with messages 1-3 archived and 4-5 still hot."""
+    db.use_database(tmp_path / "t.db")
+    monkeypatch.setattr(retention, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    retention._load_chunk.cache_clear()
+    for i in range(3):
+        db.add_message(SESSION, "user", "resume_help", f"archived {i}")
+    with db.get_convo() as conn:
+        conn.execute("UPDATE messages SET created_at = '2020-01-01 00:00:00'")
+        conn.commit()
+    assert retention.archive_old_sessions(days=90)["messages"] == 3
+    for i in range(2):
+        db.add_message(SESSION, "user", "resume_help", f"hot {i}")
+    yield
+    retention._load_chunk.cache_clear()
+    db.close_db()
+
+def _ids(rows):
+    return [r[0] for r in rows]
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 4, 5, 6, 10])
+def test_pages_cover_hot_and_archived_messages(split_session, limit):
+    seen, cursor = [], None
+    while True:
+        page, cursor = retention.get_history_page(SESSION, cursor, limit)
+        assert len(page) <= limit
+        seen = _ids(page) + seen
+        if cursor is None:
+            break
+        assert cursor == page[0][0]
+    assert seen == [1, 2, 3, 4, 5]
+
+def test_page_larger_than_hot_rows_fills_from_archive(split_session):
+    page, cursor = retention.get_history_page(SESSION, None, 6)
+    assert _ids(page) == [1, 2, 3, 4, 5]
+    assert cursor is None
+
+def test_page_ending_at_the_boundary_points_into_archive(split_session):
+    page, cursor = retention.get_history_page(SESSION, None, 2)
+    assert _ids(page) == [4, 5]
+    assert cursor == 4
+    page, cursor = retention.get_history_page(SESSION, cursor, 2)
+    assert _ids(page) == [2, 3]
+    assert cursor == 2
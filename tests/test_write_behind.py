@@ -0,0 +1,60 @@
+# tests/test_write_behind.py
+"""Message id allocation by write-behind writers sharing one database (db.WriteBehind)."""
+import sqlite3
+
+import pytest
+
+import db
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    db.use_database(tmp_path / "t.db")
+    monkeypatch.setattr(db, "WRITE_BEHIND", True)
+    writers = []
+
+    def writer(id_block):
+        w = db.WriteBehind(id_block=id_block)
+        writers.append(w)
+        return w
+
+    yield writer
+    for w in writers:
+        w.close()
+    monkeypatch.setattr(db, "_writer", None)
+    db.close_db()
+
+def _add(monkeypatch, writer, session_id, content):
+    # Each writer stands in for one process's db._writer
+    monkeypatch.setattr(db, "_writer", writer)
+    return db.add_message(session_id, "user", "resume_help", content)
+
+def _rows():
+    with db.get_convo() as conn:
+        return {r[0]: (r[1], r[2]) for r in conn.execute("SELECT id, session_id, content FROM messages")}
+
+def test_two_writers_never_hand_out_the_same_id(database, monkeypatch):
+    app, api = database(id_block=4), database(id_block=4)
+    expected = {}
+    for i in range(10):
+        for name, writer in (("app", app), ("api", api)):
+            msg_id = _add(monkeypatch, writer, name, f"{name} {i}")
+            assert msg_id not in expected
+            expected[msg_id] = (name, f"{name} {i}")
+    app.flush()
+    api.flush()
+    assert _rows() == expected
+
+def test_plain_inserts_number_after_reserved_blocks(database, monkeypatch, tmp_path):
+    writer = database(id_block=8)
+    reserved = _add(monkeypatch, writer, "app", "queued")
+    # Another process in synchronous mode lets AUTOINCREMENT pick the id
+    conn = sqlite3.connect((tmp_path / "t.db").as_posix())
+    with conn:
+        other = conn.execute(
+            "INSERT INTO messages (session_id, role, intent, content) VALUES ('api', 'user', 'resume_help', 'direct')"
+        ).lastrowid
+    conn.close()
+    assert other >= reserved + 8
+    later = _add(monkeypatch, writer, "app", "queued later")
+    writer.flush()
+    assert _rows() == {reserved: ("app", "queued"), later: ("app", "queued later"), other: ("api", "direct")}
@@ -0,0 +1,184 @@
+# tracing.py
+"""
+Per-request latency tracing. service.py opens a Trace for every question and
+times its stages (routing, history read, prompt assembly, cache lookup, DB
+writes); the model stages (queue wait, prompt eval, generation, echo
+fallback) come from GenerationStats. finish() stores the spans with the token
+counts in the metrics table, keyed by the answer's message id, and adds them
+to in-process histograms that prometheus_text() exports (api.py serves them
+at /metrics).
+
+With CAREERGUIDE_TRACING=off, start() hands out a shared no-op trace: a span
+costs one method call and nothing is stored.
+"""
+from __future__ import annotations
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Dict, Iterator, List, Optional, Tuple
+import json
+import os
+import threading
+import time
+
+from db import add_metrics
+from model import GenerationStats
+
+TRACING = os.getenv("CAREERGUIDE_TRACING", "on") != "off"
+
+# Histogram bucket bounds, seconds (+Inf is implied)
+BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Trace:
+    """Named stage durations of one request; a stage timed twice adds up."""
+    __slots__ = ("started", "spans")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+
+    @contextmanager
+    def _timed(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def span(self, name: str) -> ContextManager[None]:
+        return self._timed(name)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+class _NullTrace(Trace):
+    __slots__ = ()
+
+    def __init__(self) -> None:
+        pass
+
+    def span(self, name: str) -> ContextManager[None]:
+        return _NULL_SPAN
+
+    def add(self, name: str, seconds: float) -> None:
+        pass
+
+_NULL_SPAN = nullcontext()
+NULL_TRACE = _NullTrace()
+
+def start() -> Trace:
+    return Trace() if TRACING else NULL_TRACE
+
+class _Histogram:
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self) -> None:
+        self.buckets = [0] * len(BUCKETS_S)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(BUCKETS_S):
+            if value <= bound:
+                self.buckets[i] += 1
+        self.sum += value
+        self.count += 1
+
+_lock = threading.Lock()
+_requests: Dict[Tuple[str, str, str], _Histogram] = {}     # (intent, model, cached)
+_ttft: Dict[Tuple[str, str], _Histogram] = {}              # (intent, model)
+_stages: Dict[Tuple[str, str], _Histogram] = {}            # (stage, model)
+_tokens: Dict[Tuple[str, str], int] = {}                   # (model, kind)
+_echo_fallbacks: Dict[str, int] = {}                       # model
+_echo_discarded: Dict[str, int] = {}                       # model
+
+def finish(
+    trace: Trace,
+    message_id: int,
+    session_id: str,
+    intent: str,
+    cached: bool,
+    stats: Optional[GenerationStats] = None,
+    model_name: Optional[str] = None,
+) -> None:
+    """
+    Close the trace of the request answered by `message_id` and record it
+    under `model_name`, the model that generated the answer.
+    """
+    if trace is NULL_TRACE:
+        return
+    total_s = time.perf_counter() - trace.started
+    generated = stats is not None and stats.ttft_s is not None
+    if generated:
+        trace.add("queue_wait", stats.queue_wait_s)
+        trace.add("prompt_eval", stats.ttft_s - stats.queue_wait_s)
+        trace.add("generate", max(0.0, stats.gen_s - stats.ttft_s - stats.echo_s))
+        if stats.echo_fallback:
+            trace.add("echo_fallback", stats.echo_s)
+    name = model_name or "unknown"
+    add_metrics({
+        "message_id": message_id,
+        "session_id": session_id,
+        "intent": intent,
+        "model": name,
+        "cached": int(cached),
+        "total_ms": round(total_s * 1000, 2),
+        "ttft_ms": round(stats.ttft_s * 1000, 2) if generated else None,
+        "prompt_tokens": stats.prompt_tokens if generated else None,
+        "prompt_tokens_reused": stats.prompt_tokens_reused if generated else None,
+        "completion_tokens": stats.completion_tokens if generated else None,
+        "echo_fallback": int(generated and stats.echo_fallback),
+        "echo_discarded_tokens": stats.echo_discarded_tokens if generated else None,
+        "spans": json.dumps({k: round(v * 1000, 2) for k, v in trace.spans.items()}),
+    })
+    with _lock:
+        _requests.setdefault((intent, name, str(cached).lower()), _Histogram()).observe(total_s)
+        for stage, seconds in trace.spans.items():
+            _stages.setdefault((stage, name), _Histogram()).observe(seconds)
+        if generated:
+            _ttft.setdefault((intent, name), _Histogram()).observe(stats.ttft_s)
+            for kind, n in (("prompt", stats.prompt_tokens), ("completion", stats.completion_tokens)):
+                _tokens[(name, kind)] = _tokens.get((name, kind), 0) + n
+            if stats.echo_fallback:
+                _echo_fallbacks[name] = _echo_fallbacks.get(name, 0) + 1
+                _echo_discarded[name] = _echo_discarded.get(name, 0) + stats.echo_discarded_tokens
+
+def _labels(**labels: str) -> str:
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{k}="{escape(v)}"' for k, v in labels.items())
+
+def _histogram_lines(name: str, help_text: str, series: Dict[Tuple, _Histogram], label_names: Tuple[str, ...]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for key, hist in sorted(series.items()):
+        labels = _labels(**dict(zip(label_names, key)))
+        for bound, n in zip(BUCKETS_S, hist.buckets):
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {n}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+        lines.append(f"{name}_sum{{{labels}}} {hist.sum:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {hist.count}")
+    return lines
+
+def prometheus_text(extra_gauges: Optional[Dict[str, Any]] = None) -> str:
+    """Everything recorded by this process, in the Prometheus text exposition format."""
+    with _lock:
+        lines = _histogram_lines(
+            "careerguide_request_seconds", "Time from question to stored answer.",
+            _requests, ("intent", "model", "cached"),
+        )
+        lines += _histogram_lines(
+            "careerguide_ttft_seconds", "Time to the first generated token, queue wait included.",
+            _ttft, ("intent", "model"),
+        )
+        lines += _histogram_lines(
+            "careerguide_stage_seconds", "Time spent per request stage.", _stages, ("stage", "model"),
+        )
+        lines += ["# HELP careerguide_tokens_total Prompt and completion tokens.", "# TYPE careerguide_tokens_total counter"]
+        lines += [f"careerguide_tokens_total{{{_labels(model=m, kind=k)}}} {n}" for (m, k), n in sorted(_tokens.items())]
+        lines += ["# HELP careerguide_echo_fallbacks_total Answers regenerated after an instruction echo.",
+                  "# TYPE careerguide_echo_fallbacks_total counter"]
+        lines += [f"careerguide_echo_fallbacks_total{{{_labels(model=m)}}} {n}" for m, n in sorted(_echo_fallbacks.items())]
+        lines += ["# HELP careerguide_echo_discarded_tokens_total Tokens thrown away with an instruction echo.",
+                  "# TYPE careerguide_echo_discarded_tokens_total counter"]
+        lines += [f"careerguide_echo_discarded_tokens_total{{{_labels(model=m)}}} {n}" for m, n in sorted(_echo_discarded.items())]
+    for name, value in (extra_gauges or {}).items():
+        lines += [f"# TYPE careerguide_{name} gauge", f"careerguide_{name} {value}"]
+    return "\n".join(lines) + "\n"
@@ -1,19 +1,24 @@
 
 import os
 import base64
+import html
+from functools import lru_cache
 import streamlit as st
-from utils import badge
+from utils import BASE_CSS, badge, minify_css, read_cached
+from db import SNIPPET_OPEN, SNIPPET_CLOSE
+from structured import parse as parse_structured
+
+@lru_cache(maxsize=4)
+def _data_uri(path: str, mtime_ns: int) -> str:
+    b64 = base64.b64encode(read_cached(path)).decode("utf-8")
+    return f"data:image/png;base64,{b64}"
 
 def _robot_data_uri(path: str = "assets/robot.png") -> str | None:
     if os.path.exists(path):
-        with open(path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode("utf-8")
-        return f"data:image/png;base64,{b64}"
+        return _data_uri(path, os.stat(path).st_mtime_ns)
     return None
 
-def load_styles() -> None:
-    st.markdown(
-        """
+APP_CSS = """
         <style>
             .stApp { background: #fafafa    ; color: #0f172a; }
             .main .block-container { max-width: 900px; position: relative; z-index: 2; }
@@ -58,12 +63,25 @@ def load_styles() -> None:
             .user-bubble { background:#f5f3ff; border-color:#e9d5ff; }
             .assistant-bubble { background:#eef2ff; border-color:#c7d2fe; }
             .bubble-meta { font-size:12px; color:#6b7280; margin-bottom:6px; }
+            .answer-summary { font-weight:600; margin:0 0 6px 0; }
+            .answer-bullets { margin:0 0 6px 0; padding-left:1.2rem; }
+            .answer-question { font-style:italic; color:#4c1d95; margin:0; }
+
+            .search-hit { padding: 8px 2px; border-bottom:1px solid #edeef2; }
+            .search-hit mark { background:#ede9fe; color:#4c1d95; padding:0 2px; border-radius:4px; }
 
             .feedback-row .stButton > button { padding: 0.4rem 0.6rem    ; border-radius:10px    ; }
         </style>
-        """,
-        unsafe_allow_html=True,
-    )
+"""
+
+@lru_cache(maxsize=1)
+def _styles() -> str:
+    # Base theme first so the app rules win, as when they were injected separately
+    return minify_css(BASE_CSS + APP_CSS)
+
+def load_styles() -> None:
+    """All page CSS in one element, built once per process."""
+    st.markdown(_styles(), unsafe_allow_html=True)
 
 def show_bg() -> None:
     uri = _robot_data_uri("assets/robot.png")
@@ -87,24 +105,72 @@ def show_bg() -> None:
             unsafe_allow_html=True,
         )
 
-def page_header() -> None:
+def _model_line(model_status: dict) -> str:
+    active = model_status["active"]
+    line = (
+        f"Model: <b>{html.escape(active['name'])}</b> · {active['n_threads']} threads · "
+        f"ctx {active['n_ctx']} · {html.escape(active['chat_format'])}"
+    )
+    if active["workers"] > 1:
+        line += f" · {active['workers']} workers"
+    loading = model_status.get("loading")
+    if loading:
+        line += f" · {html.escape(loading['stage'])} {html.escape(loading['name'])}…"
+    elif model_status.get("ready"):
+        line += ' · <span style="color:#15803d">ready</span>'
+    if model_status.get("error"):
+        line += f' · <span style="color:#b91c1c">{html.escape(model_status["error"])}</span>'
+    return line
+
+def page_header(model_status: dict | None = None) -> None:
+    model_html = f'<div class="muted">{_model_line(model_status)}</div>' if model_status else ""
     st.markdown(
-        """
+        f"""
         <div class="title">
             <div class="dot"></div>
             <h1 style="margin:0">CareerGuide</h1>
         </div>
         <div class="subtitle"> llama.cpp-powered career advisor.</div>
+        {model_html}
         """,
         unsafe_allow_html=True,
     )
 
-def chat_bubble(message_id, role, intent_name, text, timestamp) -> None:
+def _answer_html(text: str) -> str:
+    """Summary, bullet list and closing question for answers in the structured shape."""
+    parsed = parse_structured(text)
+    if parsed is None:
+        return text
+    bullets = "".join(f"<li>{html.escape(b)}</li>" for b in parsed.bullets)
+    out = f'<p class="answer-summary">{html.escape(parsed.summary)}</p><ul class="answer-bullets">{bullets}</ul>'
+    if parsed.question:
+        out += f'<p class="answer-question">{html.escape(parsed.question)}</p>'
+    return out
+
+@lru_cache(maxsize=256)
+def _bubble_html(role: str, intent_name: str, text: str, timestamp: str) -> str:
     bubble_class = "assistant-bubble" if role == "assistant" else "user-bubble"
-    st.markdown(
+    body = _answer_html(text) if role == "assistant" else text
+    return (
         f'<div class="bubble {bubble_class}">'
         f'<div class="bubble-meta">{badge(intent_name)} {timestamp}</div>'
-        f'<div>{text}</div>'
+        f'<div>{body}</div>'
+        f"</div>"
+    )
+
+def chat_bubble(message_id, role, intent_name, text, timestamp) -> None:
+    # Stored messages render the same on every rerun; streaming partials are one-offs
+    build = _bubble_html if message_id is not None else _bubble_html.__wrapped__
+    st.markdown(build(role, intent_name, text, timestamp), unsafe_allow_html=True)
+
+def search_hit(hit: dict) -> None:
+    """One db.search_messages() result: who, intent and when, over the snippet with its matches marked."""
+    snippet = html.escape(hit["snippet"]).replace(SNIPPET_OPEN, "<mark>").replace(SNIPPET_CLOSE, "</mark>")
+    who = "You" if hit["role"] == "user" else "CareerGuide"
+    st.markdown(
+        f'<div class="search-hit">'
+        f'<div class="bubble-meta">{badge(hit["intent"])} {who} · {hit["created_at"]}</div>'
+        f"<div>{snippet}</div>"
         f"</div>",
         unsafe_allow_html=True,
     )
@@ -1,8 +1,15 @@
 
+import os
+import time
 import uuid
-import streamlit as st
+from functools import lru_cache
+from typing import Dict, List
+
+# streamlit is imported inside the functions that need it, so service.py (and
+# through it api.py) can use the file helpers without loading it
 
 def get_session_id() -> str:
+    import streamlit as st
     if "session_id" not in st.session_state:
         st.session_state.session_id = str(uuid.uuid4())
     return st.session_state.session_id
@@ -10,9 +17,22 @@ def get_session_id() -> str:
 def badge(text: str):
     return f'<span class="badge">{text}</span>'
 
-def inject_css():
-    st.markdown(
-        """
+@lru_cache(maxsize=32)
+def _read_file(path: str, mtime_ns: int) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def read_cached(path: str) -> bytes:
+    """File contents, read once per process and again only when the file's mtime changes."""
+    return _read_file(path, os.stat(path).st_mtime_ns)
+
+def read_text_cached(path: str) -> str:
+    return read_cached(path).decode("utf-8")
+
+def minify_css(css: str) -> str:
+    return " ".join(css.split())
+
+BASE_CSS = """
         <style>
            
             .main .block-container { max-width: 900px; }
@@ -56,6 +76,29 @@ def inject_css():
             }
             .small { font-size: 12px; opacity: 0.7; }
         </style>
-        """,
-        unsafe_allow_html=True,
-    )
+"""
+
+class RerunTimer:
+    """Server-side time of one script run, split into named phases (milliseconds)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.phases: Dict[str, float] = {}
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases[phase] = (now - self._last) * 1000
+        self._last = now
+
+    @property
+    def total_ms(self) -> float:
+        return (self._last - self.started) * 1000
+
+    def record(self, keep: int = 50) -> List[float]:
+        """Append this run's total to the session's recent totals and return them."""
+        import streamlit as st
+        recent = st.session_state.setdefault("rerun_ms", [])
+        recent.append(self.total_ms)
+        del recent[:-keep]
+        return recent